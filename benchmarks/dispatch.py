@@ -0,0 +1,179 @@
+"""
+Kernel-free microbenchmarks of the FUSE3 dispatch layer.
+
+The fuse_operations table is built with FUSE3.prepare(), without mounting,
+after which the installed C function pointers are called directly with
+synthetic c_stat, fuse_file_info and buffers. This measures the overhead of
+the ctypes callbacks and the FUSE3 trampoline without requiring /dev/fuse.
+
+Usage:
+
+    python -m benchmarks.dispatch [--iterations N] [--json] [name ...]
+
+Set FUSE3_LIBFUSE_STUB=1 to run on machines without libfuse3.
+"""
+
+import argparse
+import ctypes
+import errno
+import json
+import time
+from stat import S_IFDIR, S_IFREG
+
+from fuse3 import FUSE3, FuseOSError, Operations
+from fuse3.c_fuse import c_byte_p, c_stat, fuse_file_info, fuse_operations
+
+
+class BenchOperations(Operations):
+    "Static filesystem with one large file and one directory of names."
+
+    use_ns = True
+
+    def __init__(self, size=1 << 20, entries=128):
+        self.data = bytes(size)
+        self.names = ["file%d" % i for i in range(entries)]
+        self.dir_attrs = dict(st_mode=(S_IFDIR | 0o755), st_nlink=2)
+        self.file_attrs = dict(
+            st_mode=(S_IFREG | 0o644),
+            st_nlink=1,
+            st_size=size,
+            st_atime=0,
+            st_mtime=0,
+            st_ctime=0,
+        )
+
+    def getattr(self, path, fh=None):
+        if path == "/":
+            return self.dir_attrs
+        if path == "/file":
+            return self.file_attrs
+        raise FuseOSError(errno.ENOENT)
+
+    def open(self, path, flags):
+        return 1
+
+    def read(self, path, size, offset, fh):
+        return self.data[offset : offset + size]
+
+    def write(self, path, data, offset, fh):
+        return len(data)
+
+    def readdir(self, path, fh, flags):
+        return [".", ".."] + self.names
+
+
+def _file_info(fh=1):
+    return ctypes.pointer(fuse_file_info(fh=fh))
+
+
+def bench_getattr(fuse_ops):
+    getattr_ = fuse_ops.getattr
+    stp = ctypes.pointer(c_stat())
+    return lambda: getattr_(b"/file", stp, None), 0
+
+
+def bench_getattr_enoent(fuse_ops):
+    getattr_ = fuse_ops.getattr
+    stp = ctypes.pointer(c_stat())
+    return lambda: getattr_(b"/missing", stp, None), -errno.ENOENT
+
+
+def _bench_read(size):
+    def bench(fuse_ops):
+        read = fuse_ops.read
+        buf = ctypes.cast(ctypes.create_string_buffer(size), c_byte_p)
+        fip = _file_info()
+        return lambda: read(b"/file", buf, size, 0, fip), size
+
+    return bench
+
+
+def _bench_write(size):
+    def bench(fuse_ops):
+        write = fuse_ops.write
+        buf = ctypes.cast(ctypes.create_string_buffer(size), c_byte_p)
+        fip = _file_info()
+        return lambda: write(b"/file", buf, size, 0, fip), size
+
+    return bench
+
+
+def bench_readdir(fuse_ops):
+    readdir = fuse_ops.readdir
+    filler_t = dict(fuse_operations._fields_)["readdir"]._argtypes_[2]
+    filler = filler_t(lambda buf, name, st, offset, flags: 0)
+    fip = _file_info()
+    return lambda: readdir(b"/", None, filler, 0, fip, 0), 0
+
+
+BENCHMARKS = {
+    "getattr": bench_getattr,
+    "getattr_enoent": bench_getattr_enoent,
+    "read_4k": _bench_read(4096),
+    "read_128k": _bench_read(128 * 1024),
+    "write_4k": _bench_write(4096),
+    "write_128k": _bench_write(128 * 1024),
+    "readdir_128": bench_readdir,
+}
+
+
+def run(names=None, iterations=20000, repeat=3, operations=None):
+    """
+    Runs the selected benchmarks, returning a list of result dictionaries.
+
+    Every benchmark is timed repeat times and the fastest run is reported.
+    """
+
+    fuse_ops = FUSE3.prepare(operations or BenchOperations(), "/mnt").fuse_ops
+
+    results = []
+    for name in names or BENCHMARKS:
+        call, expected = BENCHMARKS[name](fuse_ops)
+        ret = call()
+        if ret != expected:
+            raise AssertionError("%s returned %r, expected %r" % (name, ret, expected))
+
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            for _ in range(iterations):
+                call()
+            elapsed = time.perf_counter_ns() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        ns_per_op = best / iterations
+        results.append(
+            {
+                "name": name,
+                "iterations": iterations,
+                "ns_per_op": ns_per_op,
+                "ops_per_sec": 1e9 / ns_per_op if ns_per_op else float("inf"),
+            }
+        )
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("names", nargs="*", metavar="name", help="one of: %s" % ", ".join(BENCHMARKS))
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmark(s): %s" % ", ".join(sorted(unknown)))
+
+    results = run(args.names, iterations=args.iterations, repeat=args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for result in results:
+        print("%-16s %10.0f ns/op %12.0f ops/s" % (result["name"], result["ns_per_op"], result["ops_per_sec"]))
+
+
+if __name__ == "__main__":
+    main()
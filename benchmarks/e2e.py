@@ -0,0 +1,418 @@
+"""
+End-to-end I/O benchmarks against a mounted filesystem.
+
+The Operations class is mounted with FUSE3 in a subprocess, after which
+reproducible workloads are run against the mountpoint using plain Python I/O
+from one or more threads. Results are printed (or written) as JSON so they
+can be compared across commits.
+
+Usage:
+
+    python -m benchmarks.e2e memory --threads 4 --output memory.json
+    python -m benchmarks.e2e loopback
+    python -m benchmarks.e2e mypackage.module:MyOperations --arg /some/root
+
+Mount options are passed to FUSE3 with --option, e.g. to measure how
+concurrent writers to one file scale with parallel direct writes:
+
+    python -m benchmarks.e2e contrib-loopback --workload shared_write --threads 8 \
+        --option direct_io --option parallel_direct_writes
+
+When /dev/fuse, libfuse3 or fusermount3 is unavailable the run is skipped and
+the JSON output contains the reason.
+"""
+
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES = os.path.join(os.path.dirname(HERE), "legacy", "examples")
+
+FILESYSTEMS = {
+    "memfs": ("fuse3.contrib.memfs:MemoryFS", False),
+    "contrib-loopback": ("fuse3.contrib.loopback:Loopback", True),
+    "memory": (os.path.join(EXAMPLES, "memory.py") + ":Memory", False),
+    "loopback": (os.path.join(EXAMPLES, "loopback.py") + ":Loopback", True),
+}
+"""Bundled filesystems as (spec, needs a backing directory argument)."""
+
+
+class Params:
+    "Workload parameters, every workload is deterministic given the seed."
+
+    def __init__(
+        self, threads=1, file_size=64 << 20, block_size=128 << 10, io_count=2048, files=1000, entries=10000, seed=0
+    ):
+        self.threads = threads
+        self.file_size = file_size
+        self.block_size = block_size
+        self.io_count = io_count
+        self.files = files
+        self.entries = entries
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def _data_file(root, index):
+    return os.path.join(root, "data-%d" % index)
+
+
+def _run_threads(params, func):
+    "Runs func(index) on params.threads threads, returning (wall time, summed results)"
+
+    barrier = threading.Barrier(params.threads + 1)
+    results = [None] * params.threads
+    errors = []
+
+    def worker(index):
+        barrier.wait()
+        try:
+            results[index] = func(index)
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(params.threads)]
+    for thread in threads:
+        thread.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    if errors:
+        raise errors[0]
+
+    ops = sum(result[0] for result in results)
+    nbytes = sum(result[1] for result in results)
+    return elapsed, ops, nbytes
+
+
+def seq_write(root, params):
+    block = os.urandom(params.block_size)
+
+    def run(index):
+        ops = 0
+        with open(_data_file(root, index), "wb", buffering=0) as fh:
+            for _ in range(0, params.file_size, params.block_size):
+                fh.write(block)
+                ops += 1
+        return ops, ops * params.block_size
+
+    return _run_threads(params, run)
+
+
+def seq_read(root, params):
+    def run(index):
+        ops = nbytes = 0
+        with open(_data_file(root, index), "rb", buffering=0) as fh:
+            while True:
+                data = fh.read(params.block_size)
+                if not data:
+                    break
+                ops += 1
+                nbytes += len(data)
+        return ops, nbytes
+
+    return _run_threads(params, run)
+
+
+def _random_io(root, params, write):
+    size = 4096
+    blocks = params.file_size // size
+    data = os.urandom(size)
+
+    def run(index):
+        rng = random.Random(params.seed + index)
+        fd = os.open(_data_file(root, index), os.O_RDWR if write else os.O_RDONLY)
+        try:
+            for _ in range(params.io_count):
+                offset = rng.randrange(blocks) * size
+                if write:
+                    os.pwrite(fd, data, offset)
+                else:
+                    os.pread(fd, size, offset)
+        finally:
+            os.close(fd)
+        return params.io_count, params.io_count * size
+
+    return _run_threads(params, run)
+
+
+def rand_read_4k(root, params):
+    return _random_io(root, params, write=False)
+
+
+def rand_write_4k(root, params):
+    return _random_io(root, params, write=True)
+
+
+def shared_write(root, params):
+    """
+    Concurrent block_size pwrite()s to one preallocated file, thread i writes
+    the blocks i, i + threads, ... so no writes overlap or extend the file
+    """
+
+    path = os.path.join(root, "shared")
+    blocks = params.file_size // params.block_size
+    with open(path, "wb") as fh:
+        fh.truncate(blocks * params.block_size)
+    block = os.urandom(params.block_size)
+
+    def run(index):
+        rng = random.Random(params.seed + index)
+        own = range(index, blocks, params.threads)
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            for _ in range(params.io_count):
+                os.pwrite(fd, block, rng.choice(own) * params.block_size)
+        finally:
+            os.close(fd)
+        return params.io_count, params.io_count * params.block_size
+
+    return _run_threads(params, run)
+
+
+def metadata(root, params):
+    "create, stat and unlink files, counting every syscall as one op"
+
+    def run(index):
+        directory = os.path.join(root, "meta-%d" % index)
+        os.mkdir(directory)
+        names = [os.path.join(directory, "f%d" % i) for i in range(params.files)]
+        for name in names:
+            os.close(os.open(name, os.O_CREAT | os.O_WRONLY, 0o644))
+        for name in names:
+            os.stat(name)
+        for name in names:
+            os.unlink(name)
+        os.rmdir(directory)
+        return 3 * params.files, 0
+
+    return _run_threads(params, run)
+
+
+def readdir(root, params):
+    directory = os.path.join(root, "readdir")
+    if not os.path.isdir(directory):
+        os.mkdir(directory)
+        for i in range(params.entries):
+            os.close(os.open(os.path.join(directory, "entry-%d" % i), os.O_CREAT | os.O_WRONLY, 0o644))
+
+    def run(index):
+        count = 0
+        for _ in range(5):
+            with os.scandir(directory) as it:
+                count += sum(1 for _ in it)
+        return count, 0
+
+    return _run_threads(params, run)
+
+
+WORKLOADS = {
+    "seq_write": seq_write,
+    "seq_read": seq_read,
+    "rand_read_4k": rand_read_4k,
+    "rand_write_4k": rand_write_4k,
+    "shared_write": shared_write,
+    "metadata": metadata,
+    "readdir": readdir,
+}
+"""Workloads in the order they are run, seq_write creates the data files."""
+
+
+def run_workloads(root, params, names=None):
+    "Runs the workloads against the directory root, returning a list of result dictionaries"
+
+    results = []
+    for name in names or WORKLOADS:
+        if name in ("seq_read", "rand_read_4k", "rand_write_4k") and not os.path.exists(_data_file(root, 0)):
+            seq_write(root, params)
+
+        elapsed, ops, nbytes = WORKLOADS[name](root, params)
+        results.append(
+            {
+                "name": name,
+                "seconds": elapsed,
+                "ops": ops,
+                "bytes": nbytes,
+                "ops_per_sec": ops / elapsed if elapsed else None,
+                "mib_per_sec": nbytes / elapsed / (1 << 20) if elapsed and nbytes else None,
+            }
+        )
+    return results
+
+
+def load_operations(spec):
+    "Loads an Operations class from module:Class or path/to/file.py:Class"
+
+    target, _, name = spec.rpartition(":")
+    if target.endswith(".py"):
+        module_name = os.path.splitext(os.path.basename(target))[0]
+        module_spec = importlib.util.spec_from_file_location(module_name, target)
+        module = importlib.util.module_from_spec(module_spec)
+        module_spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(target)
+    return getattr(module, name)
+
+
+def unavailable_reason():
+    "Returns why filesystems cannot be mounted here, or None"
+
+    if not os.path.exists("/dev/fuse") or not os.access("/dev/fuse", os.R_OK | os.W_OK):
+        return "/dev/fuse is not available"
+    if not shutil.which("fusermount3"):
+        return "fusermount3 is not installed"
+    if os.environ.get("FUSE3_LIBFUSE_STUB") == "1":
+        return "the libfuse stub cannot mount filesystems"
+    try:
+        import fuse3  # noqa: F401
+    except OSError as e:
+        return str(e)
+    return None
+
+
+def parse_options(options):
+    "Turns NAME and NAME=VALUE strings into FUSE3 keyword arguments"
+
+    kwargs = {}
+    for option in options:
+        name, sep, value = option.partition("=")
+        kwargs[name] = value if sep else True
+    return kwargs
+
+
+def serve(spec, mountpoint, args, options=()):
+    "Entry point of the mount subprocess"
+
+    from fuse3 import FUSE3
+
+    operations = load_operations(spec)(*args)
+    FUSE3(operations, mountpoint, foreground=True, **parse_options(options))
+
+
+class Mount:
+    "Mounts an Operations class in a subprocess for the duration of a with block"
+
+    def __init__(self, spec, args=(), options=(), timeout=10):
+        self.spec = spec
+        self.args = list(args)
+        self.options = list(options)
+        self.timeout = timeout
+        self.mountpoint = None
+        self.process = None
+
+    def __enter__(self):
+        self.mountpoint = tempfile.mkdtemp(prefix="fuse3-bench-")
+        cmd = [sys.executable, "-m", "benchmarks.e2e", "--serve", self.spec, self.mountpoint] + self.args
+        for option in self.options:
+            cmd.append("--option=" + option)
+        self.process = subprocess.Popen(cmd, cwd=os.path.dirname(HERE))
+
+        deadline = time.monotonic() + self.timeout
+        while not os.path.ismount(self.mountpoint):
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                self.__exit__(None, None, None)
+                raise RuntimeError("Mounting %s failed" % self.spec)
+            time.sleep(0.05)
+        return self.mountpoint
+
+    def __exit__(self, *exc_info):
+        if os.path.ismount(self.mountpoint):
+            subprocess.call(["fusermount3", "-u", self.mountpoint])
+        try:
+            self.process.wait(self.timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        os.rmdir(self.mountpoint)
+
+
+def _git_revision():
+    try:
+        return (
+            subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("filesystem", help="one of %s, or module:Class" % ", ".join(FILESYSTEMS))
+    parser.add_argument("--arg", dest="args", action="append", default=[], help="argument for the Operations class")
+    parser.add_argument(
+        "--option", dest="options", action="append", default=[], help="FUSE3 mount option, NAME or NAME=VALUE"
+    )
+    parser.add_argument("--workload", dest="workloads", action="append", choices=list(WORKLOADS))
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--file-size", type=int, default=Params().file_size)
+    parser.add_argument("--block-size", type=int, default=Params().block_size)
+    parser.add_argument("--io-count", type=int, default=Params().io_count)
+    parser.add_argument("--files", type=int, default=Params().files)
+    parser.add_argument("--entries", type=int, default=Params().entries)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args, rest = parser.parse_known_args()
+
+    if args.serve:
+        # --serve spec mountpoint [args...]
+        serve(args.filesystem, rest[0], rest[1:], args.options)
+        return
+
+    spec, needs_root = FILESYSTEMS.get(args.filesystem, (args.filesystem, False))
+    params = Params(
+        threads=args.threads,
+        file_size=args.file_size,
+        block_size=args.block_size,
+        io_count=args.io_count,
+        files=args.files,
+        entries=args.entries,
+        seed=args.seed,
+    )
+    report = {
+        "filesystem": args.filesystem,
+        "revision": _git_revision(),
+        "python": platform.python_implementation() + " " + platform.python_version(),
+        "params": params.as_dict(),
+        "options": parse_options(args.options),
+    }
+
+    reason = unavailable_reason()
+    if reason:
+        report["skipped"] = reason
+    else:
+        backing = tempfile.mkdtemp(prefix="fuse3-backing-") if needs_root else None
+        try:
+            with Mount(spec, ([backing] if backing else []) + args.args, args.options) as mountpoint:
+                report["results"] = run_workloads(mountpoint, params, args.workloads)
+        finally:
+            if backing:
+                shutil.rmtree(backing)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
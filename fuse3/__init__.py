@@ -1,8 +1,13 @@
-from fuse3.fuse import FUSE3, FuseOSError, LoggingMixIn, Operations
+from fuse3.fuse import FUSE3, FuseOSError, LoggingMixIn, OpenResult, Operations
+from fuse3.request import Request, current_request, is_interrupted
 
 __all__ = (
     "FUSE3",
     "FuseOSError",
     "LoggingMixIn",
+    "OpenResult",
     "Operations",
+    "Request",
+    "current_request",
+    "is_interrupted",
 )
@@ -0,0 +1,299 @@
+import collections
+import errno
+import heapq
+import itertools
+import operator
+import threading
+import time
+
+DATA_OPERATIONS = frozenset(
+    ("read", "write", "read_buf", "write_buf", "fallocate", "copy_file_range", "flush", "fsync")
+)
+"""Operations admitted in the data class, all others are metadata."""
+
+UNLIMITED_OPERATIONS = frozenset(("init", "destroy", "release", "releasedir"))
+"""Operations that are always admitted: failing them would leak resources."""
+
+
+class _Class:
+    "Admission state of a class of operations"
+
+    __slots__ = ("name", "limit", "in_flight", "waiters", "admitted", "rejected")
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self.waiters = collections.deque()
+        self.admitted = 0
+        self.rejected = 0
+
+
+class _Waiter:
+    __slots__ = ("request", "event", "since", "tag")
+
+    def __init__(self, request):
+        self.request = request
+        self.event = threading.Event()
+        self.since = time.monotonic_ns()
+        self.tag = None
+
+
+class AdmissionController:
+    """
+    Bounds the number of operations in flight, separately for metadata and
+    data operations (see DATA_OPERATIONS), None leaving a class unbounded.
+
+    Requests beyond the bound wait for a free slot, first come first served.
+    Once max_queue requests of a class are waiting, or a request waited for
+    queue_timeout seconds, requests fail with error (EAGAIN by default).
+    stats() reports the queue depth and counters of each class.
+    """
+
+    def __init__(self, metadata=None, data=None, max_queue=None, queue_timeout=None, error=errno.EAGAIN):
+        self.classes = {"metadata": _Class("metadata", metadata), "data": _Class("data", data)}
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.error = error
+        self._lock = threading.Lock()
+
+    def classify(self, op):
+        "Returns the class of operation op, None for unlimited operations"
+
+        if op in UNLIMITED_OPERATIONS:
+            return None
+        return self.classes["data" if op in DATA_OPERATIONS else "metadata"]
+
+    def call(self, request, func, *args):
+        "Calls func(*args) once request is admitted, returns -error if it is not"
+
+        cls = self.classify(request.op)
+        if cls is None or cls.limit is None:
+            return func(*args)
+        if not self._acquire(cls, request):
+            return -self.error
+        try:
+            return func(*args)
+        finally:
+            self._release(cls, request)
+
+    def _acquire(self, cls, request):
+        with self._lock:
+            # Slots are handed to waiters directly, so while requests are
+            # waiting in_flight stays at the limit
+            if cls.in_flight < cls.limit:
+                cls.in_flight += 1
+                self._admit(cls, request)
+                return True
+            if self._queue_full(cls, request):
+                self._reject(cls, request)
+                return False
+            waiter = _Waiter(request)
+            self._enqueue(cls, waiter)
+
+        if waiter.event.wait(self.queue_timeout):
+            return True
+        with self._lock:
+            if waiter.event.is_set():
+                return True
+            self._remove(cls, waiter)
+            self._reject(cls, request)
+            return False
+
+    def _release(self, cls, request):
+        with self._lock:
+            self._finish(cls, request)
+            waiter = self._dequeue(cls)
+            if waiter is None:
+                cls.in_flight -= 1
+            else:
+                self._admit(cls, waiter.request, waiter)
+                waiter.event.set()
+
+    # Hooks for schedulers, called with the lock held
+
+    def _admit(self, cls, request, waiter=None):
+        "Called when request gets a slot, waiter is set if it had to wait"
+
+        cls.admitted += 1
+
+    def _reject(self, cls, request):
+        cls.rejected += 1
+
+    def _finish(self, cls, request):
+        "Called when the admitted request completed"
+
+    def _queue_full(self, cls, request):
+        return self.max_queue is not None and self._queued(cls) >= self.max_queue
+
+    def _enqueue(self, cls, waiter):
+        cls.waiters.append(waiter)
+
+    def _dequeue(self, cls):
+        "Returns the waiter to hand a freed slot of cls to, or None"
+
+        return cls.waiters.popleft() if cls.waiters else None
+
+    def _remove(self, cls, waiter):
+        cls.waiters.remove(waiter)
+
+    def _queued(self, cls):
+        return len(cls.waiters)
+
+    @property
+    def queue_depth(self):
+        "The number of requests waiting for a slot"
+
+        with self._lock:
+            return sum(self._queued(cls) for cls in self.classes.values())
+
+    def stats(self):
+        "Returns {class: {limit, in_flight, queued, admitted, rejected}}"
+
+        with self._lock:
+            return {
+                name: dict(
+                    limit=cls.limit,
+                    in_flight=cls.in_flight,
+                    queued=self._queued(cls),
+                    admitted=cls.admitted,
+                    rejected=cls.rejected,
+                )
+                for name, cls in self.classes.items()
+            }
+
+
+class _Tenant:
+    "Scheduling state and counters of a tenant"
+
+    __slots__ = ("key", "weight", "finish", "in_flight", "queued", "admitted", "rejected", "wait_ns")
+
+    def __init__(self, key, weight):
+        self.key = key
+        self.weight = weight
+        self.finish = 0.0
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_ns = 0
+
+
+class FairScheduler(AdmissionController):
+    """
+    Shares limit operation slots between tenants with weighted fair queuing.
+
+    key maps a Request to its tenant: "uid" (the default), "gid", "pid" or
+    a function, e.g. one grouping processes by cgroup, which is called with
+    the scheduler lock held and should be cheap. Once all slots are taken,
+    waiting tenants are served in proportion to their weight (weights maps
+    tenants to weights, default_weight applies to the others) however many
+    requests each of them queued, and waiting metadata operations are
+    served before data operations, so one user's bulk copy does not hold up
+    everyone's ls. max_queue applies per tenant. tenant_stats() reports the
+    counters of each tenant. Tenants are forgotten, counters included, once
+    they have no requests in flight or queued.
+    """
+
+    def __init__(
+        self,
+        limit,
+        key="uid",
+        weights=None,
+        default_weight=1,
+        max_queue=None,
+        queue_timeout=None,
+        error=errno.EAGAIN,
+    ):
+        super().__init__(max_queue=max_queue, queue_timeout=queue_timeout, error=error)
+        self.classes = {"all": _Class("all", limit)}
+        self.key = key if callable(key) else operator.attrgetter(key)
+        self.weights = dict(weights or {})
+        self.default_weight = default_weight
+        self.tenants = {}
+        self._requests = {}
+        # Waiting metadata and data operations, ordered by virtual finish time
+        self._heaps = ([], [])
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+
+    def classify(self, op):
+        if op in UNLIMITED_OPERATIONS:
+            return None
+        return self.classes["all"]
+
+    def _tenant(self, request):
+        tenant = self._requests.get(request.id)
+        if tenant is None:
+            key = self.key(request)
+            tenant = self.tenants.get(key)
+            if tenant is None:
+                tenant = self.tenants[key] = _Tenant(key, self.weights.get(key, self.default_weight))
+            self._requests[request.id] = tenant
+        return tenant
+
+    def _admit(self, cls, request, waiter=None):
+        super()._admit(cls, request, waiter)
+        tenant = self._tenant(request)
+        tenant.in_flight += 1
+        tenant.admitted += 1
+        if waiter is not None:
+            tenant.wait_ns += time.monotonic_ns() - waiter.since
+
+    def _forget_idle(self, tenant):
+        # An idle tenant's finish tag is behind the virtual time, so it has
+        # no scheduling state worth keeping
+        if not tenant.in_flight and not tenant.queued:
+            del self.tenants[tenant.key]
+
+    def _reject(self, cls, request):
+        super()._reject(cls, request)
+        tenant = self._tenant(request)
+        del self._requests[request.id]
+        tenant.rejected += 1
+        self._forget_idle(tenant)
+
+    def _finish(self, cls, request):
+        tenant = self._requests.pop(request.id)
+        tenant.in_flight -= 1
+        self._forget_idle(tenant)
+
+    def _queue_full(self, cls, request):
+        return self.max_queue is not None and self._tenant(request).queued >= self.max_queue
+
+    def _enqueue(self, cls, waiter):
+        # Self-clocked fair queuing: a tenant's requests are tagged with
+        # increasing virtual finish times, starting at the tag of the request
+        # served last when the tenant was idle
+        tenant = self._tenant(waiter.request)
+        waiter.tag = tenant.finish = max(self._virtual_time, tenant.finish) + 1 / tenant.weight
+        tenant.queued += 1
+        heap = self._heaps[waiter.request.op in DATA_OPERATIONS]
+        heapq.heappush(heap, (waiter.tag, next(self._seq), waiter))
+
+    def _dequeue(self, cls):
+        for heap in self._heaps:
+            if heap:
+                tag, _, waiter = heapq.heappop(heap)
+                self._virtual_time = tag
+                self._tenant(waiter.request).queued -= 1
+                return waiter
+        return None
+
+    def _remove(self, cls, waiter):
+        heap = self._heaps[waiter.request.op in DATA_OPERATIONS]
+        heap[:] = [entry for entry in heap if entry[2] is not waiter]
+        heapq.heapify(heap)
+        self._tenant(waiter.request).queued -= 1
+
+    def _queued(self, cls):
+        return sum(len(heap) for heap in self._heaps)
+
+    def tenant_stats(self):
+        "Returns {tenant: {weight, in_flight, queued, admitted, rejected, wait_ns}}"
+
+        with self._lock:
+            return {
+                key: {name: getattr(tenant, name) for name in _Tenant.__slots__ if name not in ("key", "finish")}
+                for key, tenant in self.tenants.items()
+            }
@@ -424,6 +424,7 @@ class fuse_context(ctypes.Structure):
 
 
 libfuse.fuse_get_context.restype = ctypes.POINTER(fuse_context)
+libfuse.fuse_interrupted.restype = ctypes.c_int
 
 
 class fuse_buf(ctypes.Structure):
@@ -449,6 +450,40 @@ fuse_bufvec_p = ctypes.POINTER(fuse_bufvec)
 fuse_bufvec_pp = ctypes.POINTER(fuse_bufvec_p)
 
 
+# Special tv_nsec values of utimensat(2)
+if _system in ("Darwin", "Darwin-MacFuse", "FreeBSD"):
+    UTIME_NOW = -1
+    UTIME_OMIT = -2
+else:
+    UTIME_NOW = (1 << 30) - 1
+    UTIME_OMIT = (1 << 30) - 2
+
+
+# fuse_conn_info capable/want flags, see fuse_common.h
+FUSE_CAP_ASYNC_READ = 1 << 0
+FUSE_CAP_POSIX_LOCKS = 1 << 1
+FUSE_CAP_ATOMIC_O_TRUNC = 1 << 3
+FUSE_CAP_EXPORT_SUPPORT = 1 << 4
+FUSE_CAP_DONT_MASK = 1 << 6
+FUSE_CAP_SPLICE_WRITE = 1 << 7
+FUSE_CAP_SPLICE_MOVE = 1 << 8
+FUSE_CAP_SPLICE_READ = 1 << 9
+FUSE_CAP_FLOCK_LOCKS = 1 << 10
+FUSE_CAP_IOCTL_DIR = 1 << 11
+FUSE_CAP_AUTO_INVAL_DATA = 1 << 12
+FUSE_CAP_READDIRPLUS = 1 << 13
+FUSE_CAP_READDIRPLUS_AUTO = 1 << 14
+FUSE_CAP_ASYNC_DIO = 1 << 15
+FUSE_CAP_WRITEBACK_CACHE = 1 << 16
+FUSE_CAP_NO_OPEN_SUPPORT = 1 << 17
+FUSE_CAP_PARALLEL_DIROPS = 1 << 18
+FUSE_CAP_POSIX_ACL = 1 << 19
+FUSE_CAP_HANDLE_KILLPRIV = 1 << 20
+FUSE_CAP_CACHE_SYMLINKS = 1 << 23
+FUSE_CAP_NO_OPENDIR_SUPPORT = 1 << 24
+FUSE_CAP_EXPLICIT_INVAL_DATA = 1 << 25
+
+
 class fuse_conn_info(ctypes.Structure):
     """
     Documentation of structure:
@@ -577,6 +612,7 @@ class fuse_operations(ctypes.Structure):
                 ctypes.c_int,
                 ctypes.c_char_p,
                 ctypes.c_char_p,
+                ctypes.c_uint,
             ),
         ),
         (
@@ -773,24 +809,6 @@ class fuse_operations(ctypes.Structure):
                 fuse_file_info_p,
             ),
         ),
-        (
-            "ftruncate",
-            ctypes.CFUNCTYPE(
-                ctypes.c_int,
-                ctypes.c_char_p,
-                c_off_t,
-                fuse_file_info_p,
-            ),
-        ),
-        (
-            "fgetattr",
-            ctypes.CFUNCTYPE(
-                ctypes.c_int,
-                ctypes.c_char_p,
-                c_stat_p,
-                fuse_file_info_p,
-            ),
-        ),
         (
             "lock",
             ctypes.CFUNCTYPE(
@@ -806,7 +824,7 @@ class fuse_operations(ctypes.Structure):
             ctypes.CFUNCTYPE(
                 ctypes.c_int,
                 ctypes.c_char_p,
-                c_utimbuf,
+                ctypes.POINTER(c_utimbuf),
                 fuse_file_info_p,
             ),
         ),
@@ -921,6 +939,12 @@ def get_fuse_context():
     return libfuse.fuse_get_context()
 
 
+def fuse_interrupted():
+    "Whether the request handled by the calling thread was interrupted"
+
+    return bool(libfuse.fuse_interrupted())
+
+
 def fuse_exit():
     """
     This will shutdown the FUSE mount and cause the call to FUSE(...) to
@@ -0,0 +1,544 @@
+"""
+Userspace block cache for slow (network) backends.
+
+BlockCacheMixIn serves read() from fixed-size, aligned blocks kept in a
+bounded LRU, optionally backed by a second LRU tier in an mmap'ed file on
+local disk, and reads ahead of sequential readers in the background:
+
+    class CachedSFTP(BlockCacheMixIn, SFTP):
+        block_size = 256 * 1024
+        cache_size = 256 * 1024 * 1024
+        spill_dir = "/var/cache/sftp"
+
+Blocks are keyed by the st_ino of files, or by path for backends that do not
+report inode numbers, and file handles keep the key of the file they opened.
+Writes, copies, truncates, renames and unlinks through the mount drop the
+affected blocks, and open() drops the blocks of a file whose size or mtime
+changed since they were cached (close-to-open consistency).
+"""
+
+import errno
+import itertools
+import mmap
+import os
+import tempfile
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from fuse3.request import current_request
+
+
+class _LRU:
+    "Blocks keyed by (file key, index), evicted least recently used first"
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.size = 0
+        self.blocks = OrderedDict()
+        self.index = defaultdict(set)
+
+    def get(self, key):
+        block = self.blocks.get(key)
+        if block is not None:
+            self.blocks.move_to_end(key)
+        return block
+
+    def _length(self, block):
+        return len(block)
+
+    def put(self, key, block):
+        "Stores block, returning the evicted (key, block) pairs"
+
+        self.pop(key)
+        self.blocks[key] = block
+        self.index[key[0]].add(key[1])
+        self.size += self._length(block)
+
+        evicted = []
+        while self.size > self.capacity:
+            evicted.append(self._evict())
+        return evicted
+
+    def _evict(self):
+        key, block = self.blocks.popitem(last=False)
+        self._unindex(key, block)
+        return key, block
+
+    def _unindex(self, key, block):
+        self.size -= self._length(block)
+        indices = self.index[key[0]]
+        indices.discard(key[1])
+        if not indices:
+            del self.index[key[0]]
+
+    def pop(self, key):
+        block = self.blocks.pop(key, None)
+        if block is not None:
+            self._unindex(key, block)
+        return block
+
+    def invalidate(self, path, first=0, last=None):
+        "Drops the blocks first..last (inclusive) of path"
+
+        for index in list(self.index.get(path, ())):
+            if index >= first and (last is None or index <= last):
+                self.pop((path, index))
+
+
+class _SpillLRU(_LRU):
+    """
+    Second cache tier storing blocks in fixed slots of an unlinked, mmap'ed
+    temporary file in directory.
+    """
+
+    def __init__(self, directory, capacity, block_size):
+        self.block_size = block_size
+        slots = max(1, capacity // block_size)
+        super().__init__(slots * block_size)
+        self.free = list(range(slots))
+        with tempfile.TemporaryFile(dir=directory) as f:
+            f.truncate(slots * block_size)
+            self.map = mmap.mmap(f.fileno(), slots * block_size)
+
+    def _length(self, slot):
+        return self.block_size
+
+    def get(self, key):
+        entry = super().get(key)
+        if entry is None:
+            return None
+        slot, length = entry
+        start = slot * self.block_size
+        return self.map[start : start + length]
+
+    def put(self, key, block):
+        self.pop(key)
+        evicted = [self._evict()] if not self.free else []
+        slot = self.free.pop()
+        start = slot * self.block_size
+        self.map[start : start + len(block)] = block
+        return evicted + super().put(key, (slot, len(block)))
+
+    def _unindex(self, key, entry):
+        super()._unindex(key, entry)
+        self.free.append(entry[0])
+
+    def close(self):
+        self.map.close()
+
+
+class BlockCache:
+    """
+    Thread-safe two-tier block cache with per-file generations, files being
+    keyed by path or st_ino.
+
+    The generation, version and end of file of a file are forgotten once
+    it has no cached blocks and is not open (see open_file()).
+    """
+
+    def __init__(self, block_size, capacity, spill_dir=None, spill_size=0):
+        self.block_size = block_size
+        self.memory = _LRU(capacity)
+        self.spill = _SpillLRU(spill_dir, spill_size, block_size) if spill_dir and spill_size else None
+        # Generations are stamps of a global counter, files without one are
+        # at the floor, which moves whenever a file is forgotten so fetches
+        # that started before do not store stale blocks
+        self.generations = {}
+        self._stamps = itertools.count(1)
+        self._floor = 0
+        self.opened = Counter()
+        self.versions = {}
+        # The index of the last, short, block of files, which is stale once
+        # the file is extended
+        self.eof = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, index):
+        key = (path, index)
+        with self.lock:
+            block = self.memory.get(key)
+            if block is None and self.spill is not None:
+                block = self.spill.get(key)
+                if block is not None:
+                    self.spill.pop(key)
+                    self._put(key, block)
+            if block is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return block
+
+    def _put(self, key, block):
+        evicted = self.memory.put(key, block)
+        if self.spill is not None:
+            evicted = [dropped for entry in evicted for dropped in self.spill.put(*entry)]
+        for (path, _), _ in evicted:
+            self._prune(path)
+
+    def _prune(self, path):
+        "Forgets path if it has no blocks and is not open, with the lock held"
+
+        if path in self.opened or path in self.memory.index or (self.spill is not None and path in self.spill.index):
+            return
+        if self.generations.pop(path, None) is not None:
+            self._floor = next(self._stamps)
+        self.versions.pop(path, None)
+        self.eof.pop(path, None)
+
+    def open_file(self, path):
+        "Keeps the state of path while it is open, until close_file()"
+
+        with self.lock:
+            self.opened[path] += 1
+            self.generations.setdefault(path, next(self._stamps))
+
+    def close_file(self, path):
+        with self.lock:
+            self.opened[path] -= 1
+            if not self.opened[path]:
+                del self.opened[path]
+                self._prune(path)
+
+    def put(self, path, index, block, generation):
+        "Stores block unless path was invalidated since generation"
+
+        with self.lock:
+            if self.generations.get(path, self._floor) == generation:
+                self._put((path, index), block)
+                if len(block) < self.block_size:
+                    self.eof[path] = index
+
+    def generation(self, path):
+        with self.lock:
+            return self.generations.get(path, self._floor)
+
+    def invalidate(self, path, first=0, last=None):
+        "Drops the blocks first..last (inclusive) of path, and its end of file block"
+
+        with self.lock:
+            self.generations[path] = next(self._stamps)
+            tiers = [self.memory] if self.spill is None else [self.memory, self.spill]
+            eof = self.eof.get(path)
+            for tier in tiers:
+                tier.invalidate(path, first, last)
+                if eof is not None and (last is None or eof <= last):
+                    tier.pop((path, eof))
+            if eof is not None and (last is None or eof <= last):
+                del self.eof[path]
+            if first == 0 and last is None:
+                self.versions.pop(path, None)
+            self._prune(path)
+
+    def validate(self, path, version):
+        "Drops all blocks of path if its version (e.g. size and mtime) changed"
+
+        with self.lock:
+            known = self.versions.get(path)
+            self.versions[path] = version
+        if known is not None and known != version:
+            self.invalidate(path)
+            with self.lock:
+                self.versions[path] = version
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+
+
+class _Stream:
+    "Access pattern and read-ahead state of a file handle"
+
+    __slots__ = ("key", "next_offset", "sequential", "readahead_until", "futures")
+
+    def __init__(self, key):
+        self.key = key
+        self.next_offset = 0
+        self.sequential = 0
+        self.readahead_until = 0
+        self.futures = []
+
+
+class BlockCacheMixIn:
+    """
+    Caches read() in aligned blocks of block_size bytes.
+
+    At most cache_size bytes are kept in memory, with spill_dir set evicted
+    blocks move to an mmap'ed file in that directory holding up to spill_size
+    bytes. After readahead_after sequential reads on a file handle, the next
+    readahead blocks are fetched by readahead_workers background threads. The
+    backend's read() must accept concurrent calls on the same file handle.
+
+    Reads and writes find the blocks of a file by its handle, not its path,
+    so nullpath_ok works as long as the backend hands out a distinct fh for
+    each open file.
+    """
+
+    block_size = 128 * 1024
+    cache_size = 64 * 1024 * 1024
+    spill_dir = None
+    spill_size = 1024 * 1024 * 1024
+    readahead = 8
+    readahead_after = 2
+    readahead_workers = 2
+    validate_on_open = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.block_cache = BlockCache(self.block_size, self.cache_size, self.spill_dir, self.spill_size)
+        self._streams = {}
+        # Whether the backend reports st_ino, None until the first getattr
+        self._inode_keys = None
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._readahead_executor = ThreadPoolExecutor(self.readahead_workers, thread_name_prefix="fuse-readahead")
+
+    def _attrs_key(self, path, attrs):
+        ino = attrs.get("st_ino")
+        if self._inode_keys is None:
+            self._inode_keys = bool(ino)
+        return ino or path
+
+    def _file_key(self, path, fh=None):
+        "Returns the cache key of the file open as fh, or else at path"
+
+        stream = self._streams.get(fh) if fh is not None else None
+        if stream is not None and stream.key is not None:
+            return stream.key
+        if path is None or self._inode_keys is False:
+            return path
+        try:
+            return self._attrs_key(path, self.getattr(path))
+        except OSError:
+            return path
+
+    def _detach(self, path):
+        "Gives handles of the file that was at path a key of their own"
+
+        detached = object()
+        for stream in list(self._streams.values()):
+            if stream.key == path:
+                self.block_cache.open_file(detached)
+                self.block_cache.close_file(path)
+                stream.key = detached
+
+    def _add_stream(self, fh, key):
+        stream = self._streams.get(fh)
+        if stream is None:
+            self.block_cache.open_file(key)
+            self._streams[fh] = _Stream(key)
+        elif stream.key != key:
+            # The backend hands out the same fh for different files, their
+            # key is looked up by path instead
+            if stream.key is not None:
+                self.block_cache.close_file(stream.key)
+            stream.key = None
+
+    def _fetch(self, key, path, first, count, fh):
+        """
+        Reads count blocks from first with a single backend read, caching and
+        returning them. Stops at the end of the file.
+        """
+
+        cache = self.block_cache
+        bs = self.block_size
+        generation = cache.generation(key)
+        data = super().read(path, count * bs, first * bs, fh)
+        view = memoryview(data)
+        blocks = []
+        for i in range(count):
+            block = bytes(view[i * bs : (i + 1) * bs])
+            cache.put(key, first + i, block, generation)
+            blocks.append(block)
+            if len(block) < bs:
+                break
+        return blocks
+
+    def _readahead(self, key, path, first, count, fh):
+        keys = [(key, index) for index in range(first, first + count)]
+        try:
+            self._fetch(key, path, first, count, fh)
+        except Exception:
+            pass
+        finally:
+            with self._pending_lock:
+                for k in keys:
+                    self._pending.pop(k, None)
+
+    def _schedule_readahead(self, key, path, stream, last, fh):
+        # Keep readahead blocks ahead of the reader, refilling the window
+        # once half of it has been consumed
+        if stream.readahead_until - (last + 1) > self.readahead // 2:
+            return
+
+        first = max(last + 1, stream.readahead_until)
+        count = self.readahead
+        eof = self.block_cache.eof.get(key)
+        if eof is not None and first > eof:
+            return
+        while count and self.block_cache.get(key, first) is not None:
+            first += 1
+            count -= 1
+        if count <= 0:
+            return
+
+        with self._pending_lock:
+            keys = [(key, index) for index in range(first, first + count)]
+            if any(k in self._pending for k in keys):
+                return
+            future = self._readahead_executor.submit(self._readahead, key, path, first, count, fh)
+            for k in keys:
+                self._pending.setdefault(k, future)
+        stream.futures = [f for f in stream.futures if not f.done()]
+        stream.futures.append(future)
+        stream.readahead_until = first + count
+
+    def read(self, path, size, offset, fh):
+        if size <= 0:
+            return b""
+
+        bs = self.block_size
+        first = offset // bs
+        last = (offset + size - 1) // bs
+        stream = self._streams.get(fh)
+        key = self._file_key(path, fh)
+
+        if stream is not None:
+            if offset == stream.next_offset:
+                stream.sequential += 1
+            else:
+                stream.sequential = 0
+                stream.readahead_until = 0
+            stream.next_offset = offset + size
+            if self.readahead and stream.sequential >= self.readahead_after:
+                self._schedule_readahead(key, path, stream, last, fh)
+
+        request = current_request()
+        blocks = []
+        index = first
+        while index <= last:
+            if request is not None and index > first:
+                # Do not keep fetching for a reader that went away
+                request.check_interrupted()
+
+            block = self.block_cache.get(key, index)
+            if block is None:
+                with self._pending_lock:
+                    future = self._pending.get((key, index))
+                if future is not None:
+                    future.result()
+                    block = self.block_cache.get(key, index)
+
+            if block is not None:
+                fetched = [block]
+            else:
+                # Fetch the whole run of missing blocks at once
+                end = index + 1
+                while end <= last and self.block_cache.get(key, end) is None:
+                    end += 1
+                fetched = self._fetch(key, path, index, end - index, fh)
+
+            blocks.extend(fetched)
+            index += len(fetched)
+            if len(fetched[-1]) < bs:
+                break
+
+        start = offset - first * bs
+        if len(blocks) == 1:
+            return memoryview(blocks[0])[start : start + size]
+        return b"".join(blocks)[start : start + size]
+
+    def _call_backend(self, op, *args):
+        # fallocate and copy_file_range are optional, ENOSYS makes the kernel
+        # fall back as if they were not implemented
+        method = getattr(super(), op, None)
+        if method is None:
+            raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+        return method(*args)
+
+    def _invalidate_range(self, key, offset, length):
+        if length > 0:
+            self.block_cache.invalidate(key, offset // self.block_size, (offset + length - 1) // self.block_size)
+
+    def write(self, path, data, offset, fh):
+        key = self._file_key(path, fh)
+        try:
+            return super().write(path, data, offset, fh)
+        finally:
+            self._invalidate_range(key, offset, len(data))
+
+    def copy_file_range(self, path_in, fh_in, off_in, path_out, fh_out, off_out, size, flags):
+        key = self._file_key(path_out, fh_out)
+        try:
+            return self._call_backend("copy_file_range", path_in, fh_in, off_in, path_out, fh_out, off_out, size, flags)
+        finally:
+            self._invalidate_range(key, off_out, size)
+
+    def truncate(self, path, length, fh=None):
+        key = self._file_key(path, fh)
+        try:
+            return super().truncate(path, length, fh)
+        finally:
+            self.block_cache.invalidate(key, length // self.block_size)
+
+    def fallocate(self, path, mode, offset, length, fh):
+        key = self._file_key(path, fh)
+        try:
+            return self._call_backend("fallocate", path, mode, offset, length, fh)
+        finally:
+            self.block_cache.invalidate(key, offset // self.block_size)
+
+    def unlink(self, path):
+        key = self._file_key(path)
+        try:
+            return super().unlink(path)
+        finally:
+            self.block_cache.invalidate(key)
+            self._detach(path)
+
+    def rename(self, old, new, flags):
+        keys = [self._file_key(old), self._file_key(new)]
+        try:
+            return super().rename(old, new, flags)
+        finally:
+            for key in keys:
+                self.block_cache.invalidate(key)
+            self._detach(old)
+            self._detach(new)
+
+    def open(self, path, flags):
+        ret = super().open(path, flags)
+        key = path
+        if self.validate_on_open or self._inode_keys is not False:
+            attrs = self.getattr(path)
+            key = self._attrs_key(path, attrs)
+            if self.validate_on_open:
+                self.block_cache.validate(key, (attrs.get("st_size"), attrs.get("st_mtime")))
+        self._add_stream(getattr(ret, "fh", ret), key)
+        return ret
+
+    def create(self, path, mode, fi=None):
+        ret = super().create(path, mode, fi)
+        key = self._file_key(path)
+        self.block_cache.invalidate(key)
+        self._add_stream(getattr(ret, "fh", ret), key)
+        return ret
+
+    def release(self, path, fh):
+        stream = self._streams.pop(fh, None)
+        if stream is not None:
+            # Wait for read-ahead still using the handle
+            for future in stream.futures:
+                future.result()
+            if stream.key is not None:
+                self.block_cache.close_file(stream.key)
+        return super().release(path, fh)
+
+    def destroy(self, path):
+        self._readahead_executor.shutdown(wait=True)
+        try:
+            return super().destroy(path)
+        finally:
+            self.block_cache.close()
@@ -0,0 +1,105 @@
+"""
+Server-side copies between backing file descriptors.
+
+Operations implementations backed by real files can delegate their
+copy_file_range to copy_file_range() below, so copies within the mount are
+reflinked or copied in the kernel and the data never passes through Python:
+
+    def copy_file_range(self, path_in, fh_in, off_in, path_out, fh_out, off_out, size, flags):
+        return copy.copy_file_range(fh_in, off_in, fh_out, off_out, size, flags)
+"""
+
+import errno
+import fcntl
+import os
+import struct
+
+FICLONERANGE = 0x4020940D
+"""_IOW(0x94, 13, struct file_clone_range)"""
+
+_file_clone_range = struct.Struct("qQQQ")
+
+# Errors meaning the copy can not be done this way, instead of having failed
+_UNSUPPORTED = frozenset(
+    (
+        errno.EINVAL,
+        errno.ENOSYS,
+        errno.ENOTTY,
+        errno.EOPNOTSUPP,
+        errno.EXDEV,
+        errno.ETXTBSY,
+    )
+)
+
+FALLBACK_CHUNK_SIZE = 1 << 20
+
+
+def clone_range(fd_in, off_in, fd_out, off_out, size):
+    """
+    Shares the extents of fd_in with fd_out (a reflink) using FICLONERANGE.
+
+    Raises OSError when the filesystem does not support cloning or the range
+    is not aligned to its block size.
+    """
+
+    fcntl.ioctl(fd_out, FICLONERANGE, _file_clone_range.pack(fd_in, off_in, size, off_out))
+
+
+def copy_file_range(fd_in, off_in, fd_out, off_out, size, flags=0, clone=True):
+    """
+    Copies size bytes from fd_in at off_in to fd_out at off_out, returning
+    the number of bytes copied, which is less than size at the end of fd_in.
+
+    The range is reflinked with FICLONERANGE when clone is True and the
+    filesystem supports it, then os.copy_file_range() is used, and pread and
+    pwrite only as a last resort. The file offsets are not changed.
+    Overlapping ranges of the same file fail with EINVAL, like
+    copy_file_range(2).
+    """
+
+    if flags:
+        raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+
+    # Never copy past the end of the source, the result is the same as for
+    # copy_file_range(2) in that case
+    st_in = os.fstat(fd_in)
+    size = max(0, min(size, st_in.st_size - off_in))
+    if not size:
+        return 0
+
+    # The chunked fallback would overwrite source data it has yet to copy
+    st_out = os.fstat(fd_out)
+    if (st_in.st_dev, st_in.st_ino) == (st_out.st_dev, st_out.st_ino) and abs(off_in - off_out) < size:
+        raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+
+    if clone:
+        try:
+            clone_range(fd_in, off_in, fd_out, off_out, size)
+            return size
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+
+    copied = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < size:
+                n = os.copy_file_range(fd_in, fd_out, size - copied, off_in + copied, off_out + copied)
+                if not n:
+                    return copied
+                copied += n
+            return copied
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+
+    while copied < size:
+        data = os.pread(fd_in, min(FALLBACK_CHUNK_SIZE, size - copied), off_in + copied)
+        if not data:
+            break
+        view = memoryview(data)
+        while view:
+            n = os.pwrite(fd_out, view, off_out + copied)
+            view = view[n:]
+            copied += n
+    return copied
@@ -0,0 +1,137 @@
+"""
+Tracking of data extents for sparse files.
+
+ExtentMap records which byte ranges of a file contain data, everything else
+is a hole. It answers lseek(SEEK_DATA / SEEK_HOLE) so tools like cp --sparse
+and tar -S can skip holes instead of reading every zero byte.
+"""
+
+import errno
+import os
+from bisect import bisect_left, bisect_right
+
+from fuse3.fuse import FuseOSError
+
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+FALLOC_FL_ZERO_RANGE = 0x10
+
+SEEK_DATA = getattr(os, "SEEK_DATA", 3)
+SEEK_HOLE = getattr(os, "SEEK_HOLE", 4)
+
+
+class ExtentMap:
+    """
+    Sorted, non-overlapping [start, end) data extents.
+
+    Adjacent extents are merged, so every extent end is the start of a hole.
+    Adding or removing a range costs O(log n) plus the number of extents it
+    touches.
+    """
+
+    __slots__ = ("_starts", "_ends")
+
+    def __init__(self, extents=()):
+        self._starts = []
+        self._ends = []
+        for start, end in extents:
+            self.add(start, end)
+
+    def __iter__(self):
+        return zip(self._starts, self._ends)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __repr__(self):
+        return "<ExtentMap %r>" % list(self)
+
+    @property
+    def data_size(self):
+        "The number of bytes covered by extents"
+
+        return sum(end - start for start, end in self)
+
+    def add(self, start, end):
+        "Marks [start, end) as data"
+
+        if start >= end:
+            return
+
+        i = bisect_left(self._ends, start)
+        j = bisect_right(self._starts, end)
+        if i < j:
+            start = min(start, self._starts[i])
+            end = max(end, self._ends[j - 1])
+        self._starts[i:j] = [start]
+        self._ends[i:j] = [end]
+
+    def remove(self, start, end):
+        "Marks [start, end) as a hole"
+
+        if start >= end:
+            return
+
+        i = bisect_right(self._ends, start)
+        j = bisect_left(self._starts, end)
+        if i >= j:
+            return
+
+        starts, ends = [], []
+        if self._starts[i] < start:
+            starts.append(self._starts[i])
+            ends.append(start)
+        if self._ends[j - 1] > end:
+            starts.append(end)
+            ends.append(self._ends[j - 1])
+        self._starts[i:j] = starts
+        self._ends[i:j] = ends
+
+    def truncate(self, size):
+        "Drops everything from size onwards"
+
+        i = bisect_left(self._starts, size)
+        del self._starts[i:]
+        del self._ends[i:]
+        if self._ends and self._ends[-1] > size:
+            self._ends[-1] = size
+
+    def is_data(self, offset):
+        i = bisect_right(self._ends, offset)
+        return i < len(self._starts) and self._starts[i] <= offset
+
+    def seek_data(self, offset):
+        "Returns the first data offset at or after offset, or None"
+
+        i = bisect_right(self._ends, offset)
+        if i == len(self._starts):
+            return None
+        return max(offset, self._starts[i])
+
+    def seek_hole(self, offset):
+        "Returns the first hole offset at or after offset"
+
+        i = bisect_right(self._ends, offset)
+        if i < len(self._starts) and self._starts[i] <= offset:
+            return self._ends[i]
+        return offset
+
+    def lseek(self, offset, whence, size):
+        """
+        Implements lseek(2) SEEK_DATA and SEEK_HOLE for a file of size bytes,
+        raising FuseOSError like the system call does. The end of the file
+        counts as a hole.
+        """
+
+        if offset < 0 or offset >= size:
+            raise FuseOSError(errno.ENXIO)
+
+        if whence == SEEK_DATA:
+            pos = self.seek_data(offset)
+            if pos is None or pos >= size:
+                raise FuseOSError(errno.ENXIO)
+            return pos
+        if whence == SEEK_HOLE:
+            return min(self.seek_hole(offset), size)
+
+        raise FuseOSError(errno.EINVAL)
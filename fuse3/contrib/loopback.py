@@ -0,0 +1,264 @@
+"""
+Loopback filesystem mirroring a directory.
+
+All path operations are fd-relative (*at) calls against an O_PATH file
+descriptor of the root directory, and file I/O uses os.pread/os.pwrite on the
+backing file descriptors, so there is no shared file offset and no lock:
+parallel I/O on different (or the same) files scales with the libfuse threads.
+Operations on open files only use the file handle, so Loopback can be mounted
+with nullpath_ok.
+
+    python -m fuse3.contrib.loopback /srv/data /mnt/data
+"""
+
+import ctypes
+import errno
+import os
+
+from fuse3.c_fuse import c_off_t
+from fuse3.contrib import copy
+from fuse3.fuse import FuseOSError, Operations
+
+O_PATH = getattr(os, "O_PATH", os.O_RDONLY)
+
+STATFS_KEYS = (
+    "f_bavail",
+    "f_bfree",
+    "f_blocks",
+    "f_bsize",
+    "f_favail",
+    "f_ffree",
+    "f_files",
+    "f_flag",
+    "f_frsize",
+    "f_namemax",
+)
+
+_libc = None
+
+
+def _libc_function(name, *argtypes):
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+
+    func = getattr(_libc, name, None)
+    if func is None:
+        raise FuseOSError(errno.ENOSYS)
+    func.argtypes = argtypes
+    func.restype = ctypes.c_int
+    return func
+
+
+def _check(ret):
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return ret
+
+
+def fallocate(fd, mode, offset, length):
+    "fallocate(2), supporting the FALLOC_FL_* mode flags unlike os.posix_fallocate"
+
+    if mode == 0 and hasattr(os, "posix_fallocate"):
+        return os.posix_fallocate(fd, offset, length)
+    func = _libc_function("fallocate", ctypes.c_int, ctypes.c_int, c_off_t, c_off_t)
+    _check(func(fd, mode, offset, length))
+
+
+def renameat2(src_dir_fd, src, dst_dir_fd, dst, flags):
+    "renameat2(2), supporting RENAME_NOREPLACE and RENAME_EXCHANGE"
+
+    func = _libc_function("renameat2", ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint)
+    _check(func(src_dir_fd, os.fsencode(src), dst_dir_fd, os.fsencode(dst), flags))
+
+
+class Loopback(Operations):
+    """
+    Mirrors the directory root.
+
+    File handles are the file descriptors of the backing files and
+    directories.
+    """
+
+    use_ns = True
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.root_fd = os.open(self.root, O_PATH | os.O_DIRECTORY)
+
+    @staticmethod
+    def _rel(path):
+        return path[1:] or "."
+
+    def destroy(self, path):
+        os.close(self.root_fd)
+
+    def access(self, path, amode):
+        if not os.access(self._rel(path), amode, dir_fd=self.root_fd):
+            raise FuseOSError(errno.EACCES)
+
+    def getattr(self, path, fh=None):
+        if fh is not None:
+            st = os.fstat(fh)
+        else:
+            st = os.stat(self._rel(path), dir_fd=self.root_fd, follow_symlinks=False)
+
+        return dict(
+            st_mode=st.st_mode,
+            st_ino=st.st_ino,
+            st_dev=st.st_dev,
+            st_nlink=st.st_nlink,
+            st_uid=st.st_uid,
+            st_gid=st.st_gid,
+            st_rdev=st.st_rdev,
+            st_size=st.st_size,
+            st_blocks=st.st_blocks,
+            st_blksize=st.st_blksize,
+            st_atime=st.st_atime_ns,
+            st_mtime=st.st_mtime_ns,
+            st_ctime=st.st_ctime_ns,
+        )
+
+    def readlink(self, path):
+        return os.readlink(self._rel(path), dir_fd=self.root_fd)
+
+    def mknod(self, path, mode, dev):
+        os.mknod(self._rel(path), mode, dev, dir_fd=self.root_fd)
+
+    def mkdir(self, path, mode):
+        os.mkdir(self._rel(path), mode, dir_fd=self.root_fd)
+
+    def unlink(self, path):
+        os.unlink(self._rel(path), dir_fd=self.root_fd)
+
+    def rmdir(self, path):
+        os.rmdir(self._rel(path), dir_fd=self.root_fd)
+
+    def symlink(self, target, source):
+        os.symlink(source, self._rel(target), dir_fd=self.root_fd)
+
+    def rename(self, old, new, flags):
+        if flags:
+            renameat2(self.root_fd, self._rel(old), self.root_fd, self._rel(new), flags)
+        else:
+            os.rename(self._rel(old), self._rel(new), src_dir_fd=self.root_fd, dst_dir_fd=self.root_fd)
+
+    def link(self, target, source):
+        os.link(
+            self._rel(source),
+            self._rel(target),
+            src_dir_fd=self.root_fd,
+            dst_dir_fd=self.root_fd,
+            follow_symlinks=False,
+        )
+
+    def chmod(self, path, mode, fh=None):
+        if fh is not None:
+            os.fchmod(fh, mode)
+        else:
+            os.chmod(self._rel(path), mode, dir_fd=self.root_fd)
+
+    def chown(self, path, uid, gid, fh=None):
+        if fh is not None:
+            os.fchown(fh, uid, gid)
+        else:
+            os.chown(self._rel(path), uid, gid, dir_fd=self.root_fd, follow_symlinks=False)
+
+    def truncate(self, path, length, fh=None):
+        if fh is not None:
+            os.ftruncate(fh, length)
+            return
+
+        fd = os.open(self._rel(path), os.O_WRONLY, dir_fd=self.root_fd)
+        try:
+            os.ftruncate(fd, length)
+        finally:
+            os.close(fd)
+
+    def utimens(self, path, times=None, fh=None):
+        kwargs = {"ns": times} if times else {}
+        if fh is not None:
+            os.utime(fh, **kwargs)
+        else:
+            os.utime(self._rel(path), dir_fd=self.root_fd, follow_symlinks=False, **kwargs)
+
+    def open(self, path, flags):
+        return os.open(self._rel(path), flags, dir_fd=self.root_fd)
+
+    def create(self, path, mode, fi=None):
+        # The open flags are not passed to create, open read-write so the
+        # handle can be used for both reading and writing
+        return os.open(self._rel(path), os.O_RDWR | os.O_CREAT, mode, dir_fd=self.root_fd)
+
+    def read(self, path, size, offset, fh):
+        return os.pread(fh, size, offset)
+
+    def write(self, path, data, offset, fh):
+        return os.pwrite(fh, data, offset)
+
+    def flush(self, path, fh):
+        # Emulate close() on the backing file, releasing POSIX locks, without
+        # invalidating the handle
+        os.close(os.dup(fh))
+
+    def release(self, path, fh):
+        os.close(fh)
+
+    def fsync(self, path, datasync, fh):
+        if datasync:
+            os.fdatasync(fh)
+        else:
+            os.fsync(fh)
+
+    def opendir(self, path):
+        return os.open(self._rel(path), os.O_RDONLY | os.O_DIRECTORY, dir_fd=self.root_fd)
+
+    def readdir(self, path, fh, flags):
+        return [".", ".."] + os.listdir(fh)
+
+    def releasedir(self, path, fh):
+        os.close(fh)
+
+    def fsyncdir(self, path, datasync, fh):
+        os.fsync(fh)
+
+    def statfs(self, path):
+        stv = os.statvfs(self.root_fd)
+        return dict((key, getattr(stv, key)) for key in STATFS_KEYS)
+
+    def setxattr(self, path, name, value, options, position=0):
+        os.setxattr(self.root + path, name, value, options, follow_symlinks=False)
+
+    def getxattr(self, path, name, position=0):
+        return os.getxattr(self.root + path, name, follow_symlinks=False)
+
+    def listxattr(self, path):
+        return os.listxattr(self.root + path, follow_symlinks=False)
+
+    def removexattr(self, path, name):
+        os.removexattr(self.root + path, name, follow_symlinks=False)
+
+    def fallocate(self, path, mode, offset, length, fh):
+        fallocate(fh, mode, offset, length)
+
+    def copy_file_range(self, path_in, fh_in, off_in, path_out, fh_out, off_out, size, flags):
+        return copy.copy_file_range(fh_in, off_in, fh_out, off_out, size, flags)
+
+    def lseek(self, path, off, whence, fh):
+        return os.lseek(fh, off, whence)
+
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    from fuse3.fuse import FUSE3
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root")
+    parser.add_argument("mount")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    FUSE3(Loopback(args.root), args.mount, foreground=True, nullpath_ok=True)
@@ -0,0 +1,527 @@
+"""
+In-memory filesystem with a hierarchical tree and chunked file storage.
+
+File data is stored in fixed-size chunks, missing chunks are holes that read
+as zeros. Written ranges are tracked in an ExtentMap to answer SEEK_DATA and
+SEEK_HOLE, and fallocate supports punching holes. The last chunk of a file
+grows geometrically, so appending is amortized O(1), and reads within a
+single chunk return a memoryview without copying. Chunks are never resized
+in place, replacing them instead, so views handed to FUSE3 stay valid while
+other threads write.
+
+    python -m fuse3.contrib.memfs /mnt/scratch --max-size 1073741824
+"""
+
+import errno
+import os
+import stat
+import threading
+import time
+
+from fuse3.contrib.extents import (
+    FALLOC_FL_KEEP_SIZE,
+    FALLOC_FL_PUNCH_HOLE,
+    FALLOC_FL_ZERO_RANGE,
+    ExtentMap,
+)
+from fuse3.fuse import FuseOSError, Operations
+from fuse3.request import current_request
+
+RENAME_NOREPLACE = 1
+RENAME_EXCHANGE = 2
+
+XATTR_CREATE = 1
+XATTR_REPLACE = 2
+
+BLOCK_SIZE = 4096
+
+
+class Node:
+    __slots__ = ("attrs", "xattrs")
+
+    def __init__(self, mode, nlink=1):
+        now = time.time_ns()
+        request = current_request()
+        if request is not None:
+            uid, gid = request.uid, request.gid
+        else:
+            uid, gid = os.getuid(), os.getgid()
+
+        self.attrs = dict(
+            st_mode=mode,
+            st_nlink=nlink,
+            st_uid=uid,
+            st_gid=gid,
+            st_atime=now,
+            st_mtime=now,
+            st_ctime=now,
+        )
+        self.xattrs = {}
+
+    def getattr(self):
+        return dict(self.attrs, st_size=0, st_blocks=0, st_blksize=BLOCK_SIZE)
+
+    def touch(self, *keys):
+        now = time.time_ns()
+        for key in keys or ("st_mtime", "st_ctime"):
+            self.attrs[key] = now
+
+
+class Directory(Node):
+    __slots__ = ("children",)
+
+    def __init__(self, mode):
+        super().__init__(stat.S_IFDIR | mode, nlink=2)
+        self.children = {}
+
+
+class Symlink(Node):
+    __slots__ = ("target",)
+
+    def __init__(self, target):
+        super().__init__(stat.S_IFLNK | 0o777)
+        self.target = target
+
+    def getattr(self):
+        return dict(super().getattr(), st_size=len(self.target.encode()))
+
+
+class File(Node):
+    __slots__ = ("fs", "chunks", "extents", "size", "allocated")
+
+    def __init__(self, fs, mode):
+        super().__init__(stat.S_IFREG | mode)
+        self.fs = fs
+        self.chunks = {}
+        self.extents = ExtentMap()
+        self.size = 0
+        self.allocated = 0
+
+    def getattr(self):
+        return dict(self.attrs, st_size=self.size, st_blocks=(self.allocated + 511) // 512, st_blksize=BLOCK_SIZE)
+
+    def _free(self, nbytes):
+        self.allocated -= nbytes
+        self.fs.free(nbytes)
+
+    def read(self, size, offset):
+        chunk_size = self.fs.chunk_size
+        end = min(offset + size, self.size)
+        if offset >= end:
+            return b""
+
+        index, start = divmod(offset, chunk_size)
+        stop = start + end - offset
+        if stop <= chunk_size:
+            # Fast path, the range lies within a single chunk
+            chunk = self.chunks.get(index)
+            if chunk is None:
+                return self.fs.zeros[: stop - start]
+            if len(chunk) >= stop:
+                return memoryview(chunk)[start:stop]
+
+        out = bytearray(end - offset)
+        pos = offset
+        while pos < end:
+            index, start = divmod(pos, chunk_size)
+            n = min(chunk_size - start, end - pos)
+            chunk = self.chunks.get(index)
+            if chunk is not None and start < len(chunk):
+                piece = memoryview(chunk)[start : start + n]
+                out[pos - offset : pos - offset + len(piece)] = piece
+            pos += n
+        return out
+
+    def _grow(self, offset, end):
+        "Makes sure chunks are allocated for [offset, end)"
+
+        chunk_size = self.fs.chunk_size
+
+        # Work out which chunks have to grow first so a write either fails
+        # with ENOSPC or is applied completely
+        grow = {}
+        pos = offset
+        while pos < end:
+            index, start = divmod(pos, chunk_size)
+            n = min(chunk_size - start, end - pos)
+            chunk = self.chunks.get(index)
+            length = 0 if chunk is None else len(chunk)
+            if length < start + n:
+                # Grow geometrically to make appends amortized O(1)
+                grow[index] = min(chunk_size, max(start + n, 2 * length))
+            pos += n
+
+        nbytes = sum(new - len(self.chunks.get(index, b"")) for index, new in grow.items())
+        self.fs.allocate(nbytes)
+        self.allocated += nbytes
+        for index, new in grow.items():
+            chunk = bytearray(new)
+            old = self.chunks.get(index)
+            if old is not None:
+                chunk[: len(old)] = old
+            self.chunks[index] = chunk
+
+    def write(self, data, offset):
+        chunk_size = self.fs.chunk_size
+        data = memoryview(data)
+        end = offset + len(data)
+        self._grow(offset, end)
+
+        pos = offset
+        while pos < end:
+            index, start = divmod(pos, chunk_size)
+            n = min(chunk_size - start, end - pos)
+            self.chunks[index][start : start + n] = data[pos - offset : pos - offset + n]
+            pos += n
+
+        self.extents.add(offset, end)
+        self.size = max(self.size, end)
+        return len(data)
+
+    def allocate(self, offset, length, keep_size=False):
+        end = offset + length
+        self._grow(offset, end)
+        self.extents.add(offset, end)
+        if not keep_size:
+            self.size = max(self.size, end)
+
+    def punch_hole(self, offset, length):
+        chunk_size = self.fs.chunk_size
+        end = min(offset + length, self.size)
+        released = 0
+        pos = offset
+        while pos < end:
+            index, start = divmod(pos, chunk_size)
+            n = min(chunk_size - start, end - pos)
+            chunk = self.chunks.get(index)
+            if chunk is not None:
+                if n == chunk_size or (start == 0 and pos + n >= self.size):
+                    released += len(self.chunks.pop(index))
+                elif start < len(chunk):
+                    chunk[start : start + n] = bytes(min(n, len(chunk) - start))
+            pos += n
+
+        self._free(released)
+        self.extents.remove(offset, end)
+
+    def truncate(self, length):
+        chunk_size = self.fs.chunk_size
+        if length < self.size:
+            index, start = divmod(length, chunk_size)
+            released = 0
+            for i in [i for i in self.chunks if i > index or (i == index and start == 0)]:
+                released += len(self.chunks.pop(i))
+
+            chunk = self.chunks.get(index)
+            if chunk is not None and len(chunk) > start:
+                # Replace instead of resizing, the old chunk may still be
+                # referenced by a memoryview returned from read
+                self.chunks[index] = chunk[:start]
+                released += len(chunk) - start
+            self._free(released)
+
+        self.extents.truncate(length)
+        self.size = length
+
+    def clear(self):
+        self._free(self.allocated)
+        self.chunks.clear()
+        self.extents = ExtentMap()
+        self.size = 0
+
+
+class MemoryFS(Operations):
+    """
+    Hierarchical in-memory filesystem.
+
+    max_size limits the bytes allocated for file data, writes that would
+    exceed it fail with ENOSPC. chunk_size is the granularity in which file
+    data is allocated, reads within a chunk are served without copying.
+
+    Files are looked up by path in every operation, file handles are not
+    used, so nullpath_ok is not supported.
+    """
+
+    use_ns = True
+
+    def __init__(self, max_size=None, chunk_size=256 * 1024):
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.zeros = memoryview(bytes(chunk_size))
+        self.used = 0
+        self._lock = threading.RLock()
+        self.root = Directory(0o755)
+
+    def __call__(self, op, *args):
+        with self._lock:
+            return super().__call__(op, *args)
+
+    def allocate(self, nbytes):
+        if self.max_size is not None and self.used + nbytes > self.max_size:
+            raise FuseOSError(errno.ENOSPC)
+        self.used += nbytes
+
+    def free(self, nbytes):
+        self.used -= nbytes
+
+    def _lookup(self, path):
+        node = self.root
+        for name in path.split("/"):
+            if not name:
+                continue
+            if not isinstance(node, Directory):
+                raise FuseOSError(errno.ENOTDIR)
+            try:
+                node = node.children[name]
+            except KeyError:
+                raise FuseOSError(errno.ENOENT)
+        return node
+
+    def _parent(self, path):
+        head, _, name = path.rstrip("/").rpartition("/")
+        parent = self._lookup(head)
+        if not isinstance(parent, Directory):
+            raise FuseOSError(errno.ENOTDIR)
+        return parent, name
+
+    def _file(self, path):
+        node = self._lookup(path)
+        if isinstance(node, Directory):
+            raise FuseOSError(errno.EISDIR)
+        if not isinstance(node, File):
+            raise FuseOSError(errno.EINVAL)
+        return node
+
+    def _add(self, path, node):
+        parent, name = self._parent(path)
+        if name in parent.children:
+            raise FuseOSError(errno.EEXIST)
+        parent.children[name] = node
+        if isinstance(node, Directory):
+            parent.attrs["st_nlink"] += 1
+        parent.touch()
+        return node
+
+    def _drop(self, node):
+        node.attrs["st_nlink"] -= 1
+        if isinstance(node, File) and node.attrs["st_nlink"] == 0:
+            node.clear()
+
+    def getattr(self, path, fh=None):
+        return self._lookup(path).getattr()
+
+    def readdir(self, path, fh, flags):
+        node = self._lookup(path)
+        if not isinstance(node, Directory):
+            raise FuseOSError(errno.ENOTDIR)
+        return [".", ".."] + list(node.children)
+
+    def mkdir(self, path, mode):
+        self._add(path, Directory(mode & 0o7777))
+
+    def rmdir(self, path):
+        parent, name = self._parent(path)
+        node = self._lookup(path)
+        if not isinstance(node, Directory):
+            raise FuseOSError(errno.ENOTDIR)
+        if node.children:
+            raise FuseOSError(errno.ENOTEMPTY)
+        del parent.children[name]
+        parent.attrs["st_nlink"] -= 1
+        parent.touch()
+
+    def create(self, path, mode, fi=None):
+        self._add(path, File(self, mode & 0o7777))
+        return 0
+
+    def open(self, path, flags):
+        self._lookup(path)
+        return 0
+
+    def read(self, path, size, offset, fh):
+        node = self._file(path)
+        return node.read(size, offset)
+
+    def write(self, path, data, offset, fh):
+        node = self._file(path)
+        written = node.write(data, offset)
+        node.touch()
+        return written
+
+    def truncate(self, path, length, fh=None):
+        node = self._file(path)
+        node.truncate(length)
+        node.touch()
+
+    def fallocate(self, path, mode, offset, length, fh):
+        node = self._file(path)
+        keep_size = bool(mode & FALLOC_FL_KEEP_SIZE)
+        mode &= ~FALLOC_FL_KEEP_SIZE
+
+        if mode == FALLOC_FL_PUNCH_HOLE:
+            if not keep_size:
+                raise FuseOSError(errno.EOPNOTSUPP)
+            node.punch_hole(offset, length)
+        elif mode == FALLOC_FL_ZERO_RANGE:
+            node.punch_hole(offset, length)
+            if not keep_size:
+                node.size = max(node.size, offset + length)
+        elif mode == 0:
+            node.allocate(offset, length, keep_size)
+        else:
+            raise FuseOSError(errno.EOPNOTSUPP)
+        node.touch()
+
+    def lseek(self, path, off, whence, fh):
+        node = self._file(path)
+        return node.extents.lseek(off, whence, node.size)
+
+    def unlink(self, path):
+        parent, name = self._parent(path)
+        node = self._lookup(path)
+        if isinstance(node, Directory):
+            raise FuseOSError(errno.EISDIR)
+        del parent.children[name]
+        parent.touch()
+        self._drop(node)
+
+    def rename(self, old, new, flags):
+        old_parent, old_name = self._parent(old)
+        new_parent, new_name = self._parent(new)
+        node = self._lookup(old)
+        target = new_parent.children.get(new_name)
+        if target is node:
+            return
+        if isinstance(node, Directory) and (new + "/").startswith(old.rstrip("/") + "/"):
+            # A directory can not become a subdirectory of itself
+            raise FuseOSError(errno.EINVAL)
+
+        if flags & RENAME_EXCHANGE:
+            if target is None:
+                raise FuseOSError(errno.ENOENT)
+            if isinstance(target, Directory) and (old + "/").startswith(new.rstrip("/") + "/"):
+                raise FuseOSError(errno.EINVAL)
+            old_parent.children[old_name], new_parent.children[new_name] = target, node
+            # A directory swapped with a file moves its ".." link
+            moved = isinstance(node, Directory) - isinstance(target, Directory)
+            old_parent.attrs["st_nlink"] -= moved
+            new_parent.attrs["st_nlink"] += moved
+            old_parent.touch()
+            new_parent.touch()
+            node.touch("st_ctime")
+            target.touch("st_ctime")
+            return
+
+        if target is not None:
+            if flags & RENAME_NOREPLACE:
+                raise FuseOSError(errno.EEXIST)
+            if isinstance(target, Directory):
+                if not isinstance(node, Directory):
+                    raise FuseOSError(errno.EISDIR)
+                if target.children:
+                    raise FuseOSError(errno.ENOTEMPTY)
+                new_parent.attrs["st_nlink"] -= 1
+            elif isinstance(node, Directory):
+                raise FuseOSError(errno.ENOTDIR)
+            else:
+                self._drop(target)
+
+        del old_parent.children[old_name]
+        new_parent.children[new_name] = node
+        if isinstance(node, Directory):
+            old_parent.attrs["st_nlink"] -= 1
+            new_parent.attrs["st_nlink"] += 1
+        old_parent.touch()
+        new_parent.touch()
+        node.touch("st_ctime")
+
+    def link(self, target, source):
+        node = self._lookup(source)
+        if isinstance(node, Directory):
+            raise FuseOSError(errno.EPERM)
+        self._add(target, node)
+        node.attrs["st_nlink"] += 1
+        node.touch("st_ctime")
+
+    def symlink(self, target, source):
+        self._add(target, Symlink(source))
+
+    def readlink(self, path):
+        node = self._lookup(path)
+        if not isinstance(node, Symlink):
+            raise FuseOSError(errno.EINVAL)
+        return node.target
+
+    def chmod(self, path, mode, fh=None):
+        node = self._lookup(path)
+        node.attrs["st_mode"] = stat.S_IFMT(node.attrs["st_mode"]) | stat.S_IMODE(mode)
+        node.touch("st_ctime")
+
+    def chown(self, path, uid, gid, fh=None):
+        node = self._lookup(path)
+        if uid != -1:
+            node.attrs["st_uid"] = uid
+        if gid != -1:
+            node.attrs["st_gid"] = gid
+        node.touch("st_ctime")
+
+    def utimens(self, path, times=None, fh=None):
+        node = self._lookup(path)
+        if times is None:
+            now = time.time_ns()
+            times = (now, now)
+        node.attrs["st_atime"], node.attrs["st_mtime"] = times
+        node.touch("st_ctime")
+
+    def statfs(self, path):
+        if self.max_size is None:
+            blocks = free = (1 << 40) // BLOCK_SIZE
+        else:
+            blocks = self.max_size // BLOCK_SIZE
+            free = max(0, self.max_size - self.used) // BLOCK_SIZE
+        return dict(
+            f_bsize=BLOCK_SIZE,
+            f_frsize=BLOCK_SIZE,
+            f_blocks=blocks,
+            f_bfree=free,
+            f_bavail=free,
+            f_namemax=255,
+        )
+
+    def setxattr(self, path, name, value, options, position=0):
+        node = self._lookup(path)
+        if options & XATTR_CREATE and name in node.xattrs:
+            raise FuseOSError(errno.EEXIST)
+        if options & XATTR_REPLACE and name not in node.xattrs:
+            raise FuseOSError(errno.ENODATA)
+        node.xattrs[name] = value
+
+    def getxattr(self, path, name, position=0):
+        try:
+            return self._lookup(path).xattrs[name]
+        except KeyError:
+            raise FuseOSError(errno.ENODATA)
+
+    def listxattr(self, path):
+        return list(self._lookup(path).xattrs)
+
+    def removexattr(self, path, name):
+        try:
+            del self._lookup(path).xattrs[name]
+        except KeyError:
+            raise FuseOSError(errno.ENODATA)
+
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    from fuse3.fuse import FUSE3
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mount")
+    parser.add_argument("--max-size", type=int, help="maximum bytes of file data")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    FUSE3(MemoryFS(max_size=args.max_size), args.mount, foreground=True)
@@ -0,0 +1,163 @@
+"""
+Per-client bandwidth and IOPS limits.
+
+RateLimitMixIn throttles read() and write() with token buckets kept per
+tenant, by default the uid of the calling process, so one bulk reader cannot
+saturate the backend for every other user of the mount:
+
+    class LimitedSFTP(RateLimitMixIn, SFTP):
+        read_rate = 20 * 1024 * 1024
+        write_rate = 10 * 1024 * 1024
+        ops_rate = 500
+
+Requests over the limit are delayed, not failed. Limits can be changed while
+mounted, for all tenants or for single ones, with set_rate_limit().
+"""
+
+import operator
+import threading
+import time
+
+from fuse3.request import current_request
+
+_KINDS = ("read", "write", "ops")
+
+# How often buckets that refilled are dropped, in seconds
+_EXPIRE_INTERVAL = 1.0
+
+
+class _Bucket:
+    "Token bucket refilled with rate tokens per second, holding up to burst seconds of them"
+
+    __slots__ = ("rate", "capacity", "tokens", "last")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = rate * burst
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+
+    def full(self, now):
+        return self.tokens + (now - self.last) * self.rate >= self.capacity
+
+    def take(self, n):
+        "Takes n tokens, returning how many seconds to wait for them"
+
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        # Go into debt rather than waiting for tokens to accumulate, so
+        # requests larger than the bucket pass too
+        self.tokens -= n
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class RateLimitMixIn:
+    """
+    Limits each tenant to read_rate and write_rate bytes and ops_rate reads
+    and writes per second, None meaning unlimited. Up to rate_burst seconds
+    worth of tokens accumulate while a tenant is idle.
+
+    rate_key maps the current Request to its tenant: "uid" (the default),
+    "gid", "pid" or a function. Calls made outside of a FUSE request belong to
+    the tenant None. rate_limits maps tenants to {kind: rate} overrides of
+    the read, write and ops rates. rate_limit_stats() reports how often and
+    for how long each tenant was delayed, until the tenant has been idle for
+    long enough that its buckets are full again.
+    """
+
+    read_rate = None
+    write_rate = None
+    ops_rate = None
+    rate_burst = 1.0
+    rate_key = "uid"
+    rate_limits = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rate_limits = {tenant: dict(limits) for tenant, limits in self.rate_limits.items()}
+        self._rate_key = self.rate_key if callable(self.rate_key) else operator.attrgetter(self.rate_key)
+        self._buckets = {}
+        self._delays = {}
+        self._expired = time.monotonic()
+        self._rate_lock = threading.Lock()
+
+    def set_rate_limit(self, tenant=None, **rates):
+        """
+        Changes the read, write or ops rate of tenant, or the default rates
+        when tenant is None, e.g. set_rate_limit(1000, read=1024 * 1024).
+        """
+
+        unknown = set(rates) - set(_KINDS)
+        if unknown:
+            raise ValueError("unknown rate limits %s" % ", ".join(sorted(unknown)))
+
+        with self._rate_lock:
+            if tenant is None:
+                for kind, rate in rates.items():
+                    setattr(self, kind + "_rate", rate)
+            else:
+                self.rate_limits.setdefault(tenant, {}).update(rates)
+            # Buckets are recreated with the new rates on next use
+            for key in [key for key in self._buckets if tenant is None or key[0] == tenant]:
+                if key[1] in rates:
+                    del self._buckets[key]
+
+    def _rate(self, tenant, kind):
+        limits = self.rate_limits.get(tenant)
+        if limits is not None and kind in limits:
+            return limits[kind]
+        return getattr(self, kind + "_rate")
+
+    def _expire(self, now):
+        "Drops buckets that refilled, which behave like new ones, with the lock held"
+
+        self._expired = now
+        for key in [key for key, bucket in self._buckets.items() if bucket.full(now)]:
+            del self._buckets[key]
+        active = {tenant for tenant, _ in self._buckets}
+        for tenant in [tenant for tenant in self._delays if tenant not in active]:
+            del self._delays[tenant]
+
+    def _throttle(self, nbytes, kind):
+        request = current_request()
+        tenant = self._rate_key(request) if request is not None else None
+
+        wait = 0.0
+        with self._rate_lock:
+            now = time.monotonic()
+            if now - self._expired >= _EXPIRE_INTERVAL:
+                self._expire(now)
+            for name, n in ((kind, nbytes), ("ops", 1)):
+                rate = self._rate(tenant, name)
+                if not rate:
+                    continue
+                bucket = self._buckets.get((tenant, name))
+                if bucket is None:
+                    bucket = self._buckets[(tenant, name)] = _Bucket(rate, self.rate_burst)
+                wait = max(wait, bucket.take(n))
+            if wait:
+                count, total = self._delays.get(tenant, (0, 0.0))
+                self._delays[tenant] = (count + 1, total + wait)
+
+        deadline = time.monotonic() + wait
+        while wait > 0:
+            # Give up on readers that went away
+            if request is not None:
+                request.check_interrupted()
+            time.sleep(min(wait, 0.1))
+            wait = deadline - time.monotonic()
+
+    def rate_limit_stats(self):
+        "Returns {tenant: {delayed, delay}}, delay being the total in seconds"
+
+        with self._rate_lock:
+            return {tenant: dict(delayed=count, delay=total) for tenant, (count, total) in self._delays.items()}
+
+    def read(self, path, size, offset, fh):
+        self._throttle(size, "read")
+        return super().read(path, size, offset, fh)
+
+    def write(self, path, data, offset, fh):
+        self._throttle(len(data), "write")
+        return super().write(path, data, offset, fh)
@@ -0,0 +1,511 @@
+"""
+SFTP filesystem with a channel pool and persistent file handles.
+
+Requests are spread over a bounded pool of SFTP channels, so one slow
+request does not block every other operation. Open files keep their remote
+handle, and a channel shared with as few other files as possible, for the
+lifetime of the FUSE file handle. Sequential readers get read-ahead through
+paramiko's prefetch, and writes are pipelined: they are not acknowledged one
+by one, errors are reported by flush, fsync or release instead.
+
+Requires paramiko (pip install fusepy3[sftp]):
+
+    python -m fuse3.contrib.sftp user@host:/remote/path /mnt/remote
+"""
+
+import errno
+import itertools
+import logging
+import os
+import stat
+import threading
+from contextlib import contextmanager
+
+from fuse3.fuse import FuseOSError, Operations
+
+log = logging.getLogger("fuse.sftp")
+
+DEFAULT_POOL_SIZE = 10
+"""The default maximum number of libfuse worker threads."""
+
+
+class _Channel:
+    "A pooled SFTP client"
+
+    __slots__ = ("client", "files", "busy", "broken", "dirty")
+
+    def __init__(self, client):
+        self.client = client
+        self.files = 0
+        self.busy = False
+        self.broken = False
+        # The owner of pipelined writes still waiting for their responses
+        self.dirty = None
+
+
+class ChannelPool:
+    """
+    Pool of up to size SFTP clients created by calling factory.
+
+    Clients are created on demand and used by one request at a time:
+    paramiko discards responses to requests of other threads. A client that
+    raised anything other than an OSError with an errno (i.e. a failed
+    request) is considered broken and is closed once no open file uses it.
+
+    checkout() binds an open file to a channel, a new one while there are
+    fewer than size, else the one used by the fewest files. Requests on it
+    are made with use(). A channel's dirty owner has pipelined writes in
+    flight, settle(owner) is called to collect their responses before the
+    channel is used for anything else, as other requests would swallow them.
+    """
+
+    def __init__(self, factory, size=DEFAULT_POOL_SIZE, settle=None):
+        self.factory = factory
+        self.size = size
+        self.settle = settle
+        self._channels = []
+        self._creating = 0
+        self._cond = threading.Condition()
+
+    def _create(self):
+        "Creates a channel, called with the condition held and a free slot"
+
+        self._creating += 1
+        self._cond.release()
+        try:
+            client = self.factory()
+        finally:
+            self._cond.acquire()
+            self._creating -= 1
+            self._cond.notify_all()
+        channel = _Channel(client)
+        self._channels.append(channel)
+        return channel
+
+    def _free_slot(self):
+        return len(self._channels) + self._creating < self.size
+
+    def checkout(self):
+        "Returns the channel for a new open file, until checkin()"
+
+        with self._cond:
+            while True:
+                if self._free_slot() and all(channel.files for channel in self._channels):
+                    channel = self._create()
+                    break
+                if self._channels:
+                    channel = min(self._channels, key=lambda channel: channel.files)
+                    break
+                self._cond.wait()
+            channel.files += 1
+            return channel
+
+    def checkin(self, channel):
+        with self._cond:
+            channel.files -= 1
+            close = channel.broken and not channel.files and not channel.busy
+        if close:
+            self._close(channel)
+
+    def _close(self, channel):
+        try:
+            channel.client.close()
+        except Exception:
+            pass
+
+    def _take(self):
+        "Takes the idle channel with the fewest open files, waiting for one"
+
+        with self._cond:
+            while True:
+                idle = [channel for channel in self._channels if not channel.busy]
+                if idle:
+                    channel = min(idle, key=lambda channel: channel.files)
+                    break
+                if self._free_slot():
+                    channel = self._create()
+                    break
+                self._cond.wait()
+            channel.busy = True
+            return channel
+
+    @contextmanager
+    def _session(self, channel, owner, pipelined):
+        try:
+            dirty = channel.dirty
+            if dirty is not None and not (pipelined and dirty is owner):
+                channel.dirty = None
+                self.settle(dirty)
+            yield channel.client
+        except OSError as e:
+            if e.errno is None:
+                self._break(channel)
+            raise
+        except BaseException:
+            self._break(channel)
+            raise
+        finally:
+            with self._cond:
+                channel.busy = False
+                self._cond.notify_all()
+                close = channel.broken and not channel.files
+            if close:
+                self._close(channel)
+
+    def _break(self, channel):
+        with self._cond:
+            channel.broken = True
+            if channel in self._channels:
+                self._channels.remove(channel)
+            self._cond.notify_all()
+
+    @contextmanager
+    def channel(self):
+        "Yields an idle client for a request"
+
+        with self._session(self._take(), None, False) as client:
+            yield client
+
+    @contextmanager
+    def use(self, channel, owner=None, pipelined=False):
+        """
+        Yields the client of channel once it is idle, for requests of owner.
+        Pipelined writes of owner do not settle its own earlier writes.
+        """
+
+        with self._cond:
+            while channel.busy:
+                self._cond.wait()
+            channel.busy = True
+        with self._session(channel, owner, pipelined) as client:
+            yield client
+
+    def close(self):
+        with self._cond:
+            channels, self._channels = self._channels, []
+        for channel in channels:
+            self._close(channel)
+
+
+class Handle:
+    "An open remote file"
+
+    __slots__ = ("file", "channel", "mode", "lock", "error", "next_offset", "sequential", "prefetching")
+
+    def __init__(self, file, channel, mode):
+        self.file = file
+        self.channel = channel
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.error = None
+        self.next_offset = 0
+        self.sequential = 0
+        self.prefetching = False
+
+
+def _open_mode(flags):
+    "Translates open(2) flags to a paramiko file mode"
+
+    rdwr = (flags & os.O_ACCMODE) == os.O_RDWR
+    if flags & os.O_APPEND:
+        return "a+" if rdwr else "a"
+    if flags & os.O_TRUNC:
+        return "w+" if rdwr else "w"
+    if (flags & os.O_ACCMODE) == os.O_RDONLY:
+        return "r"
+    # paramiko has no write-only mode that does not truncate
+    return "r+"
+
+
+def _drain(file):
+    """
+    Waits for the responses to pipelined writes, returning the first error.
+
+    paramiko has no public API for this: another request on the client
+    would read the responses but drop their errors, and leave their ids in
+    file._reqs, where the next drain waits for them forever. This relies on
+    SFTPFile._reqs and SFTPClient._read_response, checked by the tests for
+    the pinned paramiko versions.
+    """
+
+    file.flush()
+    error = None
+    while file._reqs:
+        try:
+            file.sftp._read_response(file._reqs.popleft())
+        except OSError as e:
+            error = error or e
+    return error
+
+
+def _to_ns(seconds):
+    return int(seconds * 10**9) if seconds is not None else 0
+
+
+class SFTP(Operations):
+    """
+    Mounts root on an SFTP server.
+
+    connect is called to create every pooled SFTP client, by default it opens
+    an SFTP channel on a shared paramiko SSH connection to host. pool_size
+    should match the number of libfuse worker threads, and caps the number
+    of SFTP channels: it must not exceed the server's MaxSessions (10 by
+    default for OpenSSH). Beyond pool_size open files share channels. Sequential readers
+    start prefetching after readahead_after sequential reads, set it to None
+    to disable read-ahead.
+    """
+
+    use_ns = True
+
+    def __init__(
+        self, host=None, username=None, port=22, root="", pool_size=DEFAULT_POOL_SIZE, connect=None, readahead_after=2
+    ):
+        self.root = root.rstrip("/")
+        self.readahead_after = readahead_after
+        self.ssh = None
+        if connect is None:
+            connect = self._connect_factory(host, username, port)
+        self.pool = ChannelPool(connect, pool_size, settle=self._settle)
+        self._handles = {}
+        self._fhs = itertools.count(1)
+
+    def _connect_factory(self, host, username, port):
+        import paramiko
+
+        self.ssh = paramiko.SSHClient()
+        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.ssh.load_system_host_keys()
+        self.ssh.connect(host, port=port, username=username)
+        return self.ssh.open_sftp
+
+    def __call__(self, op, path, *args):
+        try:
+            return super().__call__(op, path, *args)
+        except OSError as e:
+            if e.errno:
+                raise
+            log.debug("SFTP operation %s failed without errno", op, exc_info=True)
+            raise FuseOSError(errno.EIO)
+        except Exception:
+            # paramiko.SFTPError, SSHException, EOFError, ...
+            log.warning("SFTP operation %s failed", op, exc_info=True)
+            raise FuseOSError(errno.EIO)
+
+    def _remote(self, path):
+        return self.root + path if path != "/" else self.root or "/"
+
+    def _add_handle(self, file, channel, mode):
+        fh = next(self._fhs)
+        self._handles[fh] = Handle(file, channel, mode)
+        return fh
+
+    def _handle(self, fh):
+        try:
+            return self._handles[fh]
+        except KeyError:
+            raise FuseOSError(errno.EBADF)
+
+    def destroy(self, path):
+        for fh in list(self._handles):
+            self._release(fh)
+        self.pool.close()
+        if self.ssh is not None:
+            self.ssh.close()
+
+    def getattr(self, path, fh=None):
+        if fh is not None and fh in self._handles:
+            handle = self._handles[fh]
+            with handle.lock, self.pool.use(handle.channel, handle):
+                st = handle.file.stat()
+        else:
+            with self.pool.channel() as sftp:
+                st = sftp.lstat(self._remote(path))
+
+        return dict(
+            st_mode=st.st_mode,
+            st_nlink=2 if stat.S_ISDIR(st.st_mode or 0) else 1,
+            st_size=st.st_size or 0,
+            st_uid=st.st_uid or 0,
+            st_gid=st.st_gid or 0,
+            st_atime=_to_ns(st.st_atime),
+            st_mtime=_to_ns(st.st_mtime),
+            st_ctime=_to_ns(st.st_mtime),
+        )
+
+    def readdir(self, path, fh, flags):
+        with self.pool.channel() as sftp:
+            return [".", ".."] + sftp.listdir(self._remote(path))
+
+    def readlink(self, path):
+        with self.pool.channel() as sftp:
+            return sftp.readlink(self._remote(path))
+
+    def mkdir(self, path, mode):
+        with self.pool.channel() as sftp:
+            sftp.mkdir(self._remote(path), mode)
+
+    def rmdir(self, path):
+        with self.pool.channel() as sftp:
+            sftp.rmdir(self._remote(path))
+
+    def unlink(self, path):
+        with self.pool.channel() as sftp:
+            sftp.remove(self._remote(path))
+
+    def symlink(self, target, source):
+        with self.pool.channel() as sftp:
+            sftp.symlink(source, self._remote(target))
+
+    def rename(self, old, new, flags):
+        if flags:
+            raise FuseOSError(errno.EINVAL)
+        with self.pool.channel() as sftp:
+            # Unlike rename, posix-rename@openssh.com replaces the target
+            sftp.posix_rename(self._remote(old), self._remote(new))
+
+    def _setstat(self, path, fh, name, *args):
+        "Calls the SFTPFile method name on open files, the SFTPClient one with the path otherwise"
+
+        if fh is not None and fh in self._handles:
+            handle = self._handles[fh]
+            with handle.lock, self.pool.use(handle.channel, handle):
+                getattr(handle.file, name)(*args)
+            return
+
+        with self.pool.channel() as sftp:
+            getattr(sftp, name)(self._remote(path), *args)
+
+    def chmod(self, path, mode, fh=None):
+        self._setstat(path, fh, "chmod", stat.S_IMODE(mode))
+
+    def chown(self, path, uid, gid, fh=None):
+        if uid == -1 or gid == -1:
+            st = self.getattr(path, fh)
+            uid = st["st_uid"] if uid == -1 else uid
+            gid = st["st_gid"] if gid == -1 else gid
+        self._setstat(path, fh, "chown", uid, gid)
+
+    def utimens(self, path, times=None, fh=None):
+        if times is not None:
+            times = (times[0] / 10**9, times[1] / 10**9)
+        self._setstat(path, fh, "utime", times)
+
+    def truncate(self, path, length, fh=None):
+        self._setstat(path, fh, "truncate", length)
+
+    def _settle(self, handle):
+        "Collects the responses to the pipelined writes of handle, see ChannelPool"
+
+        error = _drain(handle.file)
+        if handle.error is None:
+            handle.error = error
+
+    def _raise_error(self, handle):
+        error, handle.error = handle.error, None
+        if error is not None:
+            raise error
+
+    def _open(self, path, mode):
+        channel = self.pool.checkout()
+        try:
+            with self.pool.use(channel) as sftp:
+                file = sftp.open(self._remote(path), mode, bufsize=0)
+        except BaseException:
+            self.pool.checkin(channel)
+            raise
+
+        if mode != "r":
+            file.set_pipelined(True)
+        return self._add_handle(file, channel, mode)
+
+    def open(self, path, flags):
+        return self._open(path, _open_mode(flags))
+
+    def create(self, path, mode, fi=None):
+        fh = self._open(path, "w+")
+        handle = self._handles[fh]
+        with handle.lock, self.pool.use(handle.channel, handle):
+            handle.file.chmod(stat.S_IMODE(mode))
+        return fh
+
+    def read(self, path, size, offset, fh):
+        handle = self._handle(fh)
+        with handle.lock, self.pool.use(handle.channel, handle):
+            file = handle.file
+            if offset == handle.next_offset:
+                handle.sequential += 1
+            else:
+                handle.sequential = 0
+
+            if (
+                self.readahead_after is not None
+                and handle.mode == "r"
+                and not handle.prefetching
+                and handle.sequential >= self.readahead_after
+            ):
+                file.prefetch()
+                handle.prefetching = True
+
+            file.seek(offset)
+            data = file.read(size)
+            handle.next_offset = offset + len(data)
+            return data
+
+    def write(self, path, data, offset, fh):
+        handle = self._handle(fh)
+        channel = handle.channel
+        with handle.lock, self.pool.use(channel, handle, pipelined=True):
+            handle.file.seek(offset)
+            handle.file.write(data)
+            channel.dirty = handle
+            return len(data)
+
+    def flush(self, path, fh):
+        handle = self._handle(fh)
+        with handle.lock:
+            with self.pool.use(handle.channel, handle):
+                pass
+            self._raise_error(handle)
+
+    def fsync(self, path, datasync, fh):
+        self.flush(path, fh)
+
+    def _release(self, fh):
+        handle = self._handles.pop(fh)
+        with handle.lock:
+            try:
+                with self.pool.use(handle.channel, handle):
+                    handle.file.close()
+            finally:
+                self.pool.checkin(handle.channel)
+            self._raise_error(handle)
+
+    def release(self, path, fh):
+        if fh in self._handles:
+            self._release(fh)
+
+    def statfs(self, path):
+        return {}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from fuse3.fuse import FUSE3
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("remote", help="[user@]host[:path]")
+    parser.add_argument("mount")
+    parser.add_argument("-p", "--port", type=int, default=22)
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE)
+    args = parser.parse_args()
+
+    login, _, host = args.remote.rpartition("@")
+    host, _, root = host.partition(":")
+
+    logging.basicConfig(level=logging.INFO)
+    FUSE3(
+        SFTP(host, username=login or None, port=args.port, root=root, pool_size=args.pool_size),
+        args.mount,
+        foreground=True,
+    )
@@ -0,0 +1,251 @@
+"""
+Write-back buffering for high-latency backends.
+
+WriteBackMixIn collects contiguous writes to a file handle and passes them to
+the backend as one large write, so a program writing 4 KiB at a time causes a
+few backend writes instead of thousands:
+
+    class BufferedSFTP(WriteBackMixIn, SFTP):
+        writeback_size = 4 * 1024 * 1024
+
+Buffers are written when they are full, when a write is not contiguous with
+the buffered data, when they are older than writeback_delay seconds, and by
+flush, fsync and release. Errors of deferred writes are raised by the next
+flush, fsync or release of the handle, so close() and fsync() report them.
+"""
+
+import errno
+import os
+import threading
+import time
+
+
+class _Buffer:
+    "Dirty data of a file handle"
+
+    __slots__ = ("path", "opens", "shared", "offset", "data", "since", "error", "lock")
+
+    def __init__(self, path):
+        self.path = path
+        self.opens = 1
+        self.shared = False
+        self.offset = 0
+        self.data = bytearray()
+        self.since = None
+        self.error = None
+        self.lock = threading.Lock()
+
+
+class WriteBackMixIn:
+    """
+    Buffers up to writeback_size bytes of contiguous writes per file handle.
+
+    Reads, getattr, truncate, fallocate, lseek, copy_file_range, rename and
+    unlink of a file write its buffers first, so they are never stale. Set
+    writeback_delay to None to only write buffers when they are full or on
+    flush.
+
+    The backend must hand out a distinct fh for each open file. Writes to a
+    fh that is open more than once, e.g. the 0 every open() of Operations
+    returns, go straight to the backend.
+    """
+
+    writeback_size = 1024 * 1024
+    writeback_delay = 1.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._buffers = {}
+        self._buffers_lock = threading.Lock()
+        self._writeback_stop = threading.Event()
+        self._writeback_thread = None
+        if self.writeback_delay is not None:
+            self._writeback_thread = threading.Thread(target=self._writeback_loop, name="fuse-writeback", daemon=True)
+            self._writeback_thread.start()
+
+    def _writeback_loop(self):
+        while not self._writeback_stop.wait(self.writeback_delay / 2):
+            deadline = time.monotonic() - self.writeback_delay
+            with self._buffers_lock:
+                buffers = list(self._buffers.items())
+            for fh, buf in buffers:
+                with buf.lock:
+                    if buf.since is not None and buf.since <= deadline:
+                        self._writeback(buf, fh)
+
+    def _writeback(self, buf, fh):
+        "Writes the buffered data of fh, with buf.lock held"
+
+        if not buf.data:
+            return
+
+        data = bytes(buf.data)
+        offset = buf.offset
+        buf.data = bytearray()
+        buf.since = None
+        try:
+            while data:
+                n = super().write(buf.path, data, offset, fh)
+                if n <= 0:
+                    err = -n or errno.EIO
+                    raise OSError(err, os.strerror(err))
+                data = data[n:]
+                offset += n
+        except Exception as e:
+            if buf.error is None:
+                buf.error = e
+
+    def _raise_error(self, buf):
+        error, buf.error = buf.error, None
+        if error is not None:
+            raise error
+
+    def _writeback_path(self, path):
+        "Writes the buffers of all handles of path"
+
+        if not self._buffers:
+            return
+        with self._buffers_lock:
+            buffers = [(fh, buf) for fh, buf in self._buffers.items() if buf.path == path]
+        for fh, buf in buffers:
+            with buf.lock:
+                self._writeback(buf, fh)
+
+    def _writeback_file(self, path, fh=None):
+        "Writes the buffers of fh and of all handles of path"
+
+        buf = self._buffers.get(fh) if fh is not None else None
+        if buf is not None:
+            with buf.lock:
+                self._writeback(buf, fh)
+        if path is not None:
+            self._writeback_path(path)
+
+    def _call_backend(self, op, *args):
+        # fallocate, lseek and copy_file_range are optional, ENOSYS makes the
+        # kernel fall back as if they were not implemented
+        method = getattr(super(), op, None)
+        if method is None:
+            raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+        return method(*args)
+
+    def _track(self, path, ret):
+        # ret is a file handle or an OpenResult
+        fh = getattr(ret, "fh", ret)
+        with self._buffers_lock:
+            buf = self._buffers.get(fh)
+            if buf is None:
+                self._buffers[fh] = _Buffer(path)
+                return ret
+            buf.opens += 1
+        # The fh does not tell the files apart, stop buffering its writes
+        with buf.lock:
+            self._writeback(buf, fh)
+            buf.shared = True
+        return ret
+
+    def open(self, path, flags):
+        return self._track(path, super().open(path, flags))
+
+    def create(self, path, mode, fi=None):
+        return self._track(path, super().create(path, mode, fi))
+
+    def write(self, path, data, offset, fh):
+        buf = self._buffers.get(fh)
+        if buf is None:
+            return super().write(path, data, offset, fh)
+
+        with buf.lock:
+            if not buf.shared:
+                if buf.data and offset != buf.offset + len(buf.data):
+                    self._writeback(buf, fh)
+                if not buf.data:
+                    buf.offset = offset
+                    buf.since = time.monotonic()
+                buf.data += data
+                if len(buf.data) >= self.writeback_size:
+                    self._writeback(buf, fh)
+                return len(data)
+        return super().write(path, data, offset, fh)
+
+    def read(self, path, size, offset, fh):
+        self._writeback_file(path, fh)
+        return super().read(path, size, offset, fh)
+
+    def getattr(self, path, fh=None):
+        self._writeback_file(path, fh)
+        return super().getattr(path, fh)
+
+    def truncate(self, path, length, fh=None):
+        self._writeback_file(path, fh)
+        return super().truncate(path, length, fh)
+
+    def fallocate(self, path, mode, offset, length, fh):
+        self._writeback_file(path, fh)
+        return self._call_backend("fallocate", path, mode, offset, length, fh)
+
+    def lseek(self, path, off, whence, fh):
+        self._writeback_file(path, fh)
+        return self._call_backend("lseek", path, off, whence, fh)
+
+    def copy_file_range(self, path_in, fh_in, off_in, path_out, fh_out, off_out, size, flags):
+        self._writeback_file(path_in, fh_in)
+        self._writeback_file(path_out, fh_out)
+        return self._call_backend("copy_file_range", path_in, fh_in, off_in, path_out, fh_out, off_out, size, flags)
+
+    def rename(self, old, new, flags):
+        self._writeback_path(old)
+        self._writeback_path(new)
+        ret = super().rename(old, new, flags)
+        with self._buffers_lock:
+            for buf in self._buffers.values():
+                if buf.path == old:
+                    buf.path = new
+        return ret
+
+    def unlink(self, path):
+        self._writeback_path(path)
+        return super().unlink(path)
+
+    def flush(self, path, fh):
+        buf = self._buffers.get(fh)
+        if buf is not None:
+            with buf.lock:
+                self._writeback(buf, fh)
+                self._raise_error(buf)
+        return super().flush(path, fh)
+
+    def fsync(self, path, datasync, fh):
+        buf = self._buffers.get(fh)
+        if buf is not None:
+            with buf.lock:
+                self._writeback(buf, fh)
+                self._raise_error(buf)
+        return super().fsync(path, datasync, fh)
+
+    def release(self, path, fh):
+        with self._buffers_lock:
+            buf = self._buffers.get(fh)
+            if buf is not None:
+                buf.opens -= 1
+                if not buf.opens:
+                    del self._buffers[fh]
+        if buf is None:
+            return super().release(path, fh)
+
+        with buf.lock:
+            self._writeback(buf, fh)
+        ret = super().release(path, fh)
+        self._raise_error(buf)
+        return ret
+
+    def destroy(self, path):
+        self._writeback_stop.set()
+        if self._writeback_thread is not None:
+            self._writeback_thread.join()
+        with self._buffers_lock:
+            buffers = list(self._buffers.items())
+        for fh, buf in buffers:
+            with buf.lock:
+                self._writeback(buf, fh)
+        return super().destroy(path)
@@ -19,6 +19,7 @@ import ctypes
 import errno
 import logging
 import os
+import time
 import warnings
 from functools import partial
 from signal import SIG_DFL, SIGINT, signal
@@ -26,6 +27,10 @@ from stat import S_IFDIR
 
 from fuse3.c_fuse import (
     ENOTSUP,
+    FUSE_CAP_NO_OPEN_SUPPORT,
+    FUSE_CAP_WRITEBACK_CACHE,
+    UTIME_NOW,
+    UTIME_OMIT,
     c_gid_t,
     c_stat,
     c_uid_t,
@@ -34,7 +39,11 @@ from fuse3.c_fuse import (
     fuse_operations,
     get_fuse_context,
 )
+from fuse3.handles import HANDLE_FLAG, HandleTable
+from fuse3.request import Request
+from fuse3.request import _local as _request_local
 from fuse3.util import libfuse
+from fuse3.watchdog import Watchdog
 
 log = logging.getLogger("fuse")
 
@@ -62,11 +71,61 @@ def set_st_attrs(st, attrs, use_ns=False):
             setattr(st, key, val)
 
 
+# The operations returning the handles release and releasedir free
+_HANDLE_OPENERS = {"release": ("open", "create"), "releasedir": ("opendir",)}
+
+
 class FuseOSError(OSError):
     def __init__(self, errno):
         super(FuseOSError, self).__init__(errno, os.strerror(errno))
 
 
+class OpenResult:
+    """
+    A file handle with per-open fuse_file_info flags, which open(), create()
+    and opendir() can return instead of a plain file handle:
+
+    - keep_cache: keep the page cache of the file from previous opens
+    - direct_io: bypass the page cache, every read and write reaches the
+      filesystem with the size requested by the application
+    - parallel_direct_writes: allow concurrent direct_io writes to the file
+    - nonseekable: the file does not support seeking (e.g. a stream)
+    - noflush: do not call flush() on close(), unless there are locks
+    - cache_readdir: allow the kernel to cache the directory listing
+    """
+
+    __slots__ = ("fh", "keep_cache", "direct_io", "parallel_direct_writes", "nonseekable", "noflush", "cache_readdir")
+
+    def __init__(
+        self,
+        fh=0,
+        keep_cache=False,
+        direct_io=False,
+        parallel_direct_writes=False,
+        nonseekable=False,
+        noflush=False,
+        cache_readdir=False,
+    ):
+        self.fh = fh
+        self.keep_cache = keep_cache
+        self.direct_io = direct_io
+        self.parallel_direct_writes = parallel_direct_writes
+        self.nonseekable = nonseekable
+        self.noflush = noflush
+        self.cache_readdir = cache_readdir
+
+    def __repr__(self):
+        flags = ", ".join("%s=True" % name for name in self.__slots__[1:] if getattr(self, name))
+        return "OpenResult(%r%s)" % (self.fh, ", " + flags if flags else "")
+
+    def apply(self, fi):
+        "Sets the flags of the fuse_file_info fi"
+
+        for name in self.__slots__[1:]:
+            if getattr(self, name):
+                setattr(fi, name, 1)
+
+
 class FUSE3:
     """
     This class is the lower level interface and should not be subclassed under
@@ -81,17 +140,149 @@ class FUSE3:
         ("nothreads", "-s"),
     )
 
+    OPTIONAL_OPERATIONS = frozenset(
+        (
+            "access",
+            "flush",
+            "fsync",
+            "fsyncdir",
+            "getxattr",
+            "listxattr",
+            "release",
+            "releasedir",
+            "removexattr",
+            "setxattr",
+            "statfs",
+        )
+    )
+    """
+    Operations whose callback is left NULL when the operations object uses
+    the Operations default. libfuse or the kernel then behave like the
+    default (the kernel stops sending a request after its first ENOSYS), so
+    no Python code runs for them. listxattr() fails with EOPNOTSUPP instead
+    of returning an empty list, statfs() reports libfuse's defaults. release
+    and releasedir are kept when open, create or opendir are implemented, as
+    they free the handle table slots of the returned objects.
+    """
+
     def __init__(self, operations, mountpoint, raw_fi=False, encoding="utf-8", **kwargs):
         """
         Setting raw_fi to True will cause FUSE to pass the fuse_file_info
         class as is to Operations, instead of just the fh field.
 
         This gives you access to direct_io, keep_cache, etc.
+
+        A tracer can be passed to be called as tracer(request, result, end)
+        after every operation, where request is the fuse3.Request that was
+        handled and end the time.perf_counter_ns() at which it completed.
+        See fuse3.trace.ChromeTracer.
+
+        Setting writeback_cache to True enables the kernel's writeback cache
+        when the kernel supports it: writes are cached in the page cache and
+        sent to write() in large batches. In this mode the kernel, not the
+        filesystem, decides the file size and offset of appends, so open()
+        and create() see O_APPEND cleared and O_WRONLY turned into O_RDWR
+        (the kernel reads back pages to fill partial writes). Sizes and
+        mtimes returned by getattr() are only used while the kernel holds no
+        dirty pages for the file; it sends them with truncate() and
+        utimens() instead.
+
+        Setting parallel_direct_writes to True sets the fuse_config option
+        and the fuse_file_info bit of every opened file, so the kernel does
+        not serialize direct I/O writes to the same file on the inode lock.
+        It only applies to files opened with direct_io (see OpenResult and the
+        direct_io mount option) or O_DIRECT, and to writes that do not extend
+        the file. Operations must handle concurrent writes to the same file.
+
+        Setting nullpath_ok to True makes libfuse skip building the path of
+        operations on open files: read, write, flush, release, fsync,
+        fallocate, lseek, copy_file_range, lock, flock, ioctl, poll,
+        readdir, releasedir, fsyncdir, and getattr, truncate, chmod, chown
+        and utimens when called with a file handle all receive None as path,
+        and must use the file handle instead. hard_remove is set too, so
+        unlinked open files are removed right away instead of being renamed
+        to .fuse_hidden files. Operations must implement open() for this.
+
+        Setting kernel_permissions to True mounts with default_permissions
+        and does not register access(): the kernel checks every access
+        against the st_mode, st_uid and st_gid returned by getattr() (cached
+        for attr_timeout), the way local filesystems do, and permission
+        checks never reach Python. Operations then do not need to check
+        permissions themselves, but getattr() must report the real owner and
+        mode of every file. Combine it with allow_other to let other users
+        access the mount with the usual permission rules.
+
+        With the intr option (intr=True), libfuse interrupts the worker
+        thread with intr_signal (SIGUSR1 by default) when the system call of
+        a request is interrupted, e.g. by Ctrl-C. Python retries interrupted
+        system calls, so operations have to poll fuse3.is_interrupted() (or
+        Request.interrupted) to give up early, raising InterruptedError to
+        fail the request with EINTR.
+
+        An admission controller (see fuse3.admission.AdmissionController)
+        can be passed as admission to bound the number of operations running
+        at once, so overload queues requests instead of piling threads onto
+        the GIL and the backend. fuse3.admission.FairScheduler additionally
+        shares the slots fairly between users or processes.
+
+        Setting op_timeout to a number of seconds runs operations on a pool
+        of worker threads and fails calls taking longer with op_timeout_errno
+        (ETIMEDOUT by default, EIO is the other common choice), so a hung
+        backend cannot tie up every libfuse thread and wedge the mount.
+        op_timeouts maps operation names to their own timeout, None
+        disabling it. Timed out calls keep running with their Request marked
+        as interrupted, the watchdog attribute counts them, see
+        fuse3.watchdog.Watchdog. This cannot be combined with raw_fi.
+
+        Mounts the filesystem and blocks until it is unmounted, this is
+        equivalent to FUSE3.prepare(...).serve().
         """
 
+        self._prepare(operations, mountpoint, raw_fi, encoding, **kwargs)
+        self.serve()
+
+    @classmethod
+    def prepare(cls, operations, mountpoint, raw_fi=False, encoding="utf-8", **kwargs):
+        """
+        Builds the fuse_operations table and the libfuse arguments without
+        mounting, accepting the same arguments as FUSE3().
+
+        The returned instance exposes them as the fuse_ops and argv
+        attributes, which allows calling the installed callbacks directly in
+        tests and benchmarks. Call serve() on it to mount the filesystem.
+        """
+
+        self = cls.__new__(cls)
+        self._prepare(operations, mountpoint, raw_fi, encoding, **kwargs)
+        return self
+
+    def _prepare(self, operations, mountpoint, raw_fi, encoding, **kwargs):
         self.operations = operations
         self.raw_fi = raw_fi
         self.encoding = encoding
+        self.tracer = kwargs.pop("tracer", None)
+        self.admission = kwargs.pop("admission", None)
+        self.writeback_cache = kwargs.pop("writeback_cache", False)
+        self.writeback_cache_enabled = False
+        self.parallel_direct_writes = kwargs.pop("parallel_direct_writes", False)
+        self.nullpath_ok = kwargs.pop("nullpath_ok", False)
+        if self.nullpath_ok and self._inherited("open"):
+            raise ValueError("nullpath_ok requires an open() implementation returning file handles")
+        self.handles = HandleTable()
+
+        # Without open() and release() implementations, the kernel can be
+        # asked to stop sending open requests. Not for opendir: high-level
+        # libfuse allocates the directory handle readdir uses in opendir.
+        # The options libfuse applies to the fuse_file_info of successful
+        # opens would be ignored too.
+        self.no_open = False
+        self._want_no_open = (
+            not raw_fi
+            and not self.parallel_direct_writes
+            and not any(kwargs.get(option) for option in ("direct_io", "kernel_cache", "auto_cache"))
+            and self._inherited("open")
+            and self._inherited("release")
+        )
         self.__critical_exception = None
 
         self.use_ns = getattr(operations, "use_ns", False)
@@ -104,6 +295,16 @@ class FUSE3:
                 DeprecationWarning,
             )
 
+        self.kernel_permissions = kwargs.pop("kernel_permissions", False)
+        if self.kernel_permissions:
+            kwargs["default_permissions"] = True
+
+        op_timeout = kwargs.pop("op_timeout", None)
+        op_timeouts = kwargs.pop("op_timeouts", None)
+        op_timeout_errno = kwargs.pop("op_timeout_errno", errno.ETIMEDOUT)
+        if raw_fi and (op_timeout is not None or op_timeouts):
+            raise ValueError("op_timeout cannot be combined with raw_fi")
+
         args = ["fuse3"]
 
         args.extend(flag for arg, flag in self.OPTIONS if kwargs.pop(arg, False))
@@ -114,49 +315,76 @@ class FUSE3:
         args.append(mountpoint)
 
         args = [arg.encode(encoding) for arg in args]
-        argv = (ctypes.c_char_p * len(args))(*args)
-
-        fuse_ops = fuse_operations()
-        for ent in fuse_operations._fields_:
-            name, prototype = ent[:2]
+        self.argv = (ctypes.c_char_p * len(args))(*args)
 
-            check_name = name
+        self.fuse_ops = self._build_operations()
 
-            # ftruncate()/fgetattr() are implemented in terms of their
-            # non-f-prefixed versions in the operations object
-            if check_name in ["ftruncate", "fgetattr"]:
-                check_name = check_name[1:]
+        self.watchdog = None
+        if op_timeout is not None or op_timeouts:
+            self.watchdog = self.operations = Watchdog(operations, op_timeout, op_timeouts, op_timeout_errno)
 
-            val = getattr(operations, check_name, None)
-            if val is None:
-                continue
-
-            # Function pointer members are tested for using the
-            # getattr(operations, name) above but are dynamically
-            # invoked using self.operations(name)
-            if hasattr(prototype, "argtypes"):
-                val = prototype(partial(self._wrapper, getattr(self, name)))
-
-            setattr(fuse_ops, name, val)
+    def serve(self):
+        "Mounts the filesystem and handles requests until it is unmounted"
 
         try:
             old_handler = signal(SIGINT, SIG_DFL)
         except ValueError:
             old_handler = SIG_DFL
 
-        err = libfuse.fuse_main_real(len(args), argv, ctypes.pointer(fuse_ops), ctypes.sizeof(fuse_ops), None)
+        err = libfuse.fuse_main_real(
+            len(self.argv), self.argv, ctypes.pointer(self.fuse_ops), ctypes.sizeof(self.fuse_ops), None
+        )
 
         try:
             signal(SIGINT, old_handler)
         except ValueError:
             pass
 
+        if self.watchdog is not None:
+            self.watchdog.close()
+
         del self.operations  # Invoke the destructor
         if self.__critical_exception:
             raise self.__critical_exception
         if err:
             raise RuntimeError(err)
 
+    def _inherited(self, name):
+        "Whether the operations object uses the Operations implementation of name"
+
+        method = getattr(self.operations, name, None)
+        return method is not None and getattr(method, "__func__", None) is getattr(Operations, name)
+
+    def _opens_handles(self, release):
+        "Whether the operations implement an operation returning handles that release frees"
+
+        return any(not self._inherited(name) for name in _HANDLE_OPENERS.get(release, ()))
+
+    def _build_operations(self):
+        "Builds the fuse_operations table for the callbacks the operations object implements"
+
+        fuse_ops = fuse_operations()
+        for ent in fuse_operations._fields_:
+            name, prototype = ent[:2]
+
+            val = getattr(self.operations, name, None)
+            if val is None:
+                continue
+            if name in self.OPTIONAL_OPERATIONS and self._inherited(name) and not self._opens_handles(name):
+                continue
+            if name == "access" and self.kernel_permissions:
+                continue
+
+            # Function pointer members are tested for using the
+            # getattr(operations, name) above but are dynamically
+            # invoked using self.operations(name)
+            if hasattr(prototype, "argtypes"):
+                val = prototype(partial(self._wrapper, getattr(self, name)))
+
+            setattr(fuse_ops, name, val)
+
+        return fuse_ops
+
     @staticmethod
     def _normalize_fuse_options(**kargs):
         for key, value in kargs.items():
@@ -166,10 +394,27 @@ class FUSE3:
             else:
                 yield "%s=%s" % (key, value)
 
-    @staticmethod
-    def _wrapper(func, *args, **kwargs):
+    def _wrapper(self, func, *args, **kwargs):
         "Decorator for the methods that follow"
 
+        request = _request_local.request = Request(func.__name__)
+        ret = -errno.EFAULT
+        try:
+            if self.admission is None:
+                ret = self._dispatch(func, *args, **kwargs)
+            else:
+                ret = self.admission.call(request, partial(self._dispatch, func, *args, **kwargs))
+            return ret
+        finally:
+            _request_local.request = None
+            if self.tracer is not None:
+                try:
+                    self.tracer(request, ret, time.perf_counter_ns())
+                except Exception:
+                    log.error("Tracer failed for FUSE operation %s.", func.__name__, exc_info=True)
+
+    @staticmethod
+    def _dispatch(func, *args, **kwargs):
         try:
             if func.__name__ == "init":
                 # init may not fail, as its return code is just stored as
@@ -227,8 +472,14 @@ class FUSE3:
         return path.decode(self.encoding)
 
     def getattr(self, path, buf, fip):
+        ctypes.memset(buf, 0, ctypes.sizeof(c_stat))
+
+        st = buf.contents
         fh = self._get_fileheader(fip)
-        return self.fgetattr(path, buf, fh)
+
+        attrs = self.operations("getattr", self._decode_optional_path(path), fh)
+        set_st_attrs(st, attrs, use_ns=self.use_ns)
+        return 0
 
     def readlink(self, path, buf, bufsize):
         ret = self.operations("readlink", path.decode(self.encoding)).encode(self.encoding)
@@ -267,7 +518,7 @@ class FUSE3:
     def chmod(self, path, mode, fip):
         fh = self._get_fileheader(fip)
 
-        return self.operations("chmod", path.decode(self.encoding), mode, fh)
+        return self.operations("chmod", self._decode_optional_path(path), mode, fh)
 
     def chown(self, path, uid, gid, fip):
         # Check if any of the arguments is a -1 that has overflowed
@@ -277,17 +528,51 @@ class FUSE3:
             gid = -1
 
         fh = self._get_fileheader(fip)
-        return self.operations("chown", path.decode(self.encoding), uid, gid, fh)
+        return self.operations("chown", self._decode_optional_path(path), uid, gid, fh)
 
     def truncate(self, path, length, fip):
-        return self.operations("truncate", path.decode(self.encoding), length, fip)
+        fh = self._get_fileheader(fip)
+        return self.operations("truncate", self._decode_optional_path(path), length, fh)
+
+    def _set_fh(self, fi, ret):
+        if isinstance(ret, OpenResult):
+            ret.apply(fi)
+            ret = ret.fh
+        # Objects other than integers are stored in the handle table and
+        # passed back to the operations in place of the handle
+        fi.fh = ret if isinstance(ret, int) else self.handles.add(ret)
+
+    def _lookup_fh(self, fh):
+        if fh & HANDLE_FLAG:
+            return self.handles.get(fh)
+        return fh
+
+    def _free_fh(self, fip, raw_fi=False):
+        if not raw_fi and fip and fip.contents.fh & HANDLE_FLAG:
+            self.handles.remove(fip.contents.fh)
+
+    def _init_file_info(self, fi):
+        "Applies the mount wide file_info settings before open() or create()"
+
+        if self.parallel_direct_writes:
+            fi.parallel_direct_writes = 1
+        if self.writeback_cache_enabled:
+            flags = fi.flags & ~os.O_APPEND
+            if flags & os.O_ACCMODE == os.O_WRONLY:
+                flags = flags & ~os.O_ACCMODE | os.O_RDWR
+            fi.flags = flags
 
     def open(self, path, fip):
+        if self.no_open:
+            # Tells the kernel to not send open (and release) anymore
+            return -errno.ENOSYS
+
         fi = fip.contents
+        self._init_file_info(fi)
         if self.raw_fi:
             return self.operations("open", path.decode(self.encoding), fi)
         else:
-            fi.fh = self.operations("open", path.decode(self.encoding), fi.flags)
+            self._set_fh(fi, self.operations("open", path.decode(self.encoding), fi.flags))
 
             return 0
 
@@ -305,7 +590,13 @@ class FUSE3:
             size,
         )
 
-        ctypes.memmove(buf, ret, retsize)
+        if isinstance(ret, bytes):
+            ctypes.memmove(buf, ret, retsize)
+        else:
+            # bytearray, memoryview or any other buffer is copied directly
+            # into the kernel buffer, without an intermediate bytes object
+            dst = (ctypes.c_ubyte * retsize).from_address(ctypes.addressof(buf.contents))
+            memoryview(dst).cast("B")[:] = ret
         return retsize
 
     def write(self, path, buf, size, offset, fip):
@@ -330,7 +621,10 @@ class FUSE3:
 
     def release(self, path, fip):
         fh = self._get_fileheader(fip)
-        return self.operations("release", self._decode_optional_path(path), fh)
+        try:
+            return self.operations("release", self._decode_optional_path(path), fh)
+        finally:
+            self._free_fh(fip, self.raw_fi)
 
     def fsync(self, path, datasync, fip):
         fh = self._get_fileheader(fip)
@@ -389,13 +683,14 @@ class FUSE3:
 
     def opendir(self, path, fip):
         # Ignore raw_fi
-        fip.contents.fh = self.operations("opendir", path.decode(self.encoding))
+        self._set_fh(fip.contents, self.operations("opendir", path.decode(self.encoding)))
 
         return 0
 
     def readdir(self, path, buf, filler, offset, fip, flags):
         # Ignore raw_fi
-        for item in self.operations("readdir", self._decode_optional_path(path), fip.contents.fh, flags):
+        fh = self._lookup_fh(fip.contents.fh)
+        for item in self.operations("readdir", self._decode_optional_path(path), fh, flags):
             if isinstance(item, str):
                 name, st, offset = item, None, 0
             else:
@@ -412,14 +707,39 @@ class FUSE3:
 
     def releasedir(self, path, fip):
         # Ignore raw_fi
-        return self.operations("releasedir", self._decode_optional_path(path), fip.contents.fh)
+        try:
+            return self.operations("releasedir", self._decode_optional_path(path), self._lookup_fh(fip.contents.fh))
+        finally:
+            self._free_fh(fip)
 
     def fsyncdir(self, path, datasync, fip):
         # Ignore raw_fi
-        return self.operations("fsyncdir", self._decode_optional_path(path), datasync, fip.contents.fh)
+        return self.operations("fsyncdir", self._decode_optional_path(path), datasync, self._lookup_fh(fip.contents.fh))
 
     def init(self, conn=None, cfg=None):
+        if self.writeback_cache and conn:
+            if conn.contents.capable & FUSE_CAP_WRITEBACK_CACHE:
+                conn.contents.want |= FUSE_CAP_WRITEBACK_CACHE
+            else:
+                log.warning("writeback_cache is not supported by the kernel")
+
+        if self.parallel_direct_writes and cfg:
+            cfg.contents.parallel_direct_writes = 1
+        if self.nullpath_ok and cfg:
+            cfg.contents.nullpath_ok = 1
+            # Unlinked open files are only renamed to .fuse_hidden* to keep
+            # path based operations on them working
+            cfg.contents.hard_remove = 1
+
+        if conn:
+            if self._want_no_open and conn.contents.capable & FUSE_CAP_NO_OPEN_SUPPORT:
+                conn.contents.want |= FUSE_CAP_NO_OPEN_SUPPORT
+
         self.operations("init", "/", conn, cfg)
+        # operations.init() may have changed the negotiated flags
+        want = conn.contents.want if conn else 0
+        self.writeback_cache_enabled = bool(want & FUSE_CAP_WRITEBACK_CACHE)
+        self.no_open = self._want_no_open and bool(want & FUSE_CAP_NO_OPEN_SUPPORT)
         # This is because I saw a lot of examples returning the private_data field.
         return get_fuse_context().contents.private_data
 
@@ -431,45 +751,48 @@ class FUSE3:
 
     def create(self, path, mode, fip):
         fi = fip.contents
+        self._init_file_info(fi)
         path = path.decode(self.encoding)
 
         if self.raw_fi:
             return self.operations("create", path, mode, fi)
         else:
-            fi.fh = self.operations("create", path, mode)
+            self._set_fh(fi, self.operations("create", path, mode))
             return 0
 
-    def ftruncate(self, path, length, fip):
-        # couldn't use fip at this moment in time, setting it to None for operations.
-        return self.operations("truncate", self._decode_optional_path(path), length, None)
-
-    def fgetattr(self, path, buf, fip):
-        ctypes.memset(buf, 0, ctypes.sizeof(c_stat))
-
-        st = buf.contents
-        fh = self._get_fileheader(fip)
-
-        attrs = self.operations("getattr", self._decode_optional_path(path), fh)
-        set_st_attrs(st, attrs, use_ns=self.use_ns)
-        return 0
-
     def lock(self, path, fip, cmd, lock):
         fh = self._get_fileheader(fip)
 
         return self.operations("lock", self._decode_optional_path(path), fh, cmd, lock)
 
     def utimens(self, path, timespec, fip):
-        if timespec:
-            atime = time_of_timespec(timespec.actime, use_ns=self.use_ns)
-            mtime = time_of_timespec(timespec.modtime, use_ns=self.use_ns)
-            times = (atime, mtime)
-        else:
-            times = None
-
-        # Ignore fip for now
-        # it seems to crash once an attempt is made to open it.
+        path = self._decode_optional_path(path)
+        fh = self._get_fileheader(fip)
 
-        return self.operations("utimens", path.decode(self.encoding), times, None)
+        times = None
+        if timespec:
+            ts = timespec.contents
+            if ts.actime.tv_nsec != UTIME_NOW or ts.modtime.tv_nsec != UTIME_NOW:
+                times = self._resolve_times(path, fh, ts.actime, ts.modtime)
+
+        return self.operations("utimens", path, times, fh)
+
+    def _resolve_times(self, path, fh, *timespecs):
+        "Converts utimensat(2) timespecs, resolving UTIME_NOW and UTIME_OMIT"
+
+        now = time.time_ns() if self.use_ns else time.time()
+        attrs = None
+        times = []
+        for ts, key in zip(timespecs, ("st_atime", "st_mtime")):
+            if ts.tv_nsec == UTIME_NOW:
+                times.append(now)
+            elif ts.tv_nsec == UTIME_OMIT:
+                if attrs is None:
+                    attrs = self.operations("getattr", path, fh)
+                times.append(attrs.get(key, 0))
+            else:
+                times.append(time_of_timespec(ts, use_ns=self.use_ns))
+        return tuple(times)
 
     def bmap(self, path, blocksize, idx):
         return self.operations("bmap", path.decode(self.encoding), blocksize, idx)
@@ -477,40 +800,40 @@ class FUSE3:
     def ioctl(self, path, cmd, arg, fip, flags, data):
         fh = self._get_fileheader(fip)
 
-        return self.operations("ioctl", path.decode(self.encoding), cmd, arg, fh, flags, data)
+        return self.operations("ioctl", self._decode_optional_path(path), cmd, arg, fh, flags, data)
 
     def poll(self, path, fip, ph, reventsp):
         fh = self._get_fileheader(fip)
 
-        return self.operations("poll", path.decode(self.encoding), fh, ph, reventsp)
+        return self.operations("poll", self._decode_optional_path(path), fh, ph, reventsp)
 
     def write_buf(self, path, buf, off, fip):
         fh = self._get_fileheader(fip)
 
-        return self.operations("write_buf", path.decode(self.encoding), buf, off, fh)
+        return self.operations("write_buf", self._decode_optional_path(path), buf, off, fh)
 
     def read_buf(self, path, bufp, size, off, fip) -> int:
         fh = self._get_fileheader(fip)
 
-        return self.operations("read_buf", path.decode(self.encoding), bufp, size, off, fh)
+        return self.operations("read_buf", self._decode_optional_path(path), bufp, size, off, fh)
 
     def flock(self, path, fip, op):
         fh = self._get_fileheader(fip)
-        return self.operations("flock", path.decode(self.encoding), fh, op)
+        return self.operations("flock", self._decode_optional_path(path), fh, op)
 
     def fallocate(self, path, mode, offset, length, fip):
         fh = self._get_fileheader(fip)
-        return self.operations("fallocate", path.decode(self.encoding), mode, offset, length, fh)
+        return self.operations("fallocate", self._decode_optional_path(path), mode, offset, length, fh)
 
     def copy_file_range(self, path_in, fip_in, off_in, path_out, fip_out, off_out, size, flags):
         fh_1 = self._get_fileheader(fip_in)
         fh_2 = self._get_fileheader(fip_out)
         return self.operations(
             "copy_file_range",
-            path_in.decode(self.encoding),
+            self._decode_optional_path(path_in),
             fh_1,
             off_in,
-            path_out.decode(self.encoding),
+            self._decode_optional_path(path_out),
             fh_2,
             off_out,
             size,
@@ -519,7 +842,7 @@ class FUSE3:
 
     def lseek(self, path, off, whence, fip):
         fh = self._get_fileheader(fip)
-        return self.operations("lseek", path.decode(self.encoding), off, whence, fh)
+        return self.operations("lseek", self._decode_optional_path(path), off, whence, fh)
 
     def _get_fileheader(self, fip: fuse_file_info_p):
         if not fip:
@@ -530,7 +853,7 @@ class FUSE3:
 
         fh = fip.contents
         if not self.raw_fi:
-            fh = fh.fh
+            fh = self._lookup_fh(fh.fh)
 
         return fh
 
@@ -594,10 +917,14 @@ class Operations:
 
         raise FuseOSError(errno.EROFS)
 
-    def chmod(self, path, mode):
+    def chmod(self, path, mode, fh=None):
+        "fh is the file handle when called on an open file (fchmod), otherwise None"
+
         raise FuseOSError(errno.EROFS)
 
-    def chown(self, path, uid, gid):
+    def chown(self, path, uid, gid, fh=None):
+        "uid or gid is -1 when not changed. fh is as for chmod"
+
         raise FuseOSError(errno.EROFS)
 
     truncate = None
@@ -605,20 +932,23 @@ class Operations:
 
     Used for both ftruncate and truncate
 
-    signature: truncate(self, path: str, length: int, fd: int)
+    signature: truncate(self, path: str, length: int, fh: int)
 
     man page: `$ man ftruncate`
 
     Args:
         path: The file name
         length: the bytes to truncate
-        fd: the file descriptor (only used in ftruncate)
+        fh: the file handle if the file is open, otherwise None
     """
 
     def open(self, path, flags):
         """
         When raw_fi is False (default case), open should return a numerical
-        file handle.
+        file handle, or an OpenResult to also set per-open flags like
+        keep_cache or direct_io. Any other object is stored in a
+        fuse3.handles.HandleTable until release, and is passed as fh to the
+        operations on the open file.
 
         When raw_fi is True the signature of open becomes:
             open(self, path, fi)
@@ -628,8 +958,11 @@ class Operations:
 
         return 0
 
-    def read(self, path, size, offset, fh) -> str:
-        "Returns a string containing the data requested."
+    def read(self, path, size, offset, fh) -> bytes:
+        """
+        Returns the data requested, as bytes or any other object supporting
+        the buffer protocol, e.g. a memoryview of a bytearray.
+        """
 
         raise FuseOSError(errno.EIO)
 
@@ -669,7 +1002,7 @@ class Operations:
         raise FuseOSError(ENOTSUP)
 
     def opendir(self, path: str):
-        "Returns a numerical file handle."
+        "Returns a file handle, an object or an OpenResult like open."
 
         return 0
 
@@ -702,12 +1035,14 @@ class Operations:
         pass
 
     def access(self, path: str, amode):
+        "Not called when mounted with kernel_permissions, see FUSE3."
+
         return 0
 
     def create(self, path: str, mode, fi=None):
         """
         When raw_fi is False (default case), fi is None and create should
-        return a numerical file handle.
+        return a file handle, an object or an OpenResult like open.
 
         When raw_fi is True the file handle should be set directly by create
         and return 0.
@@ -717,8 +1052,11 @@ class Operations:
 
     lock = None
 
-    def utimens(self, path: str, times=None, fi=None):
-        "Times is a (atime, mtime) tuple. If None use current time."
+    def utimens(self, path: str, times=None, fh=None):
+        """
+        Times is a (atime, mtime) tuple. If None use current time. fh is as
+        for chmod.
+        """
 
         return 0
 
@@ -825,7 +1163,9 @@ class Operations:
     copy_file_range = None
     """Copy a range of data from one file to another.
 
-    Overwrites any data inside that range.
+    Overwrites any data inside that range. Implementations backed by file
+    descriptors can delegate to fuse3.contrib.copy.copy_file_range, which
+    reflinks or copies the data in the kernel.
 
     man page: `$ man copy_file_range`
 
@@ -869,11 +1209,42 @@ class Operations:
     """
 
 
+def _log_summary(value):
+    # Payload buffers are summarized by their length, formatting megabytes of
+    # read/write data into the log is never useful
+    if isinstance(value, memoryview):
+        return "<%d bytes>" % value.nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return "<%d bytes>" % len(value)
+    return value
+
+
 class LoggingMixIn:
+    """
+    Logs every operation with its arguments and return value.
+
+    Data buffers (bytes, bytearray and memoryview) are logged as their length.
+    Logging can be limited to specific operations by setting log_include to a
+    collection of operation names, or by listing operations to skip in
+    log_exclude, e.g.:
+
+        class Metadata(LoggingMixIn, Operations):
+            log_exclude = ("read", "write")
+    """
+
     log = logging.getLogger("fuse.log-mixin")
+    log_include = None
+    log_exclude = ()
 
     def __call__(self, op, path, *args):
-        self.log.debug("-> %s %s %s", op, path, repr(args))
+        if (
+            not self.log.isEnabledFor(logging.DEBUG)
+            or op in self.log_exclude
+            or (self.log_include is not None and op not in self.log_include)
+        ):
+            return getattr(self, op)(path, *args)
+
+        self.log.debug("-> %s %s %r", op, path, tuple(_log_summary(arg) for arg in args))
         ret = "[Unhandled Exception]"
         try:
             ret = getattr(self, op)(path, *args)
@@ -882,4 +1253,4 @@ class LoggingMixIn:
             ret = str(e)
             raise
         finally:
-            self.log.debug("<- %s %s", op, repr(ret))
+            self.log.debug("<- %s %r", op, _log_summary(ret))
@@ -0,0 +1,72 @@
+import errno
+import os
+import threading
+
+HANDLE_FLAG = 1 << 63
+"""Set in every file handle allocated by a HandleTable."""
+
+_INDEX_BITS = 32
+_INDEX_MASK = (1 << _INDEX_BITS) - 1
+_GENERATION_MASK = (1 << (63 - _INDEX_BITS)) - 1
+_SLAB_SIZE = 64
+
+
+class HandleTable:
+    """
+    Maps Python objects to 64-bit file handles.
+
+    A handle is HANDLE_FLAG | generation << 32 | slot. Slots are allocated in
+    slabs and reused after remove(), which increments their generation, so a
+    stale handle of a removed object is detected instead of resolving to the
+    object now using the slot.
+
+    Adding and removing take a lock, get() does not: a slot holds a
+    (generation, object) tuple, which is read atomically.
+    """
+
+    def __init__(self):
+        self._slots = []
+        self._generations = []
+        self._free = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._slots) - len(self._free)
+
+    def add(self, obj):
+        "Stores obj, returning its handle"
+
+        with self._lock:
+            if not self._free:
+                start = len(self._slots)
+                self._slots.extend([None] * _SLAB_SIZE)
+                self._generations.extend([1] * _SLAB_SIZE)
+                self._free.extend(range(start + _SLAB_SIZE - 1, start - 1, -1))
+
+            index = self._free.pop()
+            generation = self._generations[index]
+            self._slots[index] = (generation, obj)
+        return HANDLE_FLAG | generation << _INDEX_BITS | index
+
+    def get(self, fh):
+        "Returns the object of handle fh, raising EBADF for unknown or stale handles"
+
+        index = fh & _INDEX_MASK
+        try:
+            entry = self._slots[index]
+        except IndexError:
+            entry = None
+        if entry is None or entry[0] != (fh >> _INDEX_BITS) & _GENERATION_MASK or not fh & HANDLE_FLAG:
+            raise OSError(errno.EBADF, os.strerror(errno.EBADF))
+        return entry[1]
+
+    def remove(self, fh):
+        "Frees the slot of handle fh, returning its object"
+
+        with self._lock:
+            obj = self.get(fh)
+            index = fh & _INDEX_MASK
+            self._slots[index] = None
+            self._generations[index] = self._generations[index] % _GENERATION_MASK + 1
+            self._free.append(index)
+        return obj
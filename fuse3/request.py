@@ -0,0 +1,99 @@
+import errno
+import itertools
+import os
+import threading
+import time
+
+from fuse3.c_fuse import fuse_interrupted, get_fuse_context
+
+_local = threading.local()
+_request_ids = itertools.count(1)
+
+
+class Request:
+    """
+    Describes the FUSE request currently being handled by a thread.
+
+    Instances are created by the FUSE3 trampoline for every call from
+    libfuse, operations can access them through current_request().
+
+    The calling process credentials (uid, gid, pid and umask) are read from
+    fuse_get_context() the first time they are accessed, which has to happen
+    on the thread handling the request.
+
+    Long running operations can poll interrupted, or call
+    check_interrupted(), to give up on requests whose system call was
+    interrupted (see the intr mount option).
+    """
+
+    __slots__ = ("id", "op", "start", "_context", "_thread", "_interrupted")
+
+    def __init__(self, op):
+        self.id = next(_request_ids)
+        self.op = op
+        self.start = time.perf_counter_ns()
+        self._context = None
+        self._thread = threading.get_ident()
+        self._interrupted = False
+
+    def __repr__(self):
+        return "<Request id=%d op=%s>" % (self.id, self.op)
+
+    def _load_context(self):
+        if self._context is None:
+            ctx = get_fuse_context().contents
+            self._context = (ctx.uid, ctx.gid, ctx.pid, ctx.umask)
+        return self._context
+
+    @property
+    def uid(self):
+        return self._load_context()[0]
+
+    @property
+    def gid(self):
+        return self._load_context()[1]
+
+    @property
+    def pid(self):
+        return self._load_context()[2]
+
+    @property
+    def umask(self):
+        return self._load_context()[3]
+
+    @property
+    def interrupted(self):
+        """
+        Whether the kernel asked to interrupt the request. libfuse is only
+        asked on the thread handling the request, other threads (e.g. of an
+        executor the request was handed to) see True once it has been.
+        """
+
+        if not self._interrupted and threading.get_ident() == self._thread:
+            self._interrupted = fuse_interrupted()
+        return self._interrupted
+
+    def check_interrupted(self):
+        "Raises InterruptedError (EINTR) if the request was interrupted"
+
+        if self.interrupted:
+            raise InterruptedError(errno.EINTR, os.strerror(errno.EINTR))
+
+
+def current_request():
+    """
+    Returns the Request being handled by the calling thread, or None when
+    called outside of a FUSE operation.
+    """
+
+    return getattr(_local, "request", None)
+
+
+def is_interrupted():
+    """
+    Whether the request being handled by the calling thread was interrupted,
+    False outside of a FUSE operation.
+    """
+
+    request = current_request()
+    return request is not None and request.interrupted
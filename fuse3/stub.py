@@ -0,0 +1,86 @@
+"""
+In-process stand-in for libfuse3.
+
+Setting the FUSE3_LIBFUSE_STUB environment variable to 1 before importing
+fuse3 loads this module in place of the real library (see fuse3.util), so the
+binding layer can be unit tested, fuzzed and benchmarked without libfuse3 or
+/dev/fuse.
+
+fuse_main_real() does not mount anything: it calls the init callback, then
+mount_handler (if set) with the fuse_operations table, and finally destroy.
+"""
+
+import ctypes
+import threading
+
+mount_handler = None
+"""Called as mount_handler(fuse_ops, args, conn, cfg) while "mounted"."""
+
+mounts = []
+"""The decoded argument lists of every fuse_main_real() call."""
+
+capable = 0xFFFFFFFF
+"""The fuse_conn_info.capable flags passed to init, by default everything."""
+
+_local = threading.local()
+_exited = threading.Event()
+
+
+def set_context(uid=0, gid=0, pid=0, umask=0o022):
+    "Sets the values fuse_get_context() returns on the calling thread"
+
+    ctx = _get_context()
+    ctx.uid, ctx.gid, ctx.pid, ctx.umask = uid, gid, pid, umask
+
+
+def set_interrupted(interrupted=True):
+    "Sets the value fuse_interrupted() returns on the calling thread"
+
+    _local.interrupted = interrupted
+
+
+def _get_context():
+    from fuse3.c_fuse import fuse_context
+
+    ctx = getattr(_local, "context", None)
+    if ctx is None:
+        ctx = _local.context = fuse_context()
+    return ctx
+
+
+def fuse_get_context():
+    return ctypes.pointer(_get_context())
+
+
+def fuse_interrupted():
+    return int(getattr(_local, "interrupted", False))
+
+
+def fuse_exit(fuse):
+    _exited.set()
+
+
+def fuse_main_real(argc, argv, ops, size, user_data):
+    from fuse3.c_fuse import fuse_config, fuse_conn_info
+
+    fuse_ops = ops.contents
+    args = [argv[i].decode() for i in range(argc)]
+    mounts.append(args)
+    _exited.clear()
+
+    conn = fuse_conn_info(capable=capable)
+    cfg = fuse_config()
+
+    private_data = None
+    if fuse_ops.init:
+        private_data = fuse_ops.init(ctypes.pointer(conn), ctypes.pointer(cfg))
+    _get_context().private_data = private_data
+
+    try:
+        if mount_handler is not None:
+            mount_handler(fuse_ops, args, conn, cfg)
+    finally:
+        if fuse_ops.destroy:
+            fuse_ops.destroy(private_data)
+
+    return 0
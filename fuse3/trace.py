@@ -0,0 +1,60 @@
+import json
+import threading
+
+
+class ChromeTracer:
+    """
+    Writes every FUSE request as a complete ("X") event in the Chrome trace
+    event format, which can be loaded in chrome://tracing or Perfetto.
+
+    Events are grouped by the pid of the calling process so the trace shows
+    which clients generate load. Pass an instance as the tracer option to
+    FUSE3:
+
+        with ChromeTracer("trace.json") as tracer:
+            FUSE3(operations, mountpoint, tracer=tracer)
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "w")
+        self._file.write("[")
+        self._lock = threading.Lock()
+        self._first = True
+
+    def __call__(self, request, result, end):
+        event = {
+            "name": request.op,
+            "cat": "fuse",
+            "ph": "X",
+            "ts": request.start / 1000,
+            "dur": (end - request.start) / 1000,
+            "pid": request.pid,
+            "tid": threading.get_ident(),
+            "args": {
+                "id": request.id,
+                "uid": request.uid,
+                "gid": request.gid,
+                "result": result if isinstance(result, int) else None,
+            },
+        }
+        line = json.dumps(event)
+
+        with self._lock:
+            if self._file.closed:
+                return
+            if not self._first:
+                self._file.write(",\n")
+            self._first = False
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.write("]\n")
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -8,6 +8,11 @@ _system = system()
 
 
 def load_libfuse():
+    if os.environ.get("FUSE3_LIBFUSE_STUB") == "1":
+        from fuse3 import stub
+
+        return stub
+
     _libfuse_path = os.environ.get("FUSE_LIBRARY_PATH")
     if not _libfuse_path:
         _libfuse_path = _find_libfuse()
@@ -0,0 +1,152 @@
+import errno
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from fuse3.request import _local as _request_local
+from fuse3.request import current_request
+
+log = logging.getLogger("fuse.watchdog")
+
+UNTIMED_OPERATIONS = frozenset(("init", "destroy", "bmap", "ioctl", "lock", "poll", "read_buf", "write_buf"))
+"""
+Operations that always run on the libfuse thread: init and destroy, and the
+ones receiving pointers to libfuse memory, which must not be used after the
+reply was sent.
+"""
+
+_RELEASES = {"open": "release", "create": "release", "opendir": "releasedir"}
+
+# How often a waiting libfuse thread checks whether its request was
+# interrupted, in seconds
+_POLL_INTERVAL = 0.1
+
+
+class Watchdog:
+    """
+    Calls operations on a pool of worker threads and fails calls taking
+    longer than their timeout with error, so a hung backend ties up workers
+    instead of every libfuse thread.
+
+    timeout applies to all operations, timeouts maps operation names to
+    overrides, None disabling the timeout. A call that timed out keeps running
+    in its worker, with its Request marked as interrupted so it can give up
+    early (see Request.check_interrupted()), as are calls whose system call
+    was interrupted while they run. Handles returned by open, create and
+    opendir calls that completed after timing out are released right away,
+    as the kernel never learns about them. timed_out counts timed out calls
+    per operation, stuck is the number of them still running.
+    """
+
+    def __init__(self, operations, timeout=None, timeouts=None, error=errno.ETIMEDOUT, workers=32):
+        self.operations = operations
+        self.timeout = timeout
+        self.timeouts = dict(timeouts or {})
+        self.error = error
+        self.timed_out = Counter()
+        self.stuck = 0
+        self._lock = threading.Lock()
+        self._queue = queue.SimpleQueue()
+        self._workers = [
+            threading.Thread(target=self._work, name="fuse-watchdog-%d" % i, daemon=True) for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def __getattr__(self, name):
+        return getattr(self.operations, name)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            future, request, op, args = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            _request_local.request = request
+            ret = error = None
+            try:
+                ret = self.operations(op, *args)
+                if op == "readdir":
+                    # Run generators on the worker too
+                    ret = list(ret)
+            except BaseException as e:
+                error = e
+            finally:
+                _request_local.request = None
+
+            # The result is published with the lock held, so __call__ either
+            # gets it or has marked the call as timed out
+            with self._lock:
+                orphaned = future.timed_out
+                if orphaned:
+                    self.stuck -= 1
+                elif error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(ret)
+            if orphaned and error is None and op in _RELEASES:
+                self._release(op, args[0], ret)
+
+    def _release(self, op, path, ret):
+        "Releases the handle returned by a call to op that timed out"
+
+        try:
+            self.operations(_RELEASES[op], path, getattr(ret, "fh", ret))
+        except Exception:
+            log.warning("Releasing the result of timed out FUSE operation %s failed", op, exc_info=True)
+
+    def __call__(self, op, *args):
+        timeout = self.timeouts.get(op, self.timeout)
+        if timeout is None or op in UNTIMED_OPERATIONS:
+            return self.operations(op, *args)
+
+        request = current_request()
+        if request is not None:
+            # fuse_get_context() only works on the libfuse thread
+            request._load_context()
+
+        future = Future()
+        future.timed_out = False
+        self._queue.put((future, request, op, args))
+
+        deadline = time.monotonic() + timeout
+        while True:
+            # Wait in slices, reading request.interrupted passes an
+            # interruption on to the worker
+            remaining = deadline - time.monotonic()
+            try:
+                return future.result(max(0, min(remaining, _POLL_INTERVAL)))
+            except FutureTimeoutError:
+                pass
+            if request is not None:
+                request.interrupted
+            if remaining <= _POLL_INTERVAL:
+                break
+
+        with self._lock:
+            if not future.done():
+                self.timed_out[op] += 1
+                if not future.cancel():
+                    future.timed_out = True
+                    self.stuck += 1
+        if not future.cancelled() and future.done():
+            return future.result()
+
+        if request is not None:
+            request._interrupted = True
+        log.warning("FUSE operation %s timed out after %s seconds", op, timeout)
+        raise OSError(self.error, os.strerror(self.error))
+
+    def close(self):
+        "Stops the idle workers, leaving stuck ones to finish in the background"
+
+        for _ in self._workers:
+            self._queue.put(None)
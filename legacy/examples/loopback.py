@@ -7,7 +7,7 @@ from errno import EACCES
 from os.path import realpath
 from threading import Lock
 
-from fuse import FUSE3, FuseOSError, LoggingMixIn, Operations
+from fuse3 import FUSE3, FuseOSError, LoggingMixIn, Operations
 
 
 class Loopback(LoggingMixIn, Operations):
@@ -22,8 +22,11 @@ class Loopback(LoggingMixIn, Operations):
         if not os.access(path, mode):
             raise FuseOSError(EACCES)
 
-    chmod = os.chmod
-    chown = os.chown
+    def chmod(self, path, mode, fh=None):
+        return os.chmod(path, mode)
+
+    def chown(self, path, uid, gid, fh=None):
+        return os.chown(path, uid, gid)
 
     def create(self, path, mode):
         return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
@@ -68,7 +71,7 @@ class Loopback(LoggingMixIn, Operations):
             os.lseek(fh, offset, 0)
             return os.read(fh, size)
 
-    def readdir(self, path, fh):
+    def readdir(self, path, fh, flags):
         return [".", ".."] + os.listdir(path)
 
     readlink = os.readlink
@@ -76,7 +79,7 @@ class Loopback(LoggingMixIn, Operations):
     def release(self, path, fh):
         return os.close(fh)
 
-    def rename(self, old, new):
+    def rename(self, old, new, flags):
         return os.rename(old, self.root + new)
 
     rmdir = os.rmdir
@@ -107,7 +110,9 @@ class Loopback(LoggingMixIn, Operations):
             f.truncate(length)
 
     unlink = os.unlink
-    utimens = os.utime
+
+    def utimens(self, path, times=None, fh=None):
+        return os.utime(path, times)
 
     def write(self, path, data, offset, fh):
         with self.rwlock:
@@ -7,7 +7,7 @@ from errno import ENOENT
 from stat import S_IFDIR, S_IFLNK, S_IFREG
 from time import time
 
-from fuse import FUSE3, FuseOSError, LoggingMixIn, Operations
+from fuse3 import FUSE3, FuseOSError, LoggingMixIn, Operations
 
 if not hasattr(__builtins__, "bytes"):
     bytes = str
@@ -29,12 +29,12 @@ class Memory(LoggingMixIn, Operations):
             st_nlink=2,
         )
 
-    def chmod(self, path, mode):
+    def chmod(self, path, mode, fh=None):
         self.files[path]["st_mode"] &= 0o770000
         self.files[path]["st_mode"] |= mode
         return 0
 
-    def chown(self, path, uid, gid):
+    def chown(self, path, uid, gid, fh=None):
         self.files[path]["st_uid"] = uid
         self.files[path]["st_gid"] = gid
 
@@ -88,7 +88,7 @@ class Memory(LoggingMixIn, Operations):
     def read(self, path, size, offset, fh):
         return self.data[path][offset : offset + size]
 
-    def readdir(self, path, fh):
+    def readdir(self, path, fh, flags):
         return [".", ".."] + [x[1:] for x in self.files if x != "/"]
 
     def readlink(self, path):
@@ -102,7 +102,7 @@ class Memory(LoggingMixIn, Operations):
         except KeyError:
             pass  # Should return ENOATTR
 
-    def rename(self, old, new):
+    def rename(self, old, new, flags):
         self.data[new] = self.data.pop(old)
         self.files[new] = self.files.pop(old)
 
@@ -133,7 +133,7 @@ class Memory(LoggingMixIn, Operations):
         self.data.pop(path)
         self.files.pop(path)
 
-    def utimens(self, path, times=None):
+    def utimens(self, path, times=None, fh=None):
         now = time()
         atime, mtime = times if times else (now, now)
         self.files[path]["st_atime"] = atime
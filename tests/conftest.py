@@ -0,0 +1,35 @@
+import ctypes
+import os
+import time
+
+import pytest
+
+# Run the binding layer against the in-process libfuse stand-in, so the tests
+# do not depend on libfuse3 or /dev/fuse being available
+os.environ.setdefault("FUSE3_LIBFUSE_STUB", "1")
+
+
+@pytest.fixture
+def call_getattr():
+    "Calls the getattr callback FUSE3 installed, returning its status"
+
+    # Imported late, libfuse is loaded on import
+    from fuse3.c_fuse import c_stat
+
+    def call_getattr(fuse, path):
+        return fuse._wrapper(fuse.getattr, path, ctypes.pointer(c_stat()), None)
+
+    return call_getattr
+
+
+@pytest.fixture
+def wait_for():
+    "Waits for condition() to become true, failing the test after timeout seconds"
+
+    def wait_for(condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert condition()
+
+    return wait_for
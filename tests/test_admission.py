@@ -0,0 +1,144 @@
+import ctypes
+import errno
+import threading
+
+from fuse3 import FUSE3, Operations, current_request, stub
+from fuse3.admission import AdmissionController, FairScheduler
+from fuse3.c_fuse import fuse_file_info
+
+
+class Blocking(Operations):
+    use_ns = True
+
+    def __init__(self):
+        self.unblock = threading.Event()
+        self.entered = threading.Semaphore(0)
+        self.served = []
+        self.on_read = None
+
+    def getattr(self, path, fh=None):
+        if path == "/hang":
+            self.entered.release()
+            self.unblock.wait()
+        self.served.append((current_request().uid, "getattr"))
+        return dict(st_mode=0o40755)
+
+    def read(self, path, size, offset, fh):
+        self.served.append((current_request().uid, "read"))
+        if self.on_read is not None:
+            self.on_read()
+        return b"data"
+
+
+def read(fuse):
+    buf = ctypes.create_string_buffer(4)
+    return fuse._wrapper(fuse.read, b"/", buf, 4, 0, ctypes.pointer(fuse_file_info()))
+
+
+def test_admission(call_getattr, wait_for):
+    ops = Blocking()
+    admission = AdmissionController(metadata=1, data=1, max_queue=1)
+    fuse = FUSE3.prepare(ops, "/mnt", admission=admission)
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(call_getattr(fuse, b"/hang")))
+    first.start()
+    ops.entered.acquire()
+    second = threading.Thread(target=lambda: results.append(call_getattr(fuse, b"/")))
+    second.start()
+    wait_for(lambda: admission.queue_depth == 1)
+
+    # The queue is full, data operations are admitted separately
+    assert call_getattr(fuse, b"/") == -errno.EAGAIN
+    assert read(fuse) == 4
+    assert fuse._wrapper(fuse.release, b"/", ctypes.pointer(fuse_file_info())) == 0
+    assert admission.stats()["metadata"] == dict(limit=1, in_flight=1, queued=1, admitted=1, rejected=1)
+
+    ops.unblock.set()
+    first.join()
+    second.join()
+    assert results == [0, 0]
+    assert admission.stats() == {
+        "metadata": dict(limit=1, in_flight=0, queued=0, admitted=2, rejected=1),
+        "data": dict(limit=1, in_flight=0, queued=0, admitted=1, rejected=0),
+    }
+
+
+def test_queue_timeout(call_getattr):
+    ops = Blocking()
+    admission = AdmissionController(metadata=1, queue_timeout=0.05, error=errno.EBUSY)
+    fuse = FUSE3.prepare(ops, "/mnt", admission=admission)
+
+    first = threading.Thread(target=call_getattr, args=(fuse, b"/hang"))
+    first.start()
+    ops.entered.acquire()
+    assert call_getattr(fuse, b"/") == -errno.EBUSY
+    assert admission.queue_depth == 0
+
+    ops.unblock.set()
+    first.join()
+    assert call_getattr(fuse, b"/") == 0
+
+
+def test_fair_scheduler(call_getattr, wait_for):
+    ops = Blocking()
+    scheduler = FairScheduler(1, weights={2: 2}, max_queue=4)
+    fuse = FUSE3.prepare(ops, "/mnt", admission=scheduler)
+    threads = []
+    results = []
+
+    def submit(uid, call, *args):
+        def run():
+            stub.set_context(uid=uid)
+            results.append(call(*args))
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        threads.append(thread)
+
+    submit(0, call_getattr, fuse, b"/hang")
+    ops.entered.acquire()
+
+    # uid 1 queues a burst of reads, uid 2 (with twice the weight) and uid 3
+    # arrive later, uid 1 finally lists a directory
+    try:
+        for uid, call, args in (
+            [(1, read, [fuse])] * 3 + [(2, read, [fuse])] * 2 + [(3, read, [fuse]), (1, call_getattr, [fuse, b"/"])]
+        ):
+            depth = scheduler.queue_depth
+            submit(uid, call, *args)
+            wait_for(lambda: scheduler.queue_depth == depth + 1)
+
+        stub.set_context(uid=1)
+        assert read(fuse) == -errno.EAGAIN
+
+        stats = scheduler.tenant_stats()
+        assert stats[0] == dict(weight=1, in_flight=1, queued=0, admitted=1, rejected=0, wait_ns=0)
+        assert stats[1] == dict(weight=1, in_flight=0, queued=4, admitted=0, rejected=1, wait_ns=0)
+        assert stats[2]["queued"] == 2 and stats[2]["weight"] == 2
+        snapshots = []
+        ops.on_read = lambda: snapshots.append(scheduler.tenant_stats())
+    finally:
+        stub.set_context()
+        ops.unblock.set()
+        for thread in threads:
+            thread.join()
+
+    assert ops.served[1:] == [
+        (1, "getattr"),
+        (2, "read"),
+        (1, "read"),
+        (2, "read"),
+        (3, "read"),
+        (1, "read"),
+        (1, "read"),
+    ]
+    assert results.count(0) == 2 and results.count(4) == 6
+
+    # Tenants are forgotten once idle
+    stats = snapshots[-1]
+    assert list(stats) == [1]
+    assert stats[1] == dict(weight=1, in_flight=1, queued=0, admitted=4, rejected=1, wait_ns=stats[1]["wait_ns"])
+    assert stats[1]["wait_ns"] > 0
+    assert scheduler.tenant_stats() == {} and scheduler.tenants == {}
+    assert scheduler.stats()["all"]["in_flight"] == 0
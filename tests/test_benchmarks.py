@@ -0,0 +1,35 @@
+from benchmarks import dispatch, e2e
+from fuse3 import Operations
+
+
+def test_dispatch_benchmarks():
+    results = dispatch.run(iterations=50, repeat=1)
+
+    assert [result["name"] for result in results] == list(dispatch.BENCHMARKS)
+    for result in results:
+        assert result["ns_per_op"] > 0
+        assert result["ops_per_sec"] > 0
+
+
+def test_e2e_workloads(tmp_path):
+    params = e2e.Params(threads=2, file_size=64 << 10, block_size=16 << 10, io_count=8, files=4, entries=8)
+    results = e2e.run_workloads(str(tmp_path), params)
+
+    assert [result["name"] for result in results] == list(e2e.WORKLOADS)
+    by_name = {result["name"]: result for result in results}
+    assert by_name["seq_write"]["bytes"] == 2 * params.file_size
+    assert by_name["seq_read"]["bytes"] == 2 * params.file_size
+    assert by_name["rand_read_4k"]["ops"] == 2 * params.io_count
+    assert by_name["metadata"]["ops"] == 2 * 3 * params.files
+    assert by_name["readdir"]["ops"] == 2 * 5 * params.entries
+    assert by_name["shared_write"]["bytes"] == 2 * params.io_count * params.block_size
+    assert (tmp_path / "shared").stat().st_size == params.file_size
+
+
+def test_e2e_parse_options():
+    assert e2e.parse_options(["direct_io", "max_threads=4"]) == {"direct_io": True, "max_threads": "4"}
+
+
+def test_e2e_load_bundled_filesystems():
+    for spec, _ in e2e.FILESYSTEMS.values():
+        assert issubclass(e2e.load_operations(spec), Operations)
@@ -0,0 +1,204 @@
+import errno
+import threading
+
+import pytest
+
+from fuse3.contrib.cache import BlockCache, BlockCacheMixIn
+from fuse3.fuse import Operations
+
+
+class Backend(Operations):
+    "Serves a single bytearray per path, recording every read"
+
+    def __init__(self):
+        self.files = {}
+        self.reads = []
+        self.mtime = 0
+        self.handles = 0
+        self.lock = threading.Lock()
+
+    def getattr(self, path, fh=None):
+        return dict(st_size=len(self.files[path]), st_mtime=self.mtime)
+
+    def open(self, path, flags):
+        self.handles += 1
+        return self.handles
+
+    def read(self, path, size, offset, fh):
+        with self.lock:
+            self.reads.append((offset, size))
+        return bytes(self.files[path][offset : offset + size])
+
+    def write(self, path, data, offset, fh):
+        buf = self.files[path]
+        buf[len(buf) : offset] = bytes(max(0, offset - len(buf)))
+        buf[offset : offset + len(data)] = data
+        return len(data)
+
+    def truncate(self, path, length, fh=None):
+        del self.files[path][length:]
+
+    def unlink(self, path):
+        del self.files[path]
+
+    def release(self, path, fh):
+        return 0
+
+
+class Cached(BlockCacheMixIn, Backend):
+    block_size = 16
+    cache_size = 64
+    readahead = 0
+
+
+@pytest.fixture
+def fs():
+    fs = Cached()
+    fs.files["/file"] = bytearray(bytes(range(100)))
+    yield fs
+    fs("destroy", "/")
+
+
+def test_blocks(fs):
+    fh = fs("open", "/file", 0)
+    assert fs("read", "/file", 10, 12, fh) == bytes(range(12, 22))
+    assert fs.reads == [(0, 32)]
+    assert fs("read", "/file", 4, 20, fh) == bytes(range(20, 24))
+    assert fs.reads == [(0, 32)]
+
+    # Only the missing blocks are fetched, in one run, up to the end of file
+    assert fs("read", "/file", 200, 24, fh) == bytes(range(24, 100))
+    assert fs.reads == [(0, 32), (32, 192)]
+    assert fs.block_cache.memory.size <= 64
+
+
+def test_invalidation(fs):
+    fh = fs("open", "/file", 0)
+    assert fs("read", "/file", 200, 0, fh) == bytes(range(100))
+
+    fs("write", "/file", b"xx", 20, fh)
+    assert fs("read", "/file", 4, 20, fh) == b"xx\x16\x17"
+
+    # Extending the file invalidates the short last block
+    fs("write", "/file", b"yy", 110, fh)
+    assert fs("read", "/file", 20, 96, fh) == bytes(range(96, 100)) + bytes(10) + b"yy"
+
+    fs("truncate", "/file", 50)
+    assert fs("read", "/file", 100, 40, fh) == bytes(range(40, 50))
+
+    # Changes by someone else are picked up on open
+    assert fs("read", "/file", 1, 0, fh) == b"\x00"
+    fs.files["/file"][0:1] = b"z"
+    assert fs("read", "/file", 1, 0, fh) == b"\x00"
+    fs.mtime += 1
+    fh = fs("open", "/file", 0)
+    assert fs("read", "/file", 1, 0, fh) == b"z"
+
+
+class Linked(Backend):
+    "Hard links share a bytearray, which is also the file's inode"
+
+    def getattr(self, path, fh=None):
+        return dict(super().getattr(path, fh), st_ino=id(self.files[path]))
+
+    def copy_file_range(self, path_in, fh_in, off_in, path_out, fh_out, off_out, size, flags):
+        return super().write(path_out, self.files[path_in][off_in : off_in + size], off_out, fh_out)
+
+
+def test_file_identity():
+    class CachedLinked(Cached, Linked):
+        pass
+
+    fs = CachedLinked()
+    fs.files["/file"] = fs.files["/link"] = bytearray(bytes(range(100)))
+    fs.files["/other"] = bytearray(b"o" * 100)
+    fh = fs("open", "/file", 0)
+    other = fs("open", "/other", 0)
+    assert fs("read", "/file", 2, 0, fh) == b"\x00\x01"
+
+    # Writes through another name invalidate the same blocks
+    link = fs("open", "/link", 0)
+    fs("write", "/link", b"ab", 0, link)
+    assert fs("read", "/file", 2, 0, fh) == b"ab"
+
+    assert fs("read", "/other", 2, 0, other) == b"oo"
+    assert fs("copy_file_range", "/file", fh, 0, "/other", other, 0, 2, 0) == 2
+    assert fs("read", "/other", 2, 0, other) == b"ab"
+
+    # Handles do not need paths
+    assert fs("read", None, 2, 2, fh) == b"\x02\x03"
+    assert fs("read", None, 2, 2, other) == b"oo"
+    fs("destroy", "/")
+
+
+def test_missing_operations(fs):
+    fh = fs("open", "/file", 0)
+    with pytest.raises(OSError) as e:
+        fs("fallocate", "/file", 0, 0, 16, fh)
+    assert e.value.errno == errno.ENOSYS
+
+
+def test_forgets_files():
+    fs = Cached()
+    cache = fs.block_cache
+    for i in range(50):
+        path = "/file-%d" % i
+        fs.files[path] = bytearray(bytes(40))
+        fh = fs("open", path, 0)
+        assert fs("read", path, 40, 0, fh) == bytes(40)
+        fs("write", path, b"x", 0, fh)
+        fs("release", path, fh)
+        if i % 2:
+            fs("unlink", path)
+
+    # Only files with cached blocks are remembered
+    cached = set(path for path, _ in cache.memory.blocks)
+    assert 0 < len(cached) <= 4
+    assert set(cache.generations) == set(cache.versions) == cached
+    assert set(cache.eof) <= cached and not cache.opened
+
+    # Handles of unlinked files keep a key of their own while open
+    fh = fs("open", "/file-0", 0)
+    fs("unlink", "/file-0")
+    assert [type(key) for key in cache.opened] == [object]
+    fs("release", None, fh)
+    assert not cache.opened
+    assert all(isinstance(key, str) for key in cache.generations)
+    fs("destroy", "/")
+
+
+def test_readahead():
+    class ReadAhead(Cached):
+        readahead = 4
+        cache_size = 1024
+
+    fs = ReadAhead()
+    fs.files["/file"] = bytearray(range(256))
+    fh = fs("open", "/file", 0)
+    data = b"".join(bytes(fs("read", "/file", 16, offset, fh)) for offset in range(0, 256, 16))
+    fs("release", "/file", fh)
+    fs("destroy", "/")
+
+    assert data == bytes(range(256))
+    # Sequential reads were mostly served by read-ahead
+    assert len(fs.reads) < 8
+    assert any(size > 16 for offset, size in fs.reads)
+
+
+def test_spill(tmp_path):
+    cache = BlockCache(4, 8, spill_dir=str(tmp_path), spill_size=8)
+    for index in range(4):
+        cache.put("/file", index, bytes([index]) * 4, 0)
+
+    assert cache.memory.size == 8
+    assert cache.get("/file", 0) == b"\x00" * 4
+    assert cache.get("/file", 1) == b"\x01" * 4
+
+    cache.put("/file", 4, b"\x04", 0)
+    assert cache.get("/file", 2) is None
+    assert cache.get("/file", 4) == b"\x04"
+
+    cache.invalidate("/file")
+    assert all(cache.get("/file", index) is None for index in range(5))
+    assert len(cache.spill.free) == 2
+    cache.close()
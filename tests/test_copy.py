@@ -0,0 +1,65 @@
+import errno
+import os
+
+import pytest
+
+from fuse3.contrib import copy
+
+
+@pytest.fixture
+def files(tmp_path):
+    data = os.urandom(3 * 4096 + 100)
+    (tmp_path / "src").write_bytes(data)
+    fd_in = os.open(tmp_path / "src", os.O_RDONLY)
+    fd_out = os.open(tmp_path / "dst", os.O_RDWR | os.O_CREAT)
+    yield data, fd_in, fd_out
+    os.close(fd_in)
+    os.close(fd_out)
+
+
+def test_copy_file_range(files):
+    data, fd_in, fd_out = files
+
+    assert copy.copy_file_range(fd_in, 4096, fd_out, 10, 4096) == 4096
+    assert os.pread(fd_out, 8192, 10) == data[4096:8192]
+    # copies stop at the end of the source
+    assert copy.copy_file_range(fd_in, 8192, fd_out, 0, 1 << 20) == len(data) - 8192
+    assert copy.copy_file_range(fd_in, len(data), fd_out, 0, 10) == 0
+    assert os.lseek(fd_in, 0, os.SEEK_CUR) == 0
+
+
+def test_fallback(files, monkeypatch):
+    data, fd_in, fd_out = files
+
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    monkeypatch.setattr(copy, "clone_range", unsupported)
+    monkeypatch.setattr(os, "copy_file_range", unsupported, raising=False)
+    monkeypatch.setattr(copy, "FALLBACK_CHUNK_SIZE", 1000)
+
+    assert copy.copy_file_range(fd_in, 0, fd_out, 0, len(data)) == len(data)
+    assert os.pread(fd_out, len(data) + 1, 0) == data
+
+
+def test_flags(files):
+    _, fd_in, fd_out = files
+    with pytest.raises(OSError) as e:
+        copy.copy_file_range(fd_in, 0, fd_out, 0, 10, flags=1)
+    assert e.value.errno == errno.EINVAL
+
+
+def test_overlapping_ranges(files, tmp_path):
+    data, fd_in, _ = files
+    fd = os.open(tmp_path / "src", os.O_RDWR)
+    try:
+        for fd_out, off_out in [(fd_in, 4096), (fd, 1), (fd, 0)]:
+            with pytest.raises(OSError) as e:
+                copy.copy_file_range(fd_in, 0, fd_out, off_out, 8192)
+            assert e.value.errno == errno.EINVAL
+
+        # Adjacent ranges of the same file do not overlap
+        assert copy.copy_file_range(fd_in, 0, fd, 4096, 4096) == 4096
+        assert os.pread(fd, 4096, 4096) == data[:4096]
+    finally:
+        os.close(fd)
@@ -0,0 +1,50 @@
+import errno
+
+import pytest
+
+from fuse3 import FuseOSError
+from fuse3.contrib.extents import SEEK_DATA, SEEK_HOLE, ExtentMap
+
+
+def test_add_merges():
+    extents = ExtentMap([(10, 20), (30, 40)])
+    extents.add(20, 25)
+    assert list(extents) == [(10, 25), (30, 40)]
+
+    extents.add(0, 5)
+    extents.add(22, 35)
+    assert list(extents) == [(0, 5), (10, 40)]
+    assert extents.data_size == 35
+
+
+def test_remove_splits():
+    extents = ExtentMap([(0, 100)])
+    extents.remove(10, 20)
+    extents.remove(50, 60)
+    assert list(extents) == [(0, 10), (20, 50), (60, 100)]
+
+    extents.remove(5, 65)
+    assert list(extents) == [(0, 5), (65, 100)]
+
+    extents.truncate(70)
+    assert list(extents) == [(0, 5), (65, 70)]
+    extents.truncate(3)
+    assert list(extents) == [(0, 3)]
+
+
+def test_lseek():
+    extents = ExtentMap([(4096, 8192), (16384, 20000)])
+
+    assert extents.lseek(0, SEEK_DATA, 20000) == 4096
+    assert extents.lseek(5000, SEEK_DATA, 20000) == 5000
+    assert extents.lseek(8192, SEEK_DATA, 20000) == 16384
+    assert extents.lseek(0, SEEK_HOLE, 20000) == 0
+    assert extents.lseek(4096, SEEK_HOLE, 20000) == 8192
+    assert extents.lseek(17000, SEEK_HOLE, 20000) == 20000
+    # the end of the file is an implicit hole
+    assert extents.lseek(17000, SEEK_HOLE, 18000) == 18000
+
+    for offset, whence, size in ((20000, SEEK_DATA, 20000), (9000, SEEK_DATA, 10000), (-1, SEEK_HOLE, 10)):
+        with pytest.raises(FuseOSError) as e:
+            extents.lseek(offset, whence, size)
+        assert e.value.errno == errno.ENXIO
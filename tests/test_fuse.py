@@ -0,0 +1,339 @@
+import ctypes
+import errno
+import os
+
+import pytest
+
+from fuse3 import FUSE3, OpenResult, Operations, stub
+from fuse3.c_fuse import (
+    FUSE_CAP_NO_OPEN_SUPPORT,
+    FUSE_CAP_WRITEBACK_CACHE,
+    UTIME_OMIT,
+    c_stat,
+    c_timespec,
+    c_utimbuf,
+    fuse_file_info,
+    fuse_operations,
+)
+from fuse3.contrib.loopback import Loopback
+
+
+class Minimal(Operations):
+    use_ns = True
+
+    def __init__(self):
+        self.calls = []
+
+    def init(self, path, conn=None, cfg=None):
+        self.calls.append("init")
+
+    def destroy(self, path):
+        self.calls.append("destroy")
+
+
+@pytest.fixture
+def mount_handler():
+    handlers = []
+    stub.mount_handler = lambda *args: [handler(*args) for handler in handlers]
+    yield handlers.append
+    stub.mount_handler = None
+
+
+def test_prepare_does_not_mount():
+    mounts = len(stub.mounts)
+    fuse = FUSE3.prepare(Minimal(), "/mnt", foreground=True, ro=True, uid=1000)
+
+    assert len(stub.mounts) == mounts
+    assert [arg.decode() for arg in fuse.argv] == ["fuse3", "-f", "-o", "ro,uid=1000,fsname=Minimal", "/mnt"]
+    assert fuse.fuse_ops.getattr
+    assert fuse.fuse_ops.init
+    # not implemented by Operations
+    assert not fuse.fuse_ops.lock
+
+
+def test_prepared_callbacks():
+    fuse = FUSE3.prepare(Minimal(), "/mnt")
+    st = c_stat()
+
+    assert fuse.fuse_ops.getattr(b"/", ctypes.pointer(st), None) == 0
+    assert st.st_nlink == 2
+    assert fuse.fuse_ops.getattr(b"/missing", ctypes.pointer(st), None) < 0
+
+
+def test_serve(mount_handler):
+    seen = []
+    mount_handler(lambda fuse_ops, args, conn, cfg: seen.append(fuse_ops.getattr(b"/", ctypes.pointer(c_stat()), None)))
+
+    ops = Minimal()
+    FUSE3(ops, "/mnt", foreground=True)
+
+    assert stub.mounts[-1][-1] == "/mnt"
+    assert ops.calls == ["init", "destroy"]
+    assert seen == [0]
+
+
+class Flags(Minimal):
+    def init(self, path, conn=None, cfg=None):
+        self.calls.append(bool(conn.contents.want & FUSE_CAP_WRITEBACK_CACHE))
+
+    def open(self, path, flags):
+        self.calls.append(flags)
+        return 1
+
+
+@pytest.mark.parametrize("capable", [stub.capable, 0])
+def test_writeback_cache(mount_handler, monkeypatch, capable):
+    monkeypatch.setattr(stub, "capable", capable)
+    fhs = []
+
+    def handler(fuse_ops, args, conn, cfg):
+        fi = fuse_file_info(flags=os.O_WRONLY | os.O_APPEND)
+        fuse_ops.open(b"/file", ctypes.pointer(fi))
+        fhs.append(fi.fh)
+
+    mount_handler(handler)
+    ops = Flags()
+    FUSE3(ops, "/mnt", writeback_cache=True)
+
+    assert "writeback_cache" not in stub.mounts[-1][-2]
+    assert fhs == [1]
+    if capable:
+        assert ops.calls == [True, os.O_RDWR, "destroy"]
+    else:
+        assert ops.calls == [False, os.O_WRONLY | os.O_APPEND, "destroy"]
+
+
+class Results(Minimal):
+    def open(self, path, flags):
+        return OpenResult(3, keep_cache=True, parallel_direct_writes=True, direct_io=True)
+
+    def opendir(self, path):
+        return OpenResult(4, cache_readdir=True)
+
+
+def test_open_result():
+    fuse = FUSE3.prepare(Results(), "/mnt")
+
+    fi = fuse_file_info()
+    assert fuse.fuse_ops.open(b"/file", ctypes.pointer(fi)) == 0
+    assert (fi.fh, fi.keep_cache, fi.direct_io, fi.parallel_direct_writes, fi.nonseekable) == (3, 1, 1, 1, 0)
+
+    fi = fuse_file_info()
+    assert fuse.fuse_ops.opendir(b"/", ctypes.pointer(fi)) == 0
+    assert (fi.fh, fi.cache_readdir, fi.keep_cache) == (4, 1, 0)
+
+    assert repr(OpenResult(1, noflush=True)) == "OpenResult(1, noflush=True)"
+
+
+def test_parallel_direct_writes(mount_handler):
+    seen = []
+
+    def handler(fuse_ops, args, conn, cfg):
+        fi = fuse_file_info(flags=os.O_WRONLY)
+        fuse_ops.open(b"/file", ctypes.pointer(fi))
+        seen.append((cfg.parallel_direct_writes, fi.parallel_direct_writes))
+
+    mount_handler(handler)
+    FUSE3(Flags(), "/mnt", parallel_direct_writes=True)
+
+    assert "parallel_direct_writes" not in stub.mounts[-1][-2]
+    assert seen == [(1, 1)]
+
+
+class Flushing(Minimal):
+    def flush(self, path, fh):
+        return 0
+
+    def release(self, path, fh):
+        return 0
+
+
+def test_inherited_callbacks_are_not_registered():
+    fuse_ops = FUSE3.prepare(Minimal(), "/mnt").fuse_ops
+    for name in ("flush", "release", "access", "statfs", "getxattr", "listxattr", "fsync"):
+        assert not getattr(fuse_ops, name), name
+    # libfuse fails utime(2) with ENOSYS without utimens
+    assert fuse_ops.utimens
+    assert fuse_ops.open and fuse_ops.opendir
+
+    fuse_ops = FUSE3.prepare(Flushing(), "/mnt").fuse_ops
+    assert fuse_ops.flush and fuse_ops.release
+    assert not fuse_ops.fsync
+
+
+@pytest.mark.parametrize(
+    "ops, options, no_open",
+    [
+        (Minimal(), {}, True),
+        (Flushing(), {}, False),
+        (Flags(), {}, False),
+        (Minimal(), {"direct_io": True}, False),
+        (Minimal(), {"kernel_cache": True}, False),
+        (Minimal(), {"auto_cache": True}, False),
+    ],
+)
+def test_no_open(mount_handler, ops, options, no_open):
+    seen = []
+
+    def handler(fuse_ops, args, conn, cfg):
+        seen.append(bool(conn.want & FUSE_CAP_NO_OPEN_SUPPORT))
+        seen.append(fuse_ops.open(b"/file", ctypes.pointer(fuse_file_info())))
+        # libfuse needs opendir to allocate the handle of readdir
+        seen.append(fuse_ops.opendir(b"/", ctypes.pointer(fuse_file_info())))
+
+    mount_handler(handler)
+    FUSE3(ops, "/mnt", **options)
+
+    assert seen == [no_open, -errno.ENOSYS if no_open else 0, 0]
+
+
+class Checking(Minimal):
+    def access(self, path, amode):
+        return 0
+
+
+def test_kernel_permissions():
+    assert FUSE3.prepare(Checking(), "/mnt").fuse_ops.access
+
+    fuse = FUSE3.prepare(Checking(), "/mnt", kernel_permissions=True)
+    assert not fuse.fuse_ops.access
+    assert fuse.argv[2] == b"default_permissions,fsname=Checking"
+
+
+def test_nullpath_ok(mount_handler, tmp_path):
+    seen = []
+
+    def handler(fuse_ops, args, conn, cfg):
+        seen.append((cfg.nullpath_ok, cfg.hard_remove))
+
+        fi = fuse_file_info(flags=os.O_RDWR)
+        assert fuse_ops.create(b"/file", 0o644, ctypes.pointer(fi)) == 0
+        data = (ctypes.c_byte * 4)(*b"data")
+        assert fuse_ops.write(None, ctypes.cast(data, ctypes.POINTER(ctypes.c_byte)), 4, 0, ctypes.pointer(fi)) == 4
+        assert fuse_ops.chmod(None, 0o600, ctypes.pointer(fi)) == 0
+        st = c_stat()
+        assert fuse_ops.getattr(None, ctypes.pointer(st), ctypes.pointer(fi)) == 0
+        seen.append((st.st_size, st.st_mode & 0o777))
+        assert fuse_ops.release(None, ctypes.pointer(fi)) == 0
+
+    mount_handler(handler)
+    FUSE3(Loopback(str(tmp_path)), "/mnt", nullpath_ok=True)
+
+    assert "nullpath_ok" not in stub.mounts[-1][-2]
+    assert seen == [(1, 1), (4, 0o600)]
+
+
+def test_nullpath_ok_requires_open():
+    class Stateless(Operations):
+        use_ns = True
+
+    with pytest.raises(ValueError):
+        FUSE3.prepare(Stateless(), "/mnt", nullpath_ok=True)
+
+
+def test_operations_layout():
+    # Member order of libfuse3's struct fuse_operations
+    assert [field[0] for field in fuse_operations._fields_] == (
+        "getattr readlink mknod mkdir unlink rmdir symlink rename link chmod chown truncate open read write statfs "
+        "flush release fsync setxattr getxattr listxattr removexattr opendir readdir releasedir fsyncdir init "
+        "destroy access create lock utimens bmap ioctl poll write_buf read_buf flock fallocate copy_file_range lseek"
+    ).split()
+
+
+def test_setattr_file_handles(mount_handler, tmp_path):
+    (tmp_path / "file").write_bytes(b"hello")
+    os.utime(tmp_path / "file", ns=(10**9, 10**9))
+
+    def handler(fuse_ops, args, conn, cfg):
+        fi = fuse_file_info(flags=os.O_RDWR)
+        assert fuse_ops.open(b"/file", ctypes.pointer(fi)) == 0
+        os.rename(tmp_path / "file", tmp_path / "moved")
+
+        assert fuse_ops.truncate(None, 2, ctypes.pointer(fi)) == 0
+        assert fuse_ops.chown(None, -1, -1, ctypes.pointer(fi)) == 0
+        times = c_utimbuf(c_timespec(0, UTIME_OMIT), c_timespec(5, 0))
+        assert fuse_ops.utimens(None, ctypes.pointer(times), ctypes.pointer(fi)) == 0
+        assert fuse_ops.release(None, ctypes.pointer(fi)) == 0
+
+    mount_handler(handler)
+    FUSE3(Loopback(str(tmp_path)), "/mnt", nullpath_ok=True)
+
+    st = os.stat(tmp_path / "moved")
+    assert (st.st_size, st.st_atime_ns, st.st_mtime_ns) == (2, 10**9, 5 * 10**9)
+
+
+class File:
+    def __init__(self, data):
+        self.data = data
+        self.closed = False
+
+
+class Objects(Minimal):
+    def open(self, path, flags):
+        return File(b"hello")
+
+    def create(self, path, mode, fi=None):
+        return OpenResult(File(b""), direct_io=True)
+
+    def read(self, path, size, offset, fh):
+        return fh.data[offset : offset + size]
+
+    def release(self, path, fh):
+        fh.closed = True
+
+
+class DefaultRelease(Minimal):
+    def open(self, path, flags):
+        return File(b"")
+
+    def opendir(self, path):
+        return File(b"")
+
+
+@pytest.mark.parametrize("raw_fi", [False, True])
+def test_default_release_frees_handles(raw_fi):
+    fuse = FUSE3.prepare(DefaultRelease(), "/mnt", raw_fi=raw_fi)
+    fuse_ops = fuse.fuse_ops
+    assert fuse_ops.release and fuse_ops.releasedir
+
+    fi = fuse_file_info()
+    assert fuse_ops.opendir(b"/", ctypes.pointer(fi)) == 0
+    assert len(fuse.handles) == 1
+    assert fuse_ops.releasedir(b"/", ctypes.pointer(fi)) == 0
+    assert len(fuse.handles) == 0
+
+    if not raw_fi:
+        fi = fuse_file_info()
+        assert fuse_ops.open(b"/file", ctypes.pointer(fi)) == 0
+        assert fuse_ops.release(b"/file", ctypes.pointer(fi)) == 0
+        assert len(fuse.handles) == 0
+
+    fuse = FUSE3.prepare(Minimal(), "/mnt")
+    assert not fuse.fuse_ops.release and not fuse.fuse_ops.releasedir
+
+
+def test_object_handles():
+    ops = Objects()
+    fuse = FUSE3.prepare(ops, "/mnt")
+    fuse_ops = fuse.fuse_ops
+
+    fi = fuse_file_info()
+    assert fuse_ops.open(b"/file", ctypes.pointer(fi)) == 0
+    file = fuse.handles.get(fi.fh)
+
+    buf = ctypes.create_string_buffer(8)
+    assert fuse_ops.read(b"/file", ctypes.cast(buf, ctypes.POINTER(ctypes.c_byte)), 8, 1, ctypes.pointer(fi)) == 4
+    assert buf.raw[:4] == b"ello"
+
+    assert fuse_ops.release(b"/file", ctypes.pointer(fi)) == 0
+    assert file.closed
+    assert len(fuse.handles) == 0
+    # Stale handle
+    assert (
+        fuse_ops.read(b"/file", ctypes.cast(buf, ctypes.POINTER(ctypes.c_byte)), 8, 0, ctypes.pointer(fi))
+        == -errno.EBADF
+    )
+
+    fi = fuse_file_info()
+    assert fuse_ops.create(b"/new", 0o644, ctypes.pointer(fi)) == 0
+    assert fi.direct_io and isinstance(fuse.handles.get(fi.fh), File)
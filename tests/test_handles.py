@@ -0,0 +1,49 @@
+import errno
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from fuse3.handles import HANDLE_FLAG, HandleTable
+
+
+def test_handles():
+    table = HandleTable()
+    a, b = object(), object()
+
+    fh_a = table.add(a)
+    fh_b = table.add(b)
+    assert fh_a != fh_b
+    assert fh_a & HANDLE_FLAG
+    assert table.get(fh_a) is a
+    assert table.get(fh_b) is b
+    assert len(table) == 2
+
+    assert table.remove(fh_a) is a
+    assert len(table) == 1
+
+    # The slot is reused, but the stale handle is detected
+    fh_c = table.add("c")
+    assert fh_c & 0xFFFFFFFF == fh_a & 0xFFFFFFFF
+    assert table.get(fh_c) == "c"
+    for fh in (fh_a, 12345, HANDLE_FLAG | 1 << 32 | 10**6):
+        with pytest.raises(OSError) as e:
+            table.get(fh)
+        assert e.value.errno == errno.EBADF
+    with pytest.raises(OSError):
+        table.remove(fh_a)
+
+
+def test_concurrent_handles():
+    table = HandleTable()
+
+    def worker(index):
+        for i in range(1000):
+            obj = (index, i)
+            fh = table.add(obj)
+            assert table.get(fh) is obj
+            assert table.remove(fh) is obj
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(worker, range(8)))
+
+    assert len(table) == 0
@@ -0,0 +1,54 @@
+import logging
+
+from fuse3 import LoggingMixIn, Operations
+
+
+class Payload(LoggingMixIn, Operations):
+    def read(self, path, size, offset, fh):
+        return b"\x00" * size
+
+    def write(self, path, data, offset, fh):
+        return len(data)
+
+
+def test_payload_is_summarized(caplog):
+    ops = Payload()
+    with caplog.at_level(logging.DEBUG, logger="fuse.log-mixin"):
+        assert ops("write", "/file", memoryview(b"a" * 4096), 0, 1) == 4096
+        assert ops("read", "/file", 8192, 0, 1) == b"\x00" * 8192
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages == [
+        "-> write /file ('<4096 bytes>', 0, 1)",
+        "<- write 4096",
+        "-> read /file (8192, 0, 1)",
+        "<- read '<8192 bytes>'",
+    ]
+
+
+def test_disabled_logger_skips_formatting(caplog):
+    class Unprintable:
+        def __repr__(self):
+            raise AssertionError("repr called while logging is disabled")
+
+    ops = Payload()
+    with caplog.at_level(logging.INFO, logger="fuse.log-mixin"):
+        assert ops("getattr", "/", Unprintable())
+    assert not caplog.records
+
+
+def test_op_filters(caplog):
+    ops = Payload()
+    ops.log_exclude = ("read",)
+    with caplog.at_level(logging.DEBUG, logger="fuse.log-mixin"):
+        ops("read", "/file", 1, 0, 1)
+        ops("getattr", "/")
+    assert [r.getMessage().split()[1] for r in caplog.records] == ["getattr", "getattr"]
+
+    caplog.clear()
+    ops.log_exclude = ()
+    ops.log_include = {"read"}
+    with caplog.at_level(logging.DEBUG, logger="fuse.log-mixin"):
+        ops("read", "/file", 1, 0, 1)
+        ops("getattr", "/")
+    assert [r.getMessage().split()[1] for r in caplog.records] == ["read", "read"]
@@ -0,0 +1,127 @@
+import errno
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from fuse3.contrib.extents import (
+    FALLOC_FL_KEEP_SIZE,
+    FALLOC_FL_PUNCH_HOLE,
+    SEEK_DATA,
+    SEEK_HOLE,
+)
+from fuse3.contrib.loopback import Loopback, renameat2
+
+RENAME_NOREPLACE = 1
+
+
+@pytest.fixture
+def fs(tmp_path):
+    fs = Loopback(str(tmp_path))
+    yield fs
+    fs("destroy", "/")
+
+
+def test_files(fs, tmp_path):
+    fh = fs("create", "/file", 0o644)
+    assert fs("write", "/file", b"hello world", 0, fh) == 11
+    assert fs("read", "/file", 5, 6, fh) == b"world"
+    assert fs("getattr", "/file", fh)["st_size"] == 11
+
+    fs("truncate", "/file", 5, fh)
+    fs("release", "/file", fh)
+    assert (tmp_path / "file").read_bytes() == b"hello"
+
+    fs("truncate", "/file", 2)
+    assert fs("getattr", "/file")["st_size"] == 2
+
+
+def test_directories(fs, tmp_path):
+    fs("mkdir", "/dir", 0o755)
+    fs("symlink", "/dir/link", "../file")
+    fs("release", "/dir/file", fs("create", "/dir/file", 0o644))
+    fs("link", "/dir/hard", "/dir/file")
+
+    fh = fs("opendir", "/dir")
+    assert sorted(fs("readdir", "/dir", fh, 0)) == [".", "..", "file", "hard", "link"]
+    fs("releasedir", "/dir", fh)
+
+    assert fs("readlink", "/dir/link") == "../file"
+    assert fs("getattr", "/dir/hard")["st_nlink"] == 2
+
+    fs("rename", "/dir/hard", "/moved", 0)
+    fs("unlink", "/moved")
+    fs("unlink", "/dir/file")
+    fs("unlink", "/dir/link")
+    fs("rmdir", "/dir")
+    assert os.listdir(tmp_path) == []
+
+
+def test_rename_noreplace(fs, tmp_path):
+    fs("release", "/file", fs("create", "/file", 0o644))
+    try:
+        renameat2(fs.root_fd, "file", fs.root_fd, "moved", RENAME_NOREPLACE)
+    except OSError as e:
+        pytest.skip("renameat2 flags are not supported here: %s" % e)
+
+    fs("release", "/file", fs("create", "/file", 0o644))
+    with pytest.raises(OSError) as e:
+        fs("rename", "/moved", "/file", RENAME_NOREPLACE)
+    assert e.value.errno == errno.EEXIST
+    assert sorted(os.listdir(tmp_path)) == ["file", "moved"]
+
+
+def test_setattr(fs, tmp_path):
+    fh = fs("create", "/file", 0o600)
+    fs("chmod", "/file", 0o640, fh)
+    assert fs("getattr", "/file")["st_mode"] & 0o777 == 0o640
+
+    fs("utimens", "/file", (10**9, 2 * 10**9), fh)
+    assert fs("getattr", "/file")["st_mtime"] == 2 * 10**9
+    fs("utimens", "/file", (3 * 10**9, 4 * 10**9))
+    assert fs("getattr", "/file")["st_atime"] == 3 * 10**9
+    fs("release", "/file", fh)
+
+
+def test_copy_file_range_and_lseek(fs):
+    src = fs("create", "/src", 0o644)
+    dst = fs("create", "/dst", 0o644)
+    fs("write", "/src", b"x" * 8192, 0, src)
+
+    assert fs("copy_file_range", "/src", src, 4096, "/dst", dst, 0, 4096, 0) == 4096
+    assert fs("read", "/dst", 8192, 0, dst) == b"x" * 4096
+    assert fs("lseek", "/dst", 0, os.SEEK_DATA, dst) == 0
+
+    fs("fallocate", "/dst", 0, 0, 65536, dst)
+    assert fs("getattr", "/dst", dst)["st_size"] == 65536
+
+
+def test_sparse(fs):
+    fh = fs("create", "/sparse", 0o644)
+    fs("write", "/sparse", b"x" * 65536, 0, fh)
+    try:
+        fs("fallocate", "/sparse", FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, 0, 32768, fh)
+    except OSError as e:
+        pytest.skip("punching holes is not supported here: %s" % e)
+
+    assert fs("getattr", "/sparse", fh)["st_size"] == 65536
+    assert fs("read", "/sparse", 16, 0, fh) == b"\x00" * 16
+    assert fs("lseek", "/sparse", 0, SEEK_DATA, fh) >= 4096
+    assert fs("lseek", "/sparse", 0, SEEK_HOLE, fh) == 0
+    fs("release", "/sparse", fh)
+
+
+def test_parallel_io(fs):
+    def worker(index):
+        path = "/file-%d" % index
+        fh = fs("create", path, 0o644)
+        for i in range(100):
+            fs("write", path, bytes([index]) * 512, i * 512, fh)
+        for i in range(100):
+            assert fs("read", path, 512, i * 512, fh) == bytes([index]) * 512
+        fs("release", path, fh)
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(worker, range(8)))
+
+    assert fs("getattr", "/file-7")["st_size"] == 512 * 100
@@ -0,0 +1,202 @@
+import ctypes
+import errno
+import stat
+
+import pytest
+
+from fuse3 import FUSE3, FuseOSError
+from fuse3.c_fuse import c_byte_p, c_stat, fuse_file_info
+from fuse3.contrib.extents import (
+    FALLOC_FL_KEEP_SIZE,
+    FALLOC_FL_PUNCH_HOLE,
+    SEEK_DATA,
+    SEEK_HOLE,
+)
+from fuse3.contrib.memfs import RENAME_EXCHANGE, RENAME_NOREPLACE, MemoryFS
+
+
+@pytest.fixture
+def fs():
+    return MemoryFS(chunk_size=1024)
+
+
+def test_tree(fs):
+    fs("mkdir", "/a", 0o755)
+    fs("mkdir", "/a/b", 0o700)
+    fs("create", "/a/b/file", 0o644)
+
+    assert fs("readdir", "/a", 0, 0) == [".", "..", "b"]
+    assert fs("getattr", "/a")["st_nlink"] == 3
+    assert stat.S_ISREG(fs("getattr", "/a/b/file")["st_mode"])
+
+    with pytest.raises(FuseOSError) as e:
+        fs("rmdir", "/a/b")
+    assert e.value.errno == errno.ENOTEMPTY
+
+    with pytest.raises(FuseOSError) as e:
+        fs("getattr", "/a/b/file/x")
+    assert e.value.errno == errno.ENOTDIR
+
+    fs("rename", "/a/b", "/c", 0)
+    assert fs("readdir", "/", 0, 0) == [".", "..", "a", "c"]
+    assert fs("getattr", "/a")["st_nlink"] == 2
+    assert fs("getattr", "/c/file")
+
+
+def test_rename_noreplace(fs):
+    fs("create", "/x", 0o644)
+    fs("create", "/y", 0o644)
+    with pytest.raises(FuseOSError) as e:
+        fs("rename", "/x", "/y", RENAME_NOREPLACE)
+    assert e.value.errno == errno.EEXIST
+
+    fs("rename", "/x", "/y", 0)
+    assert fs("readdir", "/", 0, 0) == [".", "..", "y"]
+
+
+def test_rename_exchange(fs):
+    fs("mkdir", "/a", 0o755)
+    fs("mkdir", "/a/dir", 0o755)
+    fs("mkdir", "/b", 0o755)
+    fs("create", "/b/file", 0o644)
+
+    fs("rename", "/a/dir", "/b/file", RENAME_EXCHANGE)
+    assert stat.S_ISREG(fs("getattr", "/a/dir")["st_mode"])
+    assert stat.S_ISDIR(fs("getattr", "/b/file")["st_mode"])
+    assert fs("getattr", "/a")["st_nlink"] == 2
+    assert fs("getattr", "/b")["st_nlink"] == 3
+
+    with pytest.raises(FuseOSError) as e:
+        fs("rename", "/b/file/x", "/b", RENAME_EXCHANGE)
+    assert e.value.errno == errno.ENOENT
+    fs("mkdir", "/b/file/x", 0o755)
+    with pytest.raises(FuseOSError) as e:
+        fs("rename", "/b/file/x", "/b", RENAME_EXCHANGE)
+    assert e.value.errno == errno.EINVAL
+
+
+def test_append_and_read(fs):
+    fs("create", "/f", 0o644)
+    expected = bytearray()
+    for i in range(50):
+        block = bytes([i]) * 100
+        fs("write", "/f", block, len(expected), 0)
+        expected += block
+
+    assert fs("getattr", "/f")["st_size"] == len(expected)
+    assert bytes(fs("read", "/f", 10000, 0, 0)) == expected
+    assert bytes(fs("read", "/f", 300, 950, 0)) == expected[950:1250]
+
+    # reads within a chunk are not copied
+    assert isinstance(fs("read", "/f", 100, 1024, 0), memoryview)
+
+
+def test_chunk_growth_is_geometric(fs):
+    fs("create", "/f", 0o644)
+    node = fs.root.children["f"]
+    sizes = []
+    for offset in range(0, 1024, 16):
+        fs("write", "/f", b"x" * 16, offset, 0)
+        if len(node.chunks[0]) not in sizes:
+            sizes.append(len(node.chunks[0]))
+    assert sizes == [16, 32, 64, 128, 256, 512, 1024]
+
+
+def test_sparse(fs):
+    fs("create", "/f", 0o644)
+    fs("write", "/f", b"end", 10 * 1024, 0)
+
+    attrs = fs("getattr", "/f")
+    assert attrs["st_size"] == 10 * 1024 + 3
+    assert attrs["st_blocks"] * 512 < 2048
+    assert bytes(fs("read", "/f", 4, 5000, 0)) == b"\x00" * 4
+    assert bytes(fs("read", "/f", 6, 10 * 1024 - 3, 0)) == b"\x00\x00\x00end"
+
+
+def test_truncate(fs):
+    fs("create", "/f", 0o644)
+    fs("write", "/f", b"a" * 3000, 0, 0)
+    view = fs("read", "/f", 100, 2048, 0)
+
+    fs("truncate", "/f", 2100)
+    fs("truncate", "/f", 3000)
+    assert bytes(fs("read", "/f", 3000, 0, 0)) == b"a" * 2100 + b"\x00" * 900
+    # views handed out earlier are unaffected
+    assert bytes(view) == b"a" * 100
+
+
+def test_enospc(fs):
+    fs.max_size = 2048
+    fs("create", "/f", 0o644)
+    fs("write", "/f", b"a" * 2048, 0, 0)
+
+    with pytest.raises(FuseOSError) as e:
+        fs("write", "/f", b"b", 2048, 0)
+    assert e.value.errno == errno.ENOSPC
+    assert fs("getattr", "/f")["st_size"] == 2048
+
+    fs("unlink", "/f")
+    assert fs.used == 0
+
+
+def test_hard_links(fs):
+    fs("create", "/f", 0o644)
+    fs("write", "/f", b"data", 0, 0)
+    fs("link", "/g", "/f")
+    fs("unlink", "/f")
+
+    assert fs("getattr", "/g")["st_nlink"] == 1
+    assert bytes(fs("read", "/g", 4, 0, 0)) == b"data"
+
+
+def test_read_through_fuse(fs):
+    fuse = FUSE3.prepare(fs, "/mnt")
+    fs("create", "/f", 0o644)
+    fs("write", "/f", b"0123456789" * 300, 0, 0)
+
+    buf = ctypes.create_string_buffer(2000)
+    fip = ctypes.pointer(fuse_file_info())
+    assert fuse.fuse_ops.read(b"/f", ctypes.cast(buf, c_byte_p), 10, 1024, fip) == 10
+    assert buf.raw[:10] == b"4567890123"
+    assert fuse.fuse_ops.read(b"/f", ctypes.cast(buf, c_byte_p), 2000, 0, fip) == 2000
+    assert buf.raw == (b"0123456789" * 200)
+
+    st = c_stat()
+    assert fuse.fuse_ops.getattr(b"/f", ctypes.pointer(st), None) == 0
+    assert st.st_size == 3000
+
+
+def test_seek_data_and_punch_hole(fs):
+    fs("create", "/f", 0o644)
+    fs("write", "/f", b"a" * 4096, 0, 0)
+    fs("write", "/f", b"b" * 100, 8192, 0)
+
+    assert fs("lseek", "/f", 0, SEEK_HOLE, 0) == 4096
+    assert fs("lseek", "/f", 4096, SEEK_DATA, 0) == 8192
+
+    fs("fallocate", "/f", FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, 1024, 2048, 0)
+    assert fs("getattr", "/f")["st_size"] == 8292
+    assert bytes(fs("read", "/f", 4096, 0, 0)) == b"a" * 1024 + b"\x00" * 2048 + b"a" * 1024
+    assert fs("lseek", "/f", 0, SEEK_HOLE, 0) == 1024
+    assert fs("lseek", "/f", 1024, SEEK_DATA, 0) == 3072
+
+    # whole chunks are released
+    used = fs.used
+    fs("fallocate", "/f", FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, 0, 4096, 0)
+    assert fs.used < used
+    assert fs("lseek", "/f", 0, SEEK_DATA, 0) == 8192
+
+    with pytest.raises(FuseOSError) as e:
+        fs("fallocate", "/f", FALLOC_FL_PUNCH_HOLE, 0, 10, 0)
+    assert e.value.errno == errno.EOPNOTSUPP
+
+
+def test_fallocate(fs):
+    fs.max_size = 4096
+    fs("create", "/f", 0o644)
+    fs("fallocate", "/f", 0, 0, 3000, 0)
+    assert fs("getattr", "/f")["st_size"] == 3000
+
+    with pytest.raises(FuseOSError) as e:
+        fs("fallocate", "/f", FALLOC_FL_KEEP_SIZE, 3000, 2000, 0)
+    assert e.value.errno == errno.ENOSPC
@@ -0,0 +1,94 @@
+import ctypes
+import errno
+import time
+
+import pytest
+
+from fuse3 import FUSE3, Operations, stub
+from fuse3.c_fuse import fuse_file_info
+from fuse3.contrib import ratelimit
+from fuse3.contrib.ratelimit import RateLimitMixIn
+
+
+class Backend(Operations):
+    use_ns = True
+
+    def read(self, path, size, offset, fh):
+        return bytes(size)
+
+    def write(self, path, data, offset, fh):
+        return len(data)
+
+
+class Limited(RateLimitMixIn, Backend):
+    read_rate = 1000
+    rate_burst = 0.1
+    rate_limits = {2: {"read": None}}
+
+
+@pytest.fixture
+def fs():
+    fs = Limited()
+    fuse = FUSE3.prepare(fs, "/mnt")
+
+    def read(uid, size):
+        stub.set_context(uid=uid)
+        buf = ctypes.create_string_buffer(size)
+        try:
+            return fuse._wrapper(fuse.read, b"/", buf, size, 0, ctypes.pointer(fuse_file_info()))
+        finally:
+            stub.set_context()
+
+    fs.read_as = read
+    return fs
+
+
+def test_rate_limit(fs):
+    # A burst of 100 bytes passes, the next 50 bytes wait 50ms
+    assert fs.read_as(1, 100) == 100
+    start = time.monotonic()
+    assert fs.read_as(1, 50) == 50
+    assert time.monotonic() - start >= 0.04
+    assert fs.rate_limit_stats()[1]["delayed"] == 1
+
+    # Other tenants have buckets of their own, or no limit
+    assert fs.read_as(3, 100) == 100
+    assert fs.read_as(2, 1000) == fs.read_as(2, 1000) == 1000
+    assert fs("write", "/", b"x" * 1000, 0, 0) == 1000
+    assert set(fs.rate_limit_stats()) == {1}
+
+
+def test_set_rate_limit(fs):
+    fs.set_rate_limit(1, read=None)
+    assert fs.read_as(1, 1000) == fs.read_as(1, 1000) == 1000
+
+    fs.set_rate_limit(ops=10)
+    assert fs.read_as(2, 1) == 1
+    assert fs.ops_rate == 10 and fs.rate_limits[2] == {"read": None}
+    assert Limited.ops_rate is None
+    with pytest.raises(ValueError):
+        fs.set_rate_limit(1, reads=1)
+
+
+def test_interrupted(fs):
+    assert fs.read_as(4, 100) == 100
+    stub.set_interrupted()
+    try:
+        start = time.monotonic()
+        assert fs.read_as(4, 10000) == -errno.EINTR
+        assert time.monotonic() - start < 1
+    finally:
+        stub.set_interrupted(False)
+
+
+def test_idle_tenants_expire(fs, monkeypatch):
+    monkeypatch.setattr(ratelimit, "_EXPIRE_INTERVAL", 0)
+    for uid in range(10, 13):
+        assert fs.read_as(uid, 150) == 150
+    assert 12 in fs.rate_limit_stats()
+
+    # Once refilled, buckets and delays of idle tenants are dropped
+    time.sleep(0.2)
+    assert fs.read_as(1, 10) == 10
+    assert list(fs._buckets) == [(1, "read")]
+    assert fs.rate_limit_stats() == {}
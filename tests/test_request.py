@@ -0,0 +1,86 @@
+import ctypes
+import errno
+import json
+import threading
+
+from fuse3 import FUSE3, Operations, current_request, is_interrupted, stub
+from fuse3.c_fuse import c_stat
+from fuse3.trace import ChromeTracer
+
+
+class Recorder(Operations):
+    use_ns = True
+
+    def __init__(self):
+        self.requests = []
+
+    def getattr(self, path, fh=None):
+        self.requests.append(current_request())
+        return super().getattr(path, fh)
+
+
+def make_fuse(operations, tracer=None):
+    return FUSE3.prepare(operations, "/mnt", tracer=tracer)
+
+
+def test_current_request():
+    ops = Recorder()
+    fuse = make_fuse(ops)
+
+    assert current_request() is None
+    assert fuse._wrapper(fuse.getattr, b"/", ctypes.pointer(c_stat()), None) == 0
+    assert fuse._wrapper(fuse.getattr, b"/", ctypes.pointer(c_stat()), None) == 0
+    assert current_request() is None
+
+    first, second = ops.requests
+    assert first.op == second.op == "getattr"
+    assert second.id > first.id
+    assert second.start >= first.start
+    assert isinstance(first.uid, int)
+    assert isinstance(first.pid, int)
+
+
+def test_chrome_tracer(tmp_path):
+    path = tmp_path / "trace.json"
+    with ChromeTracer(path) as tracer:
+        fuse = make_fuse(Recorder(), tracer=tracer)
+        fuse._wrapper(fuse.getattr, b"/", ctypes.pointer(c_stat()), None)
+        fuse._wrapper(fuse.getattr, b"/missing", ctypes.pointer(c_stat()), None)
+
+    events = json.loads(path.read_text())
+    assert [event["name"] for event in events] == ["getattr", "getattr"]
+    assert [event["args"]["result"] for event in events][1] < 0
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+
+
+class Interruptible(Operations):
+    use_ns = True
+
+    def __init__(self):
+        self.seen = []
+
+    def getattr(self, path, fh=None):
+        request = current_request()
+        other = threading.Thread(target=lambda: self.seen.append(request.interrupted))
+        other.start()
+        other.join()
+        self.seen.append(is_interrupted())
+        request.check_interrupted()
+        return super().getattr(path, fh)
+
+
+def test_interrupted():
+    ops = Interruptible()
+    fuse = FUSE3.prepare(ops, "/mnt", intr=True)
+    assert b"intr" in fuse.argv[2].split(b",")
+    assert not is_interrupted()
+
+    assert fuse._wrapper(fuse.getattr, b"/", ctypes.pointer(c_stat()), None) == 0
+    stub.set_interrupted()
+    try:
+        assert fuse._wrapper(fuse.getattr, b"/", ctypes.pointer(c_stat()), None) == -errno.EINTR
+    finally:
+        stub.set_interrupted(False)
+
+    # Other threads only see the interruption once the request thread has
+    assert ops.seen == [False, False, False, True]
@@ -0,0 +1,394 @@
+import collections
+import errno
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from fuse3.contrib.sftp import SFTP, ChannelPool, _drain
+
+
+class FakeFile:
+    """
+    Stands in for paramiko.SFTPFile, with pipelined writes acknowledged on
+    demand
+    """
+
+    def __init__(self, sftp, path, mode):
+        flags = {
+            "r": os.O_RDONLY,
+            "r+": os.O_RDWR,
+            "w": os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+            "w+": os.O_RDWR | os.O_CREAT | os.O_TRUNC,
+            "a": os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+            "a+": os.O_RDWR | os.O_CREAT | os.O_APPEND,
+        }
+        self.sftp = sftp
+        self.fd = os.open(path, flags[mode], 0o644)
+        self.pos = 0
+        self.pipelined = False
+        self.prefetched = False
+        self._reqs = collections.deque()
+
+    def set_pipelined(self, pipelined=True):
+        self.pipelined = pipelined
+
+    def prefetch(self, file_size=None):
+        self.prefetched = True
+
+    def seek(self, offset):
+        self.pos = offset
+
+    def read(self, size):
+        self.sftp._request()
+        data = os.pread(self.fd, size, self.pos)
+        self.pos += len(data)
+        return data
+
+    def write(self, data):
+        if self.sftp.fail_writes:
+            error = OSError(errno.ENOSPC, "No space left on device")
+        else:
+            os.pwrite(self.fd, data, self.pos)
+            error = None
+        self.pos += len(data)
+        num = next(self.sftp.nums)
+        self.sftp.pending[num] = error
+        self._reqs.append(num)
+        if not self.pipelined:
+            self.flush()
+            self.sftp._read_response(self._reqs.popleft())
+
+    def flush(self):
+        pass
+
+    def stat(self):
+        self.sftp._request()
+        return os.fstat(self.fd)
+
+    def chmod(self, mode):
+        self.sftp._request()
+        os.fchmod(self.fd, mode)
+
+    def utime(self, times):
+        self.sftp._request()
+        os.utime(self.fd, times)
+
+    def truncate(self, size):
+        self.sftp._request()
+        os.ftruncate(self.fd, size)
+
+    def close(self):
+        self.sftp._request()
+        os.close(self.fd)
+
+
+class FakeSFTPClient:
+    "Stands in for paramiko.SFTPClient, serving the local directory root"
+
+    def __init__(self, root):
+        self.root = root
+        self.fail_writes = False
+        self.closed = False
+        self.nums = itertools.count()
+        self.pending = {}
+
+    def _path(self, path):
+        self._request()
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def _request(self):
+        # Like paramiko, waiting for a response reads all outstanding ones,
+        # dropping the statuses of pipelined writes
+        self.pending.clear()
+
+    def _read_response(self, num):
+        if num not in self.pending:
+            raise AssertionError("response #%d was already read, paramiko would wait forever" % num)
+        error = self.pending.pop(num)
+        if error is not None:
+            raise error
+
+    def open(self, path, mode="r", bufsize=-1):
+        return FakeFile(self, self._path(path), mode)
+
+    def lstat(self, path):
+        return os.lstat(self._path(path))
+
+    def stat(self, path):
+        return os.stat(self._path(path))
+
+    def listdir(self, path):
+        return os.listdir(self._path(path))
+
+    def readlink(self, path):
+        return os.readlink(self._path(path))
+
+    def mkdir(self, path, mode=0o777):
+        os.mkdir(self._path(path), mode)
+
+    def rmdir(self, path):
+        os.rmdir(self._path(path))
+
+    def remove(self, path):
+        os.unlink(self._path(path))
+
+    def symlink(self, source, dest):
+        os.symlink(source, self._path(dest))
+
+    def posix_rename(self, old, new):
+        os.rename(self._path(old), self._path(new))
+
+    def chmod(self, path, mode):
+        os.chmod(self._path(path), mode)
+
+    def utime(self, path, times):
+        os.utime(self._path(path), times)
+
+    def truncate(self, path, size):
+        os.truncate(self._path(path), size)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def clients():
+    return []
+
+
+@pytest.fixture
+def fs(tmp_path, clients):
+    def connect():
+        client = FakeSFTPClient(str(tmp_path))
+        clients.append(client)
+        return client
+
+    fs = SFTP(connect=connect, pool_size=4)
+    yield fs
+    fs("destroy", "/")
+
+
+def test_channel_pool():
+    created = []
+    pool = ChannelPool(lambda: created.append(object()) or created[-1], size=2)
+
+    with pool.channel() as a, pool.channel() as b:
+        assert a is not b
+    with pool.channel() as c:
+        assert c in (a, b)
+    assert len(created) == 2
+
+    # Failed requests return the channel, other errors (SFTPError,
+    # EOFError...) retire it
+    with pytest.raises(OSError):
+        with pool.channel() as c:
+            raise OSError(errno.ENOENT, "No such file")
+    with pytest.raises(EOFError):
+        with pool.channel() as d:
+            raise EOFError()
+    assert c is d
+    with pool.channel() as e, pool.channel() as f:
+        assert d not in (e, f)
+    assert len(created) == 3
+
+
+def test_channel_pool_checkout():
+    created = []
+    settled = []
+    pool = ChannelPool(lambda: created.append(object()) or created[-1], size=2, settle=settled.append)
+
+    # Open files get channels of their own up to size, then share them
+    a = pool.checkout()
+    b = pool.checkout()
+    assert a is not b
+    c = pool.checkout()
+    assert c in (a, b)
+    with pool.channel() as client:
+        assert client in created
+    assert len(created) == 2
+
+    # Requests wait for the channel to be idle
+    entered = threading.Event()
+    with pool.use(a, "owner") as client:
+        assert client is a.client
+
+        def request():
+            with pool.use(a):
+                entered.set()
+
+        thread = threading.Thread(target=request)
+        thread.start()
+        assert not entered.wait(0.05)
+    thread.join()
+    assert entered.is_set() and not a.busy
+
+    # Pipelined writes are settled before anything else uses the channel
+    a.dirty = "owner"
+    with pool.use(a, "owner", pipelined=True):
+        assert settled == []
+    with pool.use(a, "owner"):
+        assert settled == ["owner"] and a.dirty is None
+
+    for channel in (a, b, c):
+        pool.checkin(channel)
+    assert [channel.files for channel in (a, b)] == [0, 0]
+
+
+def test_files(fs, tmp_path):
+    fh = fs("create", "/file", 0o640)
+    other = fs("open", "/file", os.O_RDONLY)
+    # Open files have a channel of their own while below pool_size
+    assert fs._handles[fh].channel is not fs._handles[other].channel
+    assert fs._handles[fh].file.sftp is fs._handles[fh].channel.client
+    fs("release", "/file", other)
+    assert fs("write", "/file", b"hello world", 0, fh) == 11
+    fs("flush", "/file", fh)
+    assert fs("getattr", "/file", fh)["st_size"] == 11
+    assert fs("getattr", "/file")["st_mode"] & 0o777 == 0o640
+    fs("release", "/file", fh)
+
+    fh = fs("open", "/file", os.O_RDONLY)
+    assert [fs("read", "/file", 4, offset, fh) for offset in (0, 4, 8, 2)] == [b"hell", b"o wo", b"rld", b"llo "]
+    assert fs._handles[fh].file.prefetched
+    fs("utimens", None, (10**9, 3 * 10**9), fh)
+    assert fs("getattr", "/file")["st_mtime"] == 3 * 10**9
+    fs("release", "/file", fh)
+
+    fs("truncate", "/file", 5)
+    fs("utimens", "/file", (10**9, 2 * 10**9))
+    assert fs("getattr", "/file")["st_mtime"] == 2 * 10**9
+    assert (tmp_path / "file").read_bytes() == b"hello"
+
+
+def test_open_keeps_contents(fs, tmp_path):
+    (tmp_path / "file").write_bytes(b"0123456789")
+    fh = fs("open", "/file", os.O_WRONLY)
+    fs("write", "/file", b"ab", 4, fh)
+    fs("release", "/file", fh)
+    assert (tmp_path / "file").read_bytes() == b"0123ab6789"
+
+
+def test_directories(fs, tmp_path):
+    fs("mkdir", "/dir", 0o755)
+    fs("symlink", "/dir/link", "target")
+    assert sorted(fs("readdir", "/dir", 0, 0)) == [".", "..", "link"]
+    assert fs("readlink", "/dir/link") == "target"
+    fs("rename", "/dir/link", "/link", 0)
+    fs("unlink", "/link")
+    fs("rmdir", "/dir")
+    assert os.listdir(tmp_path) == []
+
+    with pytest.raises(OSError) as e:
+        fs("getattr", "/missing")
+    assert e.value.errno == errno.ENOENT
+
+
+def test_pipelined_write_errors(fs, clients):
+    fh = fs("create", "/file", 0o644)
+    assert fs._handles[fh].file.pipelined
+
+    clients[0].fail_writes = True
+    assert fs("write", "/file", b"data", 0, fh) == 4
+    with pytest.raises(OSError) as e:
+        fs("flush", "/file", fh)
+    assert e.value.errno == errno.ENOSPC
+    fs("release", "/file", fh)
+
+
+def test_parallel_io(fs, clients):
+    barrier = threading.Barrier(4)
+
+    def worker(index):
+        path = "/file-%d" % index
+        fh = fs("create", path, 0o644)
+        barrier.wait()
+        for i in range(50):
+            fs("write", path, bytes([index]) * 512, i * 512, fh)
+        fs("flush", path, fh)
+        for i in range(50):
+            assert fs("read", path, 512, i * 512, fh) == bytes([index]) * 512
+        fs("release", path, fh)
+
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(worker, range(4)))
+
+    # One channel per open file, shared with the other operations
+    assert len(clients) == 4
+    assert fs("getattr", "/file-3")["st_size"] == 512 * 50
+
+
+def test_shared_channels(tmp_path, clients):
+    def connect():
+        client = FakeSFTPClient(str(tmp_path))
+        clients.append(client)
+        return client
+
+    fs = SFTP(connect=connect, pool_size=2)
+    fhs = {"/file-%d" % i: fs("create", "/file-%d" % i, 0o644) for i in range(5)}
+    assert len(clients) == 2
+
+    # Pipelined writes survive requests of other files on their channel
+    for i in range(3):
+        for path, fh in fhs.items():
+            fs("write", path, path.encode(), i * 7, fh)
+            fs("getattr", path, fh)
+            fs("read", path, 7, 0, fh)
+    clients[0].fail_writes = True
+    path, fh = next(iter(fhs.items()))
+    fs("write", path, b"x", 0, fh)
+    other = next(other for other, h in fhs.items() if fs._handles[h].channel is fs._handles[fh].channel and h != fh)
+    fs("getattr", other)
+    fs("getattr", other, fhs[other])
+    with pytest.raises(OSError) as e:
+        fs("flush", path, fh)
+    assert e.value.errno == errno.ENOSPC
+    clients[0].fail_writes = False
+
+    for path, fh in fhs.items():
+        fs("release", path, fh)
+        assert (tmp_path / path[1:]).read_bytes() == path.encode() * 3
+    fs("destroy", "/")
+    assert len(clients) == 2
+
+
+def test_no_prefetch_when_writable(fs, tmp_path):
+    (tmp_path / "file").write_bytes(b"data")
+    fh = fs("open", "/file", os.O_RDWR)
+    for _ in range(4):
+        assert fs("read", "/file", 4, 0, fh) == b"data"
+    assert not fs._handles[fh].file.prefetched
+    fs("release", "/file", fh)
+
+
+def test_paramiko_internals():
+    # _drain relies on these paramiko internals
+    paramiko = pytest.importorskip("paramiko")
+
+    class Client:
+        def __init__(self):
+            self.requests = []
+
+        def _async_request(self, fileobj, t, *args):
+            self.requests.append(args)
+            return len(self.requests)
+
+        def _read_response(self, num):
+            if num == 1:
+                raise IOError(errno.ENOSPC, "No space left on device")
+
+        def _finish_responses(self, fileobj):
+            pass
+
+        def _log(self, *args):
+            pass
+
+    assert callable(paramiko.SFTPClient._read_response)
+    file = paramiko.SFTPFile(Client(), b"handle", "w", bufsize=0)
+    file.set_pipelined(True)
+    file.write(b"x" * (file.MAX_REQUEST_SIZE + 1))
+    assert len(file._reqs) == 2
+    assert _drain(file).errno == errno.ENOSPC
+    assert not file._reqs
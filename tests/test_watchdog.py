@@ -0,0 +1,114 @@
+import ctypes
+import errno
+import threading
+import time
+
+import pytest
+
+from fuse3 import FUSE3, OpenResult, Operations, current_request, stub
+from fuse3.c_fuse import fuse_file_info
+
+
+class Hanging(Operations):
+    use_ns = True
+
+    def __init__(self):
+        self.unblock = threading.Event()
+        self.requests = []
+        self.interrupted = []
+        self.released = []
+
+    def getattr(self, path, fh=None):
+        request = current_request()
+        self.requests.append((request, request.uid, threading.current_thread().name))
+        if path == "/hang":
+            self.unblock.wait()
+            self.interrupted.append(request.interrupted)
+        if path == "/poll":
+            while not request.interrupted:
+                time.sleep(0.01)
+            request.check_interrupted()
+        return super().getattr(path, fh)
+
+    def open(self, path, flags):
+        self.unblock.wait()
+        return OpenResult(7, direct_io=True)
+
+    def opendir(self, path):
+        self.unblock.wait()
+        return 8
+
+    def release(self, path, fh):
+        self.released.append((path, fh))
+
+    def releasedir(self, path, fh):
+        self.released.append((path, fh))
+
+    def readdir(self, path, fh, flags):
+        yield "."
+        self.unblock.wait()
+        yield ".."
+
+
+def test_watchdog(call_getattr, wait_for):
+    ops = Hanging()
+    fuse = FUSE3.prepare(ops, "/mnt", op_timeout=0.2, op_timeouts={"readdir": 0.2, "statfs": None})
+    watchdog = fuse.watchdog
+
+    assert call_getattr(fuse, b"/") == 0
+    request, uid, thread = ops.requests[-1]
+    assert request.op == "getattr" and isinstance(uid, int)
+    assert thread.startswith("fuse-watchdog")
+
+    assert call_getattr(fuse, b"/hang") == -errno.ETIMEDOUT
+    assert fuse._wrapper(fuse.readdir, b"/", None, None, 0, ctypes.pointer(fuse_file_info()), 0) == -errno.ETIMEDOUT
+    assert watchdog.timed_out == {"getattr": 1, "readdir": 1}
+    assert watchdog.stuck == 2
+
+    # Other requests are still served
+    assert call_getattr(fuse, b"/") == 0
+
+    ops.unblock.set()
+    wait_for(lambda: watchdog.stuck == 0)
+    assert ops.interrupted == [True]
+    watchdog.close()
+
+
+def test_watchdog_options(call_getattr):
+    fuse = FUSE3.prepare(Hanging(), "/mnt", op_timeouts={"getattr": 0.2}, op_timeout_errno=errno.EIO)
+    fuse.operations.unblock.set()
+    assert call_getattr(fuse, b"/hang") == -errno.ENOENT
+    fuse.operations.unblock.clear()
+    assert call_getattr(fuse, b"/hang") == -errno.EIO
+    fuse.operations.unblock.set()
+    fuse.watchdog.close()
+
+    assert FUSE3.prepare(Hanging(), "/mnt").watchdog is None
+    with pytest.raises(ValueError):
+        FUSE3.prepare(Hanging(), "/mnt", raw_fi=True, op_timeout=1)
+
+
+def test_late_handles_are_released(wait_for):
+    ops = Hanging()
+    fuse = FUSE3.prepare(ops, "/mnt", op_timeout=0.1)
+
+    assert fuse._wrapper(fuse.open, b"/file", ctypes.pointer(fuse_file_info())) == -errno.ETIMEDOUT
+    assert fuse._wrapper(fuse.opendir, b"/dir", ctypes.pointer(fuse_file_info())) == -errno.ETIMEDOUT
+    ops.unblock.set()
+    wait_for(lambda: len(ops.released) == 2)
+    assert sorted(ops.released) == [("/dir", 8), ("/file", 7)]
+    assert len(fuse.handles) == 0
+    fuse.watchdog.close()
+
+
+def test_interruption_reaches_worker(call_getattr):
+    fuse = FUSE3.prepare(Hanging(), "/mnt", op_timeout=5)
+    stub.set_interrupted()
+    try:
+        start = time.monotonic()
+        assert call_getattr(fuse, b"/poll") == -errno.EINTR
+        assert time.monotonic() - start < 2
+        assert fuse.watchdog.timed_out == {}
+    finally:
+        stub.set_interrupted(False)
+        fuse.watchdog.close()
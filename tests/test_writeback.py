@@ -0,0 +1,165 @@
+import errno
+import os
+import time
+
+import pytest
+
+from fuse3.contrib.memfs import MemoryFS
+from fuse3.contrib.writeback import WriteBackMixIn
+from fuse3.fuse import FuseOSError, Operations
+
+
+class Backend(Operations):
+    "Records every write, failing them while fail is set"
+
+    def __init__(self):
+        self.data = bytearray()
+        self.writes = []
+        self.fail = False
+
+    def open(self, path, flags):
+        return 1
+
+    def create(self, path, mode, fi=None):
+        return 2
+
+    def getattr(self, path, fh=None):
+        return dict(st_size=len(self.data))
+
+    def read(self, path, size, offset, fh):
+        return bytes(self.data[offset : offset + size])
+
+    def write(self, path, data, offset, fh):
+        if self.fail:
+            raise FuseOSError(errno.ENOSPC)
+        self.writes.append((offset, len(data)))
+        self.data[offset : offset + len(data)] = data
+        return len(data)
+
+
+class Buffered(WriteBackMixIn, Backend):
+    writeback_size = 64
+    writeback_delay = None
+
+
+@pytest.fixture
+def fs():
+    fs = Buffered()
+    yield fs
+    fs("destroy", "/")
+
+
+def test_coalescing(fs):
+    fh = fs("open", "/file", 0)
+    for offset in range(0, 96, 8):
+        assert fs("write", "/file", b"x" * 8, offset, fh) == 8
+    assert fs.writes == [(0, 64)]
+
+    # A write elsewhere writes the buffer first
+    fs("write", "/file", b"y" * 8, 200, fh)
+    assert fs.writes == [(0, 64), (64, 32)]
+
+    fs("flush", "/file", fh)
+    assert fs.writes == [(0, 64), (64, 32), (200, 8)]
+
+
+def test_consistency(fs):
+    fh = fs("create", "/file", 0o644)
+    fs("write", "/file", b"hello", 0, fh)
+    assert fs.writes == []
+    assert fs("getattr", "/file")["st_size"] == 5
+    fs("write", "/file", b" world", 5, fh)
+    assert fs("read", "/file", 11, 0, fh) == b"hello world"
+    fs("release", "/file", fh)
+    assert fs.writes == [(0, 5), (5, 6)]
+
+
+def test_writeback_first():
+    class Seekable(Backend):
+        def lseek(self, path, off, whence, fh):
+            return len(self.data)
+
+        def fallocate(self, path, mode, offset, length, fh):
+            self.allocated = bytes(self.data)
+
+        def copy_file_range(self, path_in, fh_in, off_in, path_out, fh_out, off_out, size, flags):
+            return len(self.data[off_in : off_in + size])
+
+    class BufferedSeekable(WriteBackMixIn, Seekable):
+        writeback_size = 64
+        writeback_delay = None
+
+    fs = BufferedSeekable()
+    fh = fs("open", "/file", 0)
+    fs("write", "/file", b"data", 0, fh)
+    assert fs("lseek", "/file", 0, os.SEEK_END, fh) == 4
+    fs("write", "/file", b"more", 4, fh)
+    fs("fallocate", None, 0, 0, 16, fh)
+    assert fs.allocated == b"datamore"
+    fs("write", "/file", b"!", 8, fh)
+    assert fs("copy_file_range", "/file", fh, 0, "/copy", 2, 0, 16, 0) == 9
+    fs("destroy", "/")
+
+
+def test_missing_operations(fs):
+    fh = fs("open", "/file", 0)
+    fs("write", "/file", b"data", 0, fh)
+    with pytest.raises(OSError) as e:
+        fs("lseek", "/file", 0, os.SEEK_END, fh)
+    assert e.value.errno == errno.ENOSYS
+    assert fs.writes == [(0, 4)]
+
+
+def test_shared_file_handles():
+    class BufferedMemory(WriteBackMixIn, MemoryFS):
+        writeback_delay = None
+
+    fs = BufferedMemory()
+    # MemoryFS returns 0 for every open file
+    a = fs("create", "/a", 0o644)
+    b = fs("create", "/b", 0o644)
+    assert a == b
+    fs("write", "/a", b"AAAA", 0, a)
+    fs("write", "/b", b"BBBB", 0, b)
+    fs("flush", "/a", a)
+    fs("flush", "/b", b)
+    assert bytes(fs("read", "/a", 4, 0, a)) == b"AAAA"
+    assert bytes(fs("read", "/b", 4, 0, b)) == b"BBBB"
+
+    fs("release", "/a", a)
+    assert fs._buffers[b].opens == 1
+    fs("release", "/b", b)
+    assert fs._buffers == {}
+    fs("destroy", "/")
+
+
+def test_errors(fs):
+    fh = fs("open", "/file", 0)
+    fs.fail = True
+    assert fs("write", "/file", b"data", 0, fh) == 4
+
+    with pytest.raises(OSError) as e:
+        fs("fsync", "/file", 0, fh)
+    assert e.value.errno == errno.ENOSPC
+    fs("flush", "/file", fh)
+
+    fs("write", "/file", b"data", 0, fh)
+    with pytest.raises(OSError) as e:
+        fs("release", "/file", fh)
+    assert e.value.errno == errno.ENOSPC
+    assert fs._buffers == {}
+
+
+def test_delay():
+    class Delayed(Buffered):
+        writeback_delay = 0.02
+
+    fs = Delayed()
+    fh = fs("open", "/file", 0)
+    fs("write", "/file", b"data", 0, fh)
+    for _ in range(100):
+        if fs.writes:
+            break
+        time.sleep(0.01)
+    fs("destroy", "/")
+    assert fs.writes == [(0, 4)]